@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Benchmarks do gguf_loader (sem Kivy e sem tela)
+Gera arquivos GGUF sintéticos e mede parsing, mapeamento de tensores,
+dequantização, tokenizador, geração de respostas e tokens/s de ponta a ponta.
+
+Uso:
+    python benchmark.py --size-mb 64 --tensors 32 --quant Q4_K --output bench.json
+    python benchmark.py --compare bench_baseline.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+import gguf_loader
+import profiler
+from gguf_loader import (GGML_BLOCK_SIZES, GGML_TYPE_NAMES, GGUFModelWrapper, GGUFReader,
+                         GGUFTokenizer, PatternBackend, SimpleGGUFModel)
+from gguf_writer import GGUFWriter
+
+# Diferença absoluta mínima (s) para acusar regressão: abaixo disso é ruído
+MIN_DELTA_SECONDS = 0.0002
+
+# Campos do relatório que precisam bater para comparar com uma baseline
+CONFIG_FIELDS = ('model', 'synthetic', 'repeat')
+
+QUANT_TYPES = {name: ggml_type for ggml_type, name in GGML_TYPE_NAMES.items()}
+
+# Posição dos campos f16 (escalas) em cada bloco, para gerar dados válidos
+_SCALE_OFFSETS = {
+    'Q8_0': (0,), 'Q4_0': (0,), 'Q4_1': (0, 2), 'Q5_0': (0,), 'Q5_1': (0, 2),
+    'Q4_K': (0, 2), 'Q5_K': (0, 2), 'Q6_K': (208,)
+}
+
+BENCH_PROMPTS = [
+    "oi, tudo bem?", "qual é o seu nome", "como funciona o python?", "me fale sobre android",
+    "estou com um problema no código", "obrigado pela ajuda", "vai chover amanhã?",
+    "quanto é 2 + 2", "tchau", "o kivy serve para criar apps?", "isso é ótimo",
+    "explique inteligência artificial de forma simples"
+]
+
+
+# --- Geração de arquivos sintéticos ---
+
+def _corpus() -> str:
+    """Texto em português usado para treinar e medir o tokenizador"""
+    model = SimpleGGUFModel("")
+    texts = list(model.fallback_responses)
+    for responses in model.pattern_responses.values():
+        texts.extend(responses)
+    router = GGUFModelWrapper().router
+    texts.extend(response for response in router.example_responses if response)
+    texts.extend(BENCH_PROMPTS)
+    return "\n".join(texts)
+
+
+def train_bpe(text: str, vocab_size: int):
+    """Treina um BPE byte-level mínimo e retorna (tokens, merges)"""
+    encoder = gguf_loader._bytes_to_unicode()
+    tokens = [encoder[byte] for byte in range(256)]
+    words = Counter(
+        tuple(encoder[byte] for byte in word.encode('utf-8'))
+        for word in gguf_loader._GPT2_PRETOKENIZE.findall(text))
+    merges = []
+
+    while len(tokens) < vocab_size:
+        pairs = Counter()
+        for word, count in words.items():
+            for pair in zip(word, word[1:]):
+                pairs[pair] += count
+        if not pairs:
+            break
+        (left, right), _ = pairs.most_common(1)[0]
+        merged = left + right
+        merges.append(f"{left} {right}")
+        tokens.append(merged)
+
+        updated = Counter()
+        for word, count in words.items():
+            parts, index = [], 0
+            while index < len(word):
+                if index + 1 < len(word) and word[index] == left and word[index + 1] == right:
+                    parts.append(merged)
+                    index += 2
+                else:
+                    parts.append(word[index])
+                    index += 1
+            updated[tuple(parts)] += count
+        words = updated
+
+    # Completa o vocabulário com tokens sem merge (só ocupam espaço, como num modelo real)
+    while len(tokens) < vocab_size:
+        tokens.append(f"<extra_{len(tokens)}>")
+    return tokens, merges
+
+
+def random_blocks(quant: str, n_blocks: int, rng: np.random.Generator) -> np.ndarray:
+    """Blocos quantizados aleatórios com escalas f16 válidas"""
+    ggml_type = QUANT_TYPES[quant]
+    block_elems, block_bytes = GGML_BLOCK_SIZES[ggml_type]
+    if block_elems == 1:
+        dtype = '<f4' if quant == 'F32' else '<f2'
+        return rng.standard_normal(n_blocks).astype(dtype).view(np.uint8)
+
+    blocks = rng.integers(0, 256, size=(n_blocks, block_bytes), dtype=np.uint8)
+    for offset in _SCALE_OFFSETS[quant]:
+        scales = rng.uniform(0.001, 0.05, n_blocks).astype('<f2')
+        blocks[:, offset:offset + 2] = scales.view(np.uint8).reshape(n_blocks, 2)
+    return blocks.reshape(-1)
+
+
+def write_synthetic_gguf(path: Path, size_mb: float, tensor_count: int, quant: str,
+                         vocab_size: int, seed: int = 0) -> dict:
+    """Escreve um GGUF sintético com tensores aleatórios e vocabulário BPE"""
+    ggml_type = QUANT_TYPES[quant]
+    block_elems, block_bytes = GGML_BLOCK_SIZES[ggml_type]
+    rng = np.random.default_rng(seed)
+
+    # Linhas de 1024 elementos (múltiplo de todos os tamanhos de bloco)
+    row_elems = 1024
+    row_bytes = row_elems // block_elems * block_bytes
+    rows = max(1, int(size_mb * 1024 * 1024 / tensor_count / row_bytes))
+
+    tokens, merges = train_bpe(_corpus(), vocab_size)
+    metadata = {
+        'general.architecture': 'llama',
+        'general.name': f'terlinet-bench-{quant}',
+        'general.alignment': 32,
+        'llama.context_length': 2048,
+        'llama.embedding_length': row_elems,
+        'llama.block_count': tensor_count,
+        'tokenizer.ggml.model': 'gpt2',
+        'tokenizer.ggml.tokens': tokens,
+        'tokenizer.ggml.merges': merges,
+        'tokenizer.ggml.token_type': [1] * len(tokens),
+    }
+
+    writer = GGUFWriter(path)
+    for key, value in metadata.items():
+        writer.add_field(key, value)
+    names = [f'blk.{index}.weight' for index in range(tensor_count)]
+    for name in names:
+        writer.add_tensor(name, (row_elems, rows), ggml_type)
+    with writer:
+        for name in names:
+            writer.write_tensor(name, [random_blocks(quant, rows * row_elems // block_elems, rng)])
+
+    return {
+        'quant': quant, 'tensor_count': tensor_count, 'rows': rows, 'cols': row_elems,
+        'vocab_size': len(tokens), 'file_mb': round(path.stat().st_size / 1024 / 1024, 2)
+    }
+
+
+# --- Medição ---
+
+def measure(func, repeat: int, setup=None) -> dict:
+    """Executa `func` várias vezes e guarda o melhor tempo, a mediana e a média"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return {'seconds': min(times), 'median': statistics.median(times),
+            'mean': sum(times) / len(times), 'repeat': repeat, 'result': result}
+
+
+def _throughput(record: dict, amount: float, unit: str) -> dict:
+    record['throughput'] = round(amount / record['seconds'], 2) if record['seconds'] else None
+    record['unit'] = unit
+    return record
+
+
+def run_benchmarks(path: Path, repeat: int) -> dict:
+    results = {}
+    model = SimpleGGUFModel(str(path))
+
+    results['read_gguf_header'] = measure(model.read_gguf_header, repeat * 10)
+
+    def parse_metadata():
+        with GGUFReader(path) as reader:
+            return len(reader.fields)
+    results['metadata_parse'] = measure(parse_metadata, repeat)
+
+    reader = GGUFReader(path)
+    names = list(reader.tensors)
+    total_bytes = sum(info.n_bytes for info in reader.tensors.values())
+    total_elems = sum(info.n_elements for info in reader.tensors.values())
+
+    def map_tensors():
+        return sum(reader.tensor(name).nbytes for name in names)
+    results['tensor_mapping'] = _throughput(measure(map_tensors, repeat), len(names), 'tensors/s')
+
+    def dequantize_all():
+        return sum(float(reader.dequantize_tensor(name)[0, 0]) for name in names)
+    record = measure(dequantize_all, repeat)
+    results['dequantize'] = _throughput(record, total_bytes / 1024 / 1024, 'MB/s')
+    results['dequantize']['melems_per_s'] = round(total_elems / 1e6 / record['seconds'], 2)
+
+    tokenizer = GGUFTokenizer.from_fields(reader.fields)
+    text = _corpus() * 20
+    token_count = len(tokenizer.encode(text))
+    results['tokenizer_encode_cold'] = _throughput(
+        measure(lambda: tokenizer.encode(text), repeat, setup=tokenizer._cache.clear),
+        token_count, 'tokens/s')
+    results['tokenizer_encode_warm'] = _throughput(
+        measure(lambda: tokenizer.encode(text), repeat), token_count, 'tokens/s')
+    reader.close()
+
+    model.load_model()
+    random.seed(0)
+
+    def respond():
+        return [model.generate_response(prompt) for prompt in BENCH_PROMPTS]
+    record = measure(respond, repeat * 10)
+    results['generate_response'] = _throughput(record, len(BENCH_PROMPTS), 'respostas/s')
+    results['generate_response']['latency_us'] = round(
+        record['seconds'] / len(BENCH_PROMPTS) * 1e6, 2)
+
+    wrapper = GGUFModelWrapper()
+    wrapper.model = model
+    wrapper.backend = wrapper.pattern_backend = PatternBackend(model)
+    wrapper.model_loaded = True
+
+    def route():
+        return sum(wrapper.router.route(prompt).response is not None for prompt in BENCH_PROMPTS)
+    record = measure(route, repeat * 10)
+    results['intent_route'] = _throughput(record, len(BENCH_PROMPTS), 'mensagens/s')
+    results['intent_route']['direct_ratio'] = round(record['result'] / len(BENCH_PROMPTS), 3)
+
+    def end_to_end():
+        produced = 0
+        for prompt in BENCH_PROMPTS:
+            for piece in wrapper.generate_stream(prompt):
+                produced += len(model.tokenizer.encode(piece))
+        return produced
+    record = measure(end_to_end, repeat)
+    results['end_to_end'] = _throughput(record, record['result'], 'tokens/s')
+
+    for record in results.values():
+        record.pop('result', None)
+        record['seconds'] = round(record['seconds'], 6)
+        record['mean'] = round(record['mean'], 6)
+        record['median'] = round(record['median'], 9)
+    return results
+
+
+def config_mismatch(current: dict, baseline: dict) -> list:
+    """Campos de configuração (modelo, arquivo sintético, repetições) que diferem"""
+    meta, previous = current.get('meta', {}), baseline.get('meta', {})
+    return [field for field in CONFIG_FIELDS if meta.get(field) != previous.get(field)]
+
+
+def compare(current: dict, baseline: dict, threshold: float,
+            min_delta: float = MIN_DELTA_SECONDS) -> list:
+    """Lista as medições que ficaram mais lentas que a baseline além do limite
+
+    Compara as medianas (o melhor tempo em baselines antigas, sem mediana) e
+    só acusa regressão se a piora também passar de min_delta segundos.
+    """
+    regressions = []
+    print(f"{'benchmark':<24}{'baseline':>12}{'atual':>12}{'razão':>8}")
+    for name, record in current['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        key = 'median' if 'median' in previous and 'median' in record else 'seconds'
+        before, now = previous[key], record[key]
+        ratio = now / before if before else 1.0
+        flag = ''
+        if ratio > 1 + threshold and now - before > min_delta:
+            regressions.append(name)
+            flag = '  <-- regressão'
+        print(f"{name:<24}{before:>12.6f}{now:>12.6f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do gguf_loader")
+    parser.add_argument('--size-mb', type=float, default=16, help="tamanho dos tensores em MB")
+    parser.add_argument('--tensors', type=int, default=16, help="número de tensores")
+    parser.add_argument('--quant', default='Q4_K', choices=sorted(_SCALE_OFFSETS) + ['F16', 'F32'])
+    parser.add_argument('--vocab-size', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--model', help="usar um GGUF existente em vez do sintético")
+    parser.add_argument('--output', help="arquivo JSON de saída")
+    parser.add_argument('--compare', help="JSON de baseline para comparação")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="piora relativa tolerada antes de acusar regressão")
+    parser.add_argument('--min-delta', type=float, default=MIN_DELTA_SECONDS,
+                        help="piora absoluta mínima (s) para acusar regressão")
+    parser.add_argument('--force', action='store_true',
+                        help="compara mesmo com configuração diferente da baseline")
+    parser.add_argument('--trace', help="salva um Chrome trace da execução")
+    args = parser.parse_args()
+
+    if args.trace:
+        profiler.enable()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.model:
+            path = Path(args.model)
+            synthetic = None
+        else:
+            path = Path(tmp) / 'bench.gguf'
+            synthetic = write_synthetic_gguf(path, args.size_mb, args.tensors, args.quant,
+                                             args.vocab_size)
+        results = run_benchmarks(path, args.repeat)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'system': platform.system(),
+            'model': args.model,
+            'synthetic': synthetic,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+    if args.trace:
+        report['profile'] = profiler.summary()
+        profiler.export_chrome_trace(args.trace)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output, encoding='utf-8')
+        print(f"Resultados salvos em {args.output}")
+    else:
+        print(output)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        mismatch = config_mismatch(report, baseline)
+        if mismatch:
+            print(f"⚠️ Configuração diferente da baseline: {', '.join(mismatch)}")
+            if not args.force:
+                print("Comparação recusada (use --force para comparar assim mesmo)")
+                return 2
+        regressions = compare(report, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"❌ Regressões: {', '.join(regressions)}")
+            return 1
+        print("✅ Nenhuma regressão")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,7 +13,10 @@ package.domain = com.terlinet.app
 source.dir = .
 
 # (list) Source files to include (let empty to include all the files)
-source.include_exts = py,png,jpg,kv,atlas,txt,gguf
+source.include_exts = py,png,jpg,kv,atlas,txt
+
+# (list) Directories to exclude (the GGUF model is imported on first run, not bundled)
+source.exclude_dirs = modelo,bin,.buildozer
 
 # (str) Application versioning (method 1)
 version = 1.0.0
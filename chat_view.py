@@ -0,0 +1,230 @@
+"""
+Área de chat com layout de texto incremental
+Cada mensagem concluída vira um bloco com texturas próprias, cacheadas por
+largura; na resposta em streaming só a última linha é rediagramada quando
+chegam novos tokens
+"""
+
+from collections import OrderedDict
+
+from kivy.clock import Clock
+from kivy.core.text import Label as CoreLabel
+from kivy.graphics import Color, PopMatrix, PushMatrix, Rectangle, Translate
+from kivy.uix.widget import Widget
+
+
+class _TextBlock:
+    """Texto concluído e suas texturas já diagramadas por largura"""
+
+    __slots__ = ('text', 'layouts')
+
+    def __init__(self, text):
+        self.text = text
+        self.layouts = OrderedDict()
+
+
+class ChatTextView(Widget):
+    """Lista de blocos de texto desenhados diretamente no canvas"""
+
+    # Larguras guardadas por bloco (ex.: retrato e paisagem)
+    MAX_CACHED_WIDTHS = 2
+
+    def __init__(self, font_size=14, color=(1, 1, 1, 1), block_spacing=10, **kwargs):
+        kwargs.setdefault('size_hint_y', None)
+        kwargs.setdefault('height', 40)
+        super().__init__(**kwargs)
+        self.font_size = font_size
+        self.text_color = color
+        self.block_spacing = block_spacing
+
+        self.blocks = []
+        self._layout_width = None
+        self._content_height = 0
+        self._rects = []
+
+        # Estado da resposta em streaming
+        self._streaming = False
+        self._stream_committed = ""
+        self._stream_tail = ""
+        self._stream_textures = []
+        self._tail_rect = None
+
+        # Medidor de extensão de linha (não rasteriza)
+        self._measure = CoreLabel(font_size=font_size)
+
+        # Desenha de cima para baixo a partir do topo do widget
+        with self.canvas.before:
+            PushMatrix()
+            self._origin = Translate(self.x, self.top)
+            Color(1, 1, 1, 1)
+        with self.canvas.after:
+            PopMatrix()
+
+        self._relayout_trigger = Clock.create_trigger(self._relayout)
+        self.bind(pos=self._update_origin, size=self._update_origin)
+        self.bind(width=lambda *args: self._relayout_trigger())
+
+    # --- API pública ---
+
+    def add_paragraph(self, text):
+        """Adiciona um bloco de texto concluído"""
+        if self._streaming:
+            self.end_stream()
+        block = _TextBlock(text)
+        self.blocks.append(block)
+        if self._layout_width:
+            for texture in self._layout(block, self._layout_width):
+                self._append_texture(texture)
+            self._append_spacing()
+
+    def begin_stream(self, prefix=""):
+        """Abre o bloco da resposta em andamento"""
+        if self._streaming:
+            self.end_stream()
+        self._streaming = True
+        self._stream_committed = ""
+        self._stream_tail = ""
+        self._stream_textures = []
+        self._tail_rect = None
+        self.append_stream(prefix)
+
+    def append_stream(self, text):
+        """Acrescenta tokens: custo proporcional à última linha"""
+        if not self._streaming:
+            self.begin_stream()
+        if self._tail_rect is None and self._layout_width:
+            self._tail_rect = self._append_texture(self._render(""))
+            self._stream_textures.append(self._tail_rect.texture)
+
+        for index, part in enumerate(text.split('\n')):
+            if index > 0:
+                self._commit_tail(self._stream_tail, '\n')
+            self._stream_tail += part
+            self._wrap_tail()
+        self._refresh_tail()
+
+    def end_stream(self):
+        """Fecha a resposta e guarda as texturas já diagramadas"""
+        if not self._streaming:
+            return
+        self._refresh_tail()
+        block = _TextBlock(self._stream_committed + self._stream_tail)
+        if self._layout_width:
+            block.layouts[self._layout_width] = list(self._stream_textures)
+        self.blocks.append(block)
+        self._streaming = False
+        self._tail_rect = None
+        self._append_spacing()
+
+    # --- Diagramação ---
+
+    def _render(self, text, width=None):
+        label = CoreLabel(text=text or ' ', font_size=self.font_size, color=self.text_color,
+                          text_size=(width or self._layout_width, None),
+                          halign='left', valign='top')
+        label.refresh()
+        return label.texture
+
+    def _layout(self, block, width):
+        """Texturas do bloco na largura pedida, do cache quando possível"""
+        textures = block.layouts.get(width)
+        if textures is None:
+            textures = [self._render(block.text, width)]
+            block.layouts[width] = textures
+            while len(block.layouts) > self.MAX_CACHED_WIDTHS:
+                block.layouts.popitem(last=False)
+        else:
+            block.layouts.move_to_end(width)
+        return textures
+
+    def _wrap_tail(self):
+        """Fecha linhas da cauda que já não cabem na largura atual"""
+        width = self._layout_width
+        if not width:
+            return
+        while self._measure.get_extents(self._stream_tail)[0] > width:
+            split = self._stream_tail.rfind(' ')
+            while split > 0 and self._measure.get_extents(self._stream_tail[:split])[0] > width:
+                split = self._stream_tail.rfind(' ', 0, split)
+            if split <= 0:
+                # Palavra maior que a linha: o render quebra sozinho
+                return
+            line = self._stream_tail[:split]
+            self._stream_tail = self._stream_tail[split + 1:]
+            self._commit_tail(line, ' ')
+
+    def _commit_tail(self, line, separator):
+        """Congela `line` como textura definitiva e abre uma nova cauda"""
+        self._stream_committed += line + separator
+        if separator == '\n':
+            self._stream_tail = ""
+        if self._tail_rect is None:
+            return
+        self._set_rect_texture(self._tail_rect, self._render(line))
+        self._stream_textures[-1] = self._tail_rect.texture
+        self._tail_rect = self._append_texture(self._render(""))
+        self._stream_textures.append(self._tail_rect.texture)
+
+    def _refresh_tail(self):
+        if self._tail_rect is not None:
+            self._set_rect_texture(self._tail_rect, self._render(self._stream_tail))
+            self._stream_textures[-1] = self._tail_rect.texture
+
+    def _relayout(self, *args):
+        """Refaz o desenho na nova largura usando o cache de cada bloco"""
+        width = int(self.width)
+        if width <= 0 or width == self._layout_width:
+            return
+        self._layout_width = width
+
+        for rect in self._rects:
+            self.canvas.remove(rect)
+        self._rects = []
+        self._content_height = 0
+
+        for block in self.blocks:
+            for texture in self._layout(block, width):
+                self._append_texture(texture)
+            self._append_spacing()
+
+        if self._streaming:
+            self._stream_textures = []
+            committed = self._stream_committed.rstrip('\n')
+            if committed:
+                self._stream_textures.append(self._append_texture(self._render(committed)).texture)
+            self._tail_rect = self._append_texture(self._render(""))
+            self._stream_textures.append(self._tail_rect.texture)
+            self._wrap_tail()
+            self._refresh_tail()
+
+    # --- Canvas ---
+
+    def _append_texture(self, texture):
+        rect = Rectangle(texture=texture, size=texture.size,
+                         pos=(0, -self._content_height - texture.height))
+        self.canvas.add(rect)
+        self._rects.append(rect)
+        self._content_height += texture.height
+        self._update_height()
+        return rect
+
+    def _set_rect_texture(self, rect, texture):
+        delta = texture.height - rect.size[1]
+        rect.texture = texture
+        rect.size = texture.size
+        if delta:
+            # Só acontece na última linha, que é sempre o último retângulo
+            rect.pos = (0, rect.pos[1] - delta)
+            self._content_height += delta
+            self._update_height()
+
+    def _append_spacing(self):
+        self._content_height += self.block_spacing
+        self._update_height()
+
+    def _update_height(self):
+        self.height = max(self._content_height, 40)
+
+    def _update_origin(self, *args):
+        self._origin.x = self.x
+        self._origin.y = self.top
@@ -0,0 +1,454 @@
+"""
+Decodificação restrita do TerlineT
+Compila uma expressão regular (ou um esquema JSON simples) num autômato de
+caracteres. Para cada estado guarda a máscara booleana dos tokens do
+vocabulário que mantêm o texto válido; na geração a máscara sai do cache e só
+esconde os logits proibidos antes da amostragem.
+"""
+
+import json
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger('TerlineT.constrained')
+
+DEAD = -1
+
+_META = set('\\|()[]{}*+?.')
+_CLASS_ESCAPES = {
+    'd': (False, frozenset(), (('0', '9'),)),
+    'w': (False, frozenset('_'), (('a', 'z'), ('A', 'Z'), ('0', '9'), ('À', 'ÿ'))),
+    's': (False, frozenset(' \t\n\r'), ()),
+}
+_LITERAL_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r'}
+
+
+def escape(text: str) -> str:
+    """Texto literal na sintaxe de expressão regular aceita aqui"""
+    return ''.join('\\' + char if char in _META else char for char in text)
+
+
+def _matches(charset, char: str) -> bool:
+    negated, chars, ranges = charset
+    found = char in chars or any(low <= char <= high for low, high in ranges)
+    return found != negated
+
+
+class _Parser:
+    """Expressão regular -> NFA de Thompson
+
+    Suporta literais, `.`, classes `[...]`/`[^...]`, `\\d \\w \\s`, grupos,
+    alternância e os quantificadores `* + ? {m} {m,n}`.
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.position = 0
+        self.epsilon: List[List[int]] = []
+        self.edges: List[List[Tuple]] = []
+
+    def state(self) -> int:
+        self.epsilon.append([])
+        self.edges.append([])
+        return len(self.epsilon) - 1
+
+    def parse(self) -> Tuple[int, int]:
+        fragment = self._alternation()
+        if self.position != len(self.pattern):
+            raise ValueError(f"Expressão inválida perto da posição {self.position}: {self.pattern!r}")
+        return fragment
+
+    def _peek(self) -> Optional[str]:
+        return self.pattern[self.position] if self.position < len(self.pattern) else None
+
+    def _take(self) -> str:
+        char = self._peek()
+        if char is None:
+            raise ValueError(f"Expressão incompleta: {self.pattern!r}")
+        self.position += 1
+        return char
+
+    def _alternation(self) -> Tuple[int, int]:
+        branches = [self._sequence()]
+        while self._peek() == '|':
+            self.position += 1
+            branches.append(self._sequence())
+        if len(branches) == 1:
+            return branches[0]
+        start, end = self.state(), self.state()
+        for first, last in branches:
+            self.epsilon[start].append(first)
+            self.epsilon[last].append(end)
+        return start, end
+
+    def _sequence(self) -> Tuple[int, int]:
+        start = end = self.state()
+        while self._peek() not in (None, '|', ')'):
+            first, last = self._quantified()
+            self.epsilon[end].append(first)
+            end = last
+        return start, end
+
+    def _quantified(self) -> Tuple[int, int]:
+        begin = self.position
+        fragment = self._atom()
+        atom_end = self.position
+        char = self._peek()
+        if char in ('*', '+', '?'):
+            self.position += 1
+            start, end = self.state(), self.state()
+            first, last = fragment
+            self.epsilon[start].append(first)
+            self.epsilon[last].append(end)
+            if char in ('*', '?'):
+                self.epsilon[start].append(end)
+            if char in ('*', '+'):
+                self.epsilon[last].append(first)
+            return start, end
+        if char == '{':
+            low, high = self._repeat_bounds()
+            # Cada repetição precisa de estados próprios: reanalisa o átomo
+            source = self.pattern[begin:atom_end]
+            unused = [fragment]
+
+            def copy():
+                return unused.pop() if unused else self._sub(source)
+
+            start = end = self.state()
+            for _ in range(low):
+                first, last = copy()
+                self.epsilon[end].append(first)
+                end = last
+            for _ in range(1 if high is None else high - low):
+                first, last = copy()
+                after = self.state()
+                self.epsilon[end] += [first, after]
+                self.epsilon[last].append(after)
+                if high is None:
+                    self.epsilon[last].append(first)
+                end = after
+            return start, end
+        return fragment
+
+    def _sub(self, source: str) -> Tuple[int, int]:
+        parser = _Parser(source)
+        parser.epsilon, parser.edges = self.epsilon, self.edges
+        return parser.parse()
+
+    def _repeat_bounds(self) -> Tuple[int, Optional[int]]:
+        close = self.pattern.index('}', self.position)
+        body = self.pattern[self.position + 1:close]
+        self.position = close + 1
+        if ',' in body:
+            low, high = body.split(',', 1)
+            return int(low or 0), int(high) if high else None
+        return int(body), int(body)
+
+    def _atom(self) -> Tuple[int, int]:
+        char = self._take()
+        if char == '(':
+            fragment = self._alternation()
+            if self._take() != ')':
+                raise ValueError(f"Parêntese sem fechar: {self.pattern!r}")
+            return fragment
+        if char == '[':
+            return self._edge(self._class())
+        if char == '.':
+            return self._edge((True, frozenset('\n'), ()))
+        if char == '\\':
+            escaped = self._take()
+            if escaped in _CLASS_ESCAPES:
+                return self._edge(_CLASS_ESCAPES[escaped])
+            return self._edge((False, frozenset(_LITERAL_ESCAPES.get(escaped, escaped)), ()))
+        return self._edge((False, frozenset(char), ()))
+
+    def _class(self):
+        negated = self._peek() == '^'
+        if negated:
+            self.position += 1
+        chars, ranges = set(), []
+        while True:
+            char = self._take()
+            if char == ']':
+                break
+            if char == '\\':
+                escaped = self._take()
+                if escaped in _CLASS_ESCAPES:
+                    _, extra_chars, extra_ranges = _CLASS_ESCAPES[escaped]
+                    chars |= extra_chars
+                    ranges.extend(extra_ranges)
+                    continue
+                char = _LITERAL_ESCAPES.get(escaped, escaped)
+            if self._peek() == '-' and self.pattern[self.position + 1:self.position + 2] not in ('', ']'):
+                self.position += 1
+                ranges.append((char, self._take()))
+            else:
+                chars.add(char)
+        return negated, frozenset(chars), tuple(ranges)
+
+    def _edge(self, charset) -> Tuple[int, int]:
+        start, end = self.state(), self.state()
+        self.edges[start].append((charset, end))
+        return start, end
+
+
+class CharAutomaton:
+    """DFA construído sob demanda (subconjuntos do NFA) sobre caracteres"""
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        parser = _Parser(pattern)
+        nfa_start, self._nfa_end = parser.parse()
+        self._epsilon, self._edges = parser.epsilon, parser.edges
+        self._sets: List[frozenset] = []
+        self._ids: Dict[frozenset, int] = {}
+        self._moves: List[Dict[str, int]] = []
+        self.accepting: List[bool] = []
+        self.start = self._state_id(self._closure({nfa_start}))
+
+    def _closure(self, states) -> frozenset:
+        stack, seen = list(states), set(states)
+        while stack:
+            for target in self._epsilon[stack.pop()]:
+                if target not in seen:
+                    seen.add(target)
+                    stack.append(target)
+        return frozenset(seen)
+
+    def _state_id(self, states: frozenset) -> int:
+        if not states:
+            return DEAD
+        state = self._ids.get(states)
+        if state is None:
+            state = len(self._sets)
+            self._ids[states] = state
+            self._sets.append(states)
+            self._moves.append({})
+            self.accepting.append(self._nfa_end in states)
+        return state
+
+    def step(self, state: int, char: str) -> int:
+        if state == DEAD:
+            return DEAD
+        moves = self._moves[state]
+        target = moves.get(char)
+        if target is None:
+            reached = {end for nfa_state in self._sets[state]
+                       for charset, end in self._edges[nfa_state] if _matches(charset, char)}
+            target = self._state_id(self._closure(reached)) if reached else DEAD
+            moves[char] = target
+        return target
+
+    def walk(self, state: int, text: str) -> int:
+        for char in text:
+            state = self.step(state, char)
+            if state == DEAD:
+                break
+        return state
+
+    def fullmatch(self, text: str) -> bool:
+        state = self.walk(self.start, text)
+        return state != DEAD and self.accepting[state]
+
+
+class VocabularyTrie:
+    """Árvore de prefixos dos textos dos tokens (montada uma vez por tokenizador)"""
+
+    def __init__(self, token_strings: Sequence[Optional[str]]):
+        self.size = len(token_strings)
+        # nó: [filhos {caractere: nó}, ids que terminam aqui]
+        self.root = [{}, []]
+        for token_id, text in enumerate(token_strings):
+            if not text:
+                continue
+            node = self.root
+            for char in text:
+                node = node[0].setdefault(char, [{}, []])
+            node[1].append(token_id)
+
+
+class TokenGrammar:
+    """Autômato no nível de tokens com máscaras por estado em cache
+
+    Só entram na máscara tokens que levam a um estado de onde o vocabulário
+    ainda alcança o fim do texto: sem isso, um token válido no nível de
+    caracteres pode deixar a geração sem saída (e incompleta).
+    """
+
+    def __init__(self, automaton: CharAutomaton, trie: VocabularyTrie, end_id: Optional[int]):
+        self.automaton = automaton
+        self.trie = trie
+        self.end_id = end_id
+        # estado -> (máscara bool do vocabulário, ids permitidos, estados seguintes)
+        self._masks: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._live = None
+
+    @property
+    def start(self) -> int:
+        return self.automaton.start
+
+    def _transitions(self, state: int):
+        """(token, estado seguinte) de cada token que não leva a DEAD"""
+        stack = [(self.trie.root, state)]
+        while stack:
+            node, current = stack.pop()
+            for char, child in node[0].items():
+                following = self.automaton.step(current, char)
+                if following == DEAD:
+                    continue
+                for token_id in child[1]:
+                    yield token_id, following
+                if child[0]:
+                    stack.append((child, following))
+
+    def _live_states(self) -> set:
+        """Estados alcançáveis a partir dos quais algum caminho de tokens termina o texto
+
+        Percorre uma vez o grafo de estados (guardando só os destinos
+        distintos) e propaga a partir dos estados de aceitação.
+        """
+        sources: Dict[int, set] = {}
+        seen, pending = {self.start}, [self.start]
+        while pending:
+            state = pending.pop()
+            for following in {target for _, target in self._transitions(state)}:
+                sources.setdefault(following, set()).add(state)
+                if following not in seen:
+                    seen.add(following)
+                    pending.append(following)
+        live = {state for state in seen if self.automaton.accepting[state]}
+        frontier = list(live)
+        while frontier:
+            for source in sources.get(frontier.pop(), ()):
+                if source not in live:
+                    live.add(source)
+                    frontier.append(source)
+        logger.debug("Gramática: %d estados, %d com saída", len(seen), len(live))
+        return live
+
+    def _compute(self, state: int):
+        if self._live is None:
+            self._live = self._live_states()
+        allowed, targets = [], []
+        for token_id, following in self._transitions(state):
+            if following in self._live:
+                allowed.append(token_id)
+                targets.append(following)
+        order = np.argsort(allowed)
+        ids = np.asarray(allowed, dtype=np.int32)[order]
+        mask = np.zeros(self.trie.size, dtype=bool)
+        mask[ids] = True
+        if self.end_id is not None and self.automaton.accepting[state]:
+            mask[self.end_id] = True
+        entry = (mask, ids, np.asarray(targets, dtype=np.int32)[order])
+        self._masks[state] = entry
+        return entry
+
+    def mask(self, state: int) -> np.ndarray:
+        entry = self._masks.get(state)
+        if entry is None:
+            entry = self._compute(state)
+        return entry[0]
+
+    def advance(self, state: int, token_id: int) -> int:
+        entry = self._masks.get(state) or self._compute(state)
+        _, ids, targets = entry
+        index = int(np.searchsorted(ids, token_id))
+        if index < len(ids) and ids[index] == token_id:
+            return int(targets[index])
+        return DEAD
+
+    @property
+    def cached_states(self) -> int:
+        return len(self._masks)
+
+
+class ConstrainedSampler:
+    """Envolve um Sampler: aplica a máscara do estado atual e avança o autômato
+
+    Devolve `end_id` quando o texto está completo e nada mais cabe; se o
+    tokenizador não tem EOS, devolve DEAD (inclua-o nos ids de parada).
+    """
+
+    def __init__(self, sampler, grammar: TokenGrammar):
+        self.sampler = sampler
+        self.grammar = grammar
+        self.state = grammar.start
+
+    @property
+    def end_id(self) -> int:
+        return self.grammar.end_id if self.grammar.end_id is not None else DEAD
+
+    def sample(self, logits: np.ndarray) -> int:
+        mask = self.grammar.mask(self.state)
+        if not mask.any():
+            return self.end_id
+        token = self.sampler.sample(np.where(mask, logits, -np.inf))
+        if token != self.grammar.end_id:
+            self.state = self.grammar.advance(self.state, token)
+        return token
+
+    @property
+    def complete(self) -> bool:
+        return self.state != DEAD and self.grammar.automaton.accepting[self.state]
+
+
+class GrammarCache:
+    """Árvore do vocabulário e gramáticas já compiladas de um tokenizador"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self._trie = None
+        self._grammars: Dict[str, TokenGrammar] = {}
+
+    def grammar(self, pattern: str) -> TokenGrammar:
+        grammar = self._grammars.get(pattern)
+        if grammar is None:
+            if self._trie is None:
+                self._trie = VocabularyTrie(self.tokenizer.token_strings())
+            grammar = TokenGrammar(CharAutomaton(pattern), self._trie, self.tokenizer.eos_id)
+            logger.debug("Gramática compilada: %s", pattern)
+            self._grammars[pattern] = grammar
+        return grammar
+
+    def json_grammar(self, schema: Dict) -> TokenGrammar:
+        return self.grammar(json_schema_pattern(schema))
+
+
+# --- Esquemas JSON ---
+
+_JSON_STRING = r'"([^"\\\n]|\\["\\/nt])*"'
+_JSON_INTEGER = r'-?(0|[1-9]\d{0,15})'
+_JSON_NUMBER = _JSON_INTEGER + r'(\.\d{1,16})?'
+
+
+def json_schema_pattern(schema: Dict) -> str:
+    """Expressão regular para um subconjunto de JSON Schema
+
+    Objetos (propriedades na ordem declarada, todas presentes), arrays,
+    `enum`, string, integer, number, boolean e null.
+    """
+    if 'enum' in schema:
+        return '(' + '|'.join(escape(json.dumps(value, ensure_ascii=False))
+                              for value in schema['enum']) + ')'
+    kind = schema.get('type')
+    if kind == 'object':
+        members = [escape(json.dumps(name, ensure_ascii=False)) + ' ?: ?' + json_schema_pattern(value)
+                   for name, value in schema.get('properties', {}).items()]
+        return r'\{ ?' + ' ?, ?'.join(members) + r' ?\}'
+    if kind == 'array':
+        item = json_schema_pattern(schema.get('items', {'type': 'string'}))
+        return r'\[ ?(' + item + '( ?, ?' + item + r')*)? ?\]'
+    if kind == 'string':
+        return _JSON_STRING
+    if kind == 'integer':
+        return _JSON_INTEGER
+    if kind == 'number':
+        return _JSON_NUMBER
+    if kind == 'boolean':
+        return '(true|false)'
+    if kind == 'null':
+        return 'null'
+    raise ValueError(f"Tipo de esquema não suportado: {kind}")
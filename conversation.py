@@ -0,0 +1,303 @@
+"""
+Contexto de conversação do TerlineT
+Monta o prompt com a persona, um resumo rolante do histórico antigo e os
+turnos recentes dentro do orçamento de tokens do modelo. A contagem de tokens
+de cada turno é feita uma única vez, e o resumo é atualizado em segundo plano
+quando a conversa fica ociosa, fora do caminho crítico da geração.
+"""
+
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger('TerlineT.context')
+
+DEFAULT_PERSONA = ("Você é a TerlineT, uma assistente virtual prestativa que responde "
+                   "em português de forma clara e breve.")
+
+ROLE_LABELS = {'user': 'Usuário', 'assistant': 'TerlineT', 'system': 'Sistema'}
+
+RETRIEVAL_HEADER = "Informações relevantes:"
+SUMMARY_HEADER = "Resumo da conversa anterior:"
+
+
+def approximate_token_count(text: str) -> int:
+    """Estimativa usada quando não há tokenizador (≈4 caracteres por token)"""
+    return len(text) // 4 + 1
+
+
+class Turn:
+    """Uma mensagem da conversa com a contagem de tokens já calculada"""
+
+    __slots__ = ('role', 'text', 'tokens')
+
+    def __init__(self, role: str, text: str, tokens: int):
+        self.role = role
+        self.text = text
+        self.tokens = tokens
+
+    def format(self) -> str:
+        return f"{ROLE_LABELS.get(self.role, self.role)}: {self.text}"
+
+
+def format_messages(messages: Sequence[Dict], persona: str = DEFAULT_PERSONA) -> str:
+    """Prompt no mesmo formato do contexto a partir de mensagens {'role', 'content'}"""
+    parts = []
+    for message in messages:
+        role, content = message.get('role', 'user'), str(message.get('content', ''))
+        if role == 'system':
+            parts.append(content)
+        else:
+            parts.append(f"{ROLE_LABELS.get(role, role)}: {content}")
+    if not messages or messages[0].get('role') != 'system':
+        parts.insert(0, persona)
+    parts.append(f"{ROLE_LABELS['assistant']}:")
+    return "\n".join(parts)
+
+
+def extractive_summary(turns: List[Turn], max_words: int = 20) -> List[str]:
+    """Resumo barato: a primeira frase de cada turno, encurtada"""
+    sentences = []
+    for turn in turns:
+        first = re.split(r'(?<=[.!?])\s+', turn.text.strip(), maxsplit=1)[0]
+        words = first.split()
+        if not words:
+            continue
+        if len(words) > max_words:
+            first = " ".join(words[:max_words]) + "..."
+        sentences.append(f"{ROLE_LABELS.get(turn.role, turn.role)} disse: {first}")
+    return sentences
+
+
+class ConversationContext:
+    """Histórico com janela de tokens deslizante e resumo rolante"""
+
+    def __init__(self, count_tokens: Callable[[str], int] = approximate_token_count,
+                 persona: str = DEFAULT_PERSONA, context_budget: int = 4096,
+                 summary_budget: int = 256, idle_seconds: float = 2.0,
+                 summarizer: Optional[Callable[[List[Turn]], List[str]]] = None):
+        self.count_tokens = count_tokens
+        self.persona = persona
+        self.persona_tokens = self.summary_header_tokens = 0
+        self._count_fixed()
+        self.context_budget = context_budget
+        self.summary_budget = summary_budget
+        self.idle_seconds = idle_seconds
+        self.summarizer = summarizer or extractive_summary
+
+        self.turns = []
+        # Identifica a conversa: os índices dos turnos recomeçam a cada sessão
+        self.session_id = uuid.uuid4().hex[:12]
+        # Turnos [window_start:] entram no prompt; [summarized_upto:window_start]
+        # saíram da janela e aguardam o resumo
+        self.window_start = 0
+        self.window_tokens = 0
+        self.summarized_upto = 0
+
+        self._summary = deque()  # (frase, tokens)
+        self.summary_tokens = 0
+
+        self._lock = threading.RLock()
+        self._idle_timer = None
+        self._last_activity = 0.0
+        self._listeners = []
+
+    # --- Histórico ---
+
+    def add_listener(self, callback):
+        """callback(sessão, índice, turno) chamado a cada turno registrado"""
+        self._listeners.append(callback)
+
+    def _count_line(self, line: str) -> int:
+        """Tokens de uma linha do prompt, com a quebra de linha que a separa"""
+        return self.count_tokens(line) + 1
+
+    def _count_fixed(self):
+        # Persona e o cabeçalho da resposta ("TerlineT:") entram em todo prompt
+        self.persona_tokens = (self._count_line(self.persona)
+                               + self.count_tokens(f"{ROLE_LABELS['assistant']}:"))
+        self.summary_header_tokens = self.count_tokens(SUMMARY_HEADER) + 1
+
+    def _fixed_tokens(self) -> int:
+        fixed = self.persona_tokens
+        if self._summary:
+            fixed += self.summary_header_tokens + self.summary_tokens
+        return fixed
+
+    def recount(self):
+        """Reconta persona, turnos e resumo com o contador atual
+
+        Chamado quando o tokenizador do modelo fica disponível: o que foi
+        contado antes usava a estimativa.
+        """
+        with self._lock:
+            self._count_fixed()
+            for turn in self.turns:
+                turn.tokens = self._count_line(turn.format())
+            self._summary = deque((sentence, self.count_tokens(sentence))
+                                  for sentence, _ in self._summary)
+            self.summary_tokens = sum(tokens for _, tokens in self._summary)
+            self.window_tokens = sum(turn.tokens for turn in self.turns[self.window_start:])
+            self._fit_window(self.context_budget)
+
+    def add_turn(self, role: str, text: str) -> Turn:
+        """Registra um turno, contando seus tokens (com o cabeçalho) uma única vez"""
+        turn = Turn(role, text, 0)
+        turn.tokens = self._count_line(turn.format())
+        with self._lock:
+            self.turns.append(turn)
+            index = len(self.turns) - 1
+            self.window_tokens += turn.tokens
+            self._fit_window(self.context_budget)
+        self._schedule_summary()
+        for callback in self._listeners:
+            try:
+                callback(self.session_id, index, turn)
+            except Exception as e:
+                logger.warning("Listener de contexto falhou: %s", e)
+        return turn
+
+    def _fit_window(self, budget: int):
+        """Tira da janela os turnos mais antigos até caber no orçamento (O(1) amortizado)"""
+        self.window_start, self.window_tokens = self._window_for(budget)
+
+    def _window_for(self, budget: int):
+        """(início, tokens) da janela que cabe no orçamento, sem alterar a janela"""
+        fixed = self._fixed_tokens()
+        start, tokens = self.window_start, self.window_tokens
+        # O turno mais recente sempre fica, mesmo que sozinho estoure o orçamento
+        while start < len(self.turns) - 1 and fixed + tokens > budget:
+            tokens -= self.turns[start].tokens
+            start += 1
+        return start, tokens
+
+    def clear(self):
+        with self._lock:
+            self.turns = []
+            # Conversa nova: os turnos anteriores passam a ser só recuperáveis
+            self.session_id = uuid.uuid4().hex[:12]
+            self.window_start = self.window_tokens = self.summarized_upto = 0
+            self._summary.clear()
+            self.summary_tokens = 0
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def state(self) -> Dict:
+        """Estado serializável (turnos, janela e resumo) para snapshots"""
+        with self._lock:
+            return {'session_id': self.session_id,
+                    'turns': [[turn.role, turn.text, turn.tokens] for turn in self.turns],
+                    'window_start': self.window_start, 'window_tokens': self.window_tokens,
+                    'summarized_upto': self.summarized_upto,
+                    'summary': [list(entry) for entry in self._summary]}
+
+    def restore(self, state: Dict):
+        """Recoloca um estado salvo por `state()` sem chamar os listeners"""
+        with self._lock:
+            self.session_id = state.get('session_id', self.session_id)
+            self.turns = [Turn(role, text, tokens) for role, text, tokens in state['turns']]
+            self.window_start = state['window_start']
+            self.window_tokens = state['window_tokens']
+            self.summarized_upto = state['summarized_upto']
+            self._summary = deque((sentence, tokens) for sentence, tokens in state['summary'])
+            self.summary_tokens = sum(tokens for _, tokens in self._summary)
+
+    # --- Prompt ---
+
+    @property
+    def summary(self) -> str:
+        return " ".join(sentence for sentence, _ in self._summary)
+
+    def in_window(self, turn_index: int) -> bool:
+        """Se o turno já entra no prompt como turno recente"""
+        return turn_index >= self.window_start
+
+    def build_prompt(self, budget: Optional[int] = None, retrieved: Sequence[str] = (),
+                     retrieval_budget: int = 512) -> str:
+        """Prompt com persona, trechos recuperados, resumo e turnos recentes
+
+        O custo depende só do tamanho da janela, que é limitado pelo orçamento,
+        e não do número total de turnos da conversa.
+        """
+        snippets, used = [], 0
+        for text in retrieved:
+            line = f"- {text}"
+            tokens = self._count_line(line)
+            if not snippets:
+                tokens += self._count_line(RETRIEVAL_HEADER)
+            if used + tokens > retrieval_budget:
+                break
+            snippets.append(line)
+            used += tokens
+
+        with self._lock:
+            budget = self.context_budget if budget is None else min(budget, self.context_budget)
+            # O orçamento vale só para este prompt: a janela compartilhada só
+            # anda com o context_budget (add_turn e recount)
+            start, _ = self._window_for(budget - used)
+            parts = [self.persona]
+            if snippets:
+                parts.append(RETRIEVAL_HEADER)
+                parts.extend(snippets)
+            if self._summary:
+                parts.append(f"{SUMMARY_HEADER} {self.summary}")
+            parts.extend(turn.format() for turn in self.turns[start:])
+        parts.append(f"{ROLE_LABELS['assistant']}:")
+        return "\n".join(parts)
+
+    def prompt_tokens(self) -> int:
+        with self._lock:
+            return self._fixed_tokens() + self.window_tokens
+
+    # --- Resumo em segundo plano ---
+
+    def _schedule_summary(self):
+        """Adia o resumo até a conversa ficar ociosa por `idle_seconds`"""
+        self._last_activity = time.monotonic()
+        if self.summarized_upto < self.window_start and self._idle_timer is None:
+            self._start_timer(self.idle_seconds)
+
+    def _start_timer(self, delay: float):
+        # Um único timer vivo; a atividade só atualiza o carimbo de tempo
+        self._idle_timer = threading.Timer(delay, self._on_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _on_idle(self):
+        remaining = self._last_activity + self.idle_seconds - time.monotonic()
+        if remaining > 0:
+            self._start_timer(remaining)
+            return
+        self._idle_timer = None
+        self.summarize_pending()
+
+    def summarize_pending(self):
+        """Incorpora ao resumo os turnos que saíram da janela"""
+        with self._lock:
+            pending = self.turns[self.summarized_upto:self.window_start]
+            self.summarized_upto = self.window_start
+        if not pending:
+            return
+
+        try:
+            sentences = self.summarizer(pending)
+        except Exception as e:
+            logger.warning("Falha ao resumir o histórico: %s", e)
+            return
+
+        counted = [(sentence, self.count_tokens(sentence)) for sentence in sentences]
+        with self._lock:
+            for sentence, tokens in counted:
+                self._summary.append((sentence, tokens))
+                self.summary_tokens += tokens
+            # Resumo rolante: as frases mais antigas saem primeiro
+            while self._summary and self.summary_tokens > self.summary_budget:
+                _, tokens = self._summary.popleft()
+                self.summary_tokens -= tokens
+            self._fit_window(self.context_budget)
+        logger.debug("Resumo atualizado com %d turnos (%d tokens)", len(pending), self.summary_tokens)
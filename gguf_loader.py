@@ -3,19 +3,36 @@ GGUF Model Loader para Android
 Carregador simplificado de modelos GGUF compatível com Android
 """
 
+import logging
+import mmap
 import struct
 import numpy as np
+import hashlib
 import json
 import os
+import re
 import threading
 import time
 import random
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Sequence, Union
+
+import profiler
+from conversation import (ROLE_LABELS, ConversationContext, approximate_token_count,
+                          format_messages)
+from integrity import IntegrityError, verify_model
+from intent_router import IntentRouter
+from retrieval import USER_TURN_PREFIX, parse_conversation_source
+
+logger = logging.getLogger('TerlineT.gguf')
 
 # Constantes GGUF
 GGUF_MAGIC = 0x46554747  # "GGUF"
 GGUF_VERSION = 3
+# A v2 tem o mesmo layout da v3 (que só acrescentou arquivos big-endian)
+SUPPORTED_GGUF_VERSIONS = (2, GGUF_VERSION)
 
 # Tipos de dados GGUF
 GGUF_TYPE_UINT8 = 0
@@ -32,21 +49,612 @@ GGUF_TYPE_UINT64 = 10
 GGUF_TYPE_INT64 = 11
 GGUF_TYPE_FLOAT64 = 12
 
+# Alinhamento padrão da seção de dados dos tensores
+GGUF_DEFAULT_ALIGNMENT = 32
+
+# Tipos de tensores GGML
+GGML_TYPE_F32 = 0
+GGML_TYPE_F16 = 1
+GGML_TYPE_Q4_0 = 2
+GGML_TYPE_Q4_1 = 3
+GGML_TYPE_Q5_0 = 6
+GGML_TYPE_Q5_1 = 7
+GGML_TYPE_Q8_0 = 8
+GGML_TYPE_Q8_1 = 9
+GGML_TYPE_Q2_K = 10
+GGML_TYPE_Q3_K = 11
+GGML_TYPE_Q4_K = 12
+GGML_TYPE_Q5_K = 13
+GGML_TYPE_Q6_K = 14
+GGML_TYPE_BF16 = 30
+
+GGML_TYPE_NAMES = {
+    GGML_TYPE_F32: 'F32', GGML_TYPE_F16: 'F16', GGML_TYPE_Q4_0: 'Q4_0',
+    GGML_TYPE_Q4_1: 'Q4_1', GGML_TYPE_Q5_0: 'Q5_0', GGML_TYPE_Q5_1: 'Q5_1',
+    GGML_TYPE_Q8_0: 'Q8_0', GGML_TYPE_Q8_1: 'Q8_1', GGML_TYPE_Q2_K: 'Q2_K',
+    GGML_TYPE_Q3_K: 'Q3_K', GGML_TYPE_Q4_K: 'Q4_K', GGML_TYPE_Q5_K: 'Q5_K',
+    GGML_TYPE_Q6_K: 'Q6_K', GGML_TYPE_BF16: 'BF16'
+}
+
+# (elementos por bloco, bytes por bloco)
+GGML_BLOCK_SIZES = {
+    GGML_TYPE_F32: (1, 4), GGML_TYPE_F16: (1, 2), GGML_TYPE_BF16: (1, 2),
+    GGML_TYPE_Q4_0: (32, 18), GGML_TYPE_Q4_1: (32, 20), GGML_TYPE_Q5_0: (32, 22),
+    GGML_TYPE_Q5_1: (32, 24), GGML_TYPE_Q8_0: (32, 34), GGML_TYPE_Q8_1: (32, 36),
+    GGML_TYPE_Q2_K: (256, 84), GGML_TYPE_Q3_K: (256, 110), GGML_TYPE_Q4_K: (256, 144),
+    GGML_TYPE_Q5_K: (256, 176), GGML_TYPE_Q6_K: (256, 210)
+}
+
+# Tipos escalares de metadados
+_SCALAR_STRUCTS = {
+    GGUF_TYPE_UINT8: struct.Struct('<B'), GGUF_TYPE_INT8: struct.Struct('<b'),
+    GGUF_TYPE_UINT16: struct.Struct('<H'), GGUF_TYPE_INT16: struct.Struct('<h'),
+    GGUF_TYPE_UINT32: struct.Struct('<I'), GGUF_TYPE_INT32: struct.Struct('<i'),
+    GGUF_TYPE_FLOAT32: struct.Struct('<f'), GGUF_TYPE_BOOL: struct.Struct('<?'),
+    GGUF_TYPE_UINT64: struct.Struct('<Q'), GGUF_TYPE_INT64: struct.Struct('<q'),
+    GGUF_TYPE_FLOAT64: struct.Struct('<d')
+}
+_NUMPY_TYPES = {
+    GGUF_TYPE_UINT8: np.uint8, GGUF_TYPE_INT8: np.int8, GGUF_TYPE_UINT16: np.uint16,
+    GGUF_TYPE_INT16: np.int16, GGUF_TYPE_UINT32: np.uint32, GGUF_TYPE_INT32: np.int32,
+    GGUF_TYPE_FLOAT32: np.float32, GGUF_TYPE_BOOL: np.bool_, GGUF_TYPE_UINT64: np.uint64,
+    GGUF_TYPE_INT64: np.int64, GGUF_TYPE_FLOAT64: np.float64
+}
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+
+
+class GGUFTensorInfo:
+    """Descrição de um tensor dentro do arquivo GGUF"""
+
+    __slots__ = ('name', 'shape', 'ggml_type', 'offset')
+
+    def __init__(self, name: str, shape: tuple, ggml_type: int, offset: int):
+        self.name = name
+        # Dimensões na ordem GGML (a primeira é a mais interna)
+        self.shape = shape
+        self.ggml_type = ggml_type
+        self.offset = offset
+
+    @property
+    def n_elements(self) -> int:
+        count = 1
+        for dim in self.shape:
+            count *= dim
+        return count
+
+    @property
+    def n_bytes(self) -> int:
+        block_elems, block_bytes = GGML_BLOCK_SIZES[self.ggml_type]
+        return self.n_elements // block_elems * block_bytes
+
+    @property
+    def numpy_shape(self) -> tuple:
+        return tuple(reversed(self.shape))
+
+
+class GGUFReader:
+    """Leitor completo de arquivos GGUF via mmap (metadados e tensores)"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self._pos = 0
+        self.version = 0
+        self.fields = {}
+        # Tipo GGUF de cada campo: (tipo, tipo dos itens se for array)
+        self.field_types = {}
+        self.tensors = {}
+        self.alignment = GGUF_DEFAULT_ALIGNMENT
+        self.data_offset = 0
+
+        try:
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Ainda há views NumPy apontando para o mmap; o GC fecha depois
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # --- Leitura de baixo nível ---
+
+    def _unpack(self, fmt: struct.Struct):
+        value = fmt.unpack_from(self._mmap, self._pos)[0]
+        self._pos += fmt.size
+        return value
+
+    def _read_string(self) -> str:
+        length = _U64.unpack_from(self._mmap, self._pos)[0]
+        start = self._pos + 8
+        self._pos = start + length
+        return self._mmap[start:self._pos].decode('utf-8', errors='replace')
+
+    def _read_value(self, value_type: int):
+        if value_type == GGUF_TYPE_STRING:
+            return self._read_string()
+        if value_type != GGUF_TYPE_ARRAY:
+            return self._unpack(_SCALAR_STRUCTS[value_type])
+
+        item_type = self._unpack(_U32)
+        count = self._unpack(_U64)
+        if item_type in _NUMPY_TYPES:
+            # Arrays numéricos são lidos de uma vez, sem laço em Python
+            dtype = np.dtype(_NUMPY_TYPES[item_type]).newbyteorder('<')
+            array = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=self._pos).copy()
+            self._pos += count * dtype.itemsize
+            return array
+        if item_type == GGUF_TYPE_STRING:
+            buffer, pos, strings = self._mmap, self._pos, []
+            unpack_length = _U64.unpack_from
+            for _ in range(count):
+                length = unpack_length(buffer, pos)[0]
+                pos += 8
+                strings.append(buffer[pos:pos + length].decode('utf-8', errors='replace'))
+                pos += length
+            self._pos = pos
+            return strings
+        return [self._read_value(item_type) for _ in range(count)]
+
+    def _parse(self):
+        magic = self._unpack(_U32)
+        if magic != GGUF_MAGIC:
+            raise ValueError("Arquivo não é GGUF (magic inválido)")
+        self.version = self._unpack(_U32)
+        if self.version not in SUPPORTED_GGUF_VERSIONS:
+            raise ValueError(f"Versão GGUF não suportada: {self.version}")
+
+        tensor_count = self._unpack(_U64)
+        kv_count = self._unpack(_U64)
+
+        for _ in range(kv_count):
+            key = self._read_string()
+            value_type = self._unpack(_U32)
+            item_type = None
+            if value_type == GGUF_TYPE_ARRAY:
+                item_type = _U32.unpack_from(self._mmap, self._pos)[0]
+            self.field_types[key] = (value_type, item_type)
+            self.fields[key] = self._read_value(value_type)
+
+        for _ in range(tensor_count):
+            name = self._read_string()
+            n_dims = self._unpack(_U32)
+            shape = struct.unpack_from(f'<{n_dims}Q', self._mmap, self._pos)
+            self._pos += 8 * n_dims
+            ggml_type = self._unpack(_U32)
+            offset = self._unpack(_U64)
+            self.tensors[name] = GGUFTensorInfo(name, shape, ggml_type, offset)
+
+        self.alignment = int(self.fields.get('general.alignment', GGUF_DEFAULT_ALIGNMENT))
+        self.data_offset = align_offset(self._pos, self.alignment)
+
+    # --- Acesso aos tensores ---
+
+    @property
+    def architecture(self) -> str:
+        return self.fields.get('general.architecture', 'llama')
+
+    def tensor_bytes(self, name: str) -> np.ndarray:
+        """View (sem cópia) dos bytes brutos do tensor no mmap"""
+        info = self.tensors[name]
+        return np.frombuffer(self._mmap, dtype=np.uint8, count=info.n_bytes,
+                             offset=self.data_offset + info.offset)
+
+    def release(self, name: str):
+        """Devolve ao sistema as páginas do tensor já lidas (leitura em fluxo)"""
+        if not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        info = self.tensors[name]
+        start = self.data_offset + info.offset
+        page_start = start - start % mmap.PAGESIZE
+        try:
+            self._mmap.madvise(mmap.MADV_DONTNEED, page_start, start + info.n_bytes - page_start)
+        except (OSError, ValueError):
+            pass
+
+    def tensor(self, name: str) -> np.ndarray:
+        """Tensor mapeado: F32/F16 tipados, quantizados como blocos brutos"""
+        info = self.tensors[name]
+        raw = self.tensor_bytes(name)
+        if info.ggml_type == GGML_TYPE_F32:
+            return raw.view('<f4').reshape(info.numpy_shape)
+        if info.ggml_type == GGML_TYPE_F16:
+            return raw.view('<f2').reshape(info.numpy_shape)
+        return raw
+
+    @property
+    def quantization(self) -> str:
+        """Tipo de tensor que ocupa mais bytes (ex.: 'Q4_K')"""
+        totals = {}
+        for info in self.tensors.values():
+            totals[info.ggml_type] = totals.get(info.ggml_type, 0) + info.n_bytes
+        if not totals:
+            return 'desconhecida'
+        dominant = max(totals, key=totals.get)
+        return GGML_TYPE_NAMES.get(dominant, str(dominant))
+
+    def dequantize_tensor(self, name: str) -> np.ndarray:
+        """Tensor convertido para float32 no formato NumPy"""
+        info = self.tensors[name]
+        values = dequantize(self.tensor_bytes(name), info.ggml_type, info.n_elements)
+        return values.reshape(info.numpy_shape)
+
+
+def align_offset(offset: int, alignment: int = GGUF_DEFAULT_ALIGNMENT) -> int:
+    return offset + (alignment - offset % alignment) % alignment
+
+
+# --- Dequantização vetorizada ---
+
+def _blocks(data: np.ndarray, ggml_type: int, n_elements: int) -> np.ndarray:
+    block_elems, block_bytes = GGML_BLOCK_SIZES[ggml_type]
+    n_blocks = n_elements // block_elems
+    return np.asarray(data, dtype=np.uint8)[:n_blocks * block_bytes].reshape(n_blocks, block_bytes)
+
+
+def _f16(blocks: np.ndarray, start: int) -> np.ndarray:
+    return blocks[:, start:start + 2].copy().view('<f2').astype(np.float32)
+
+
+def _dequantize_q8_0(blocks):
+    d = _f16(blocks, 0)
+    return d * blocks[:, 2:].view(np.int8).astype(np.float32)
+
+
+def _dequantize_q4_0(blocks):
+    d = _f16(blocks, 0)
+    qs = blocks[:, 2:]
+    q = np.concatenate((qs & 0x0F, qs >> 4), axis=1).astype(np.int8) - 8
+    return d * q.astype(np.float32)
+
+
+def _dequantize_q4_1(blocks):
+    d, m = _f16(blocks, 0), _f16(blocks, 2)
+    qs = blocks[:, 4:]
+    q = np.concatenate((qs & 0x0F, qs >> 4), axis=1)
+    return d * q.astype(np.float32) + m
+
+
+def _q5_values(qh_bytes, qs):
+    qh = qh_bytes.copy().view('<u4')
+    bits = (qh >> np.arange(32, dtype=np.uint32)) & 1
+    low = (qs & 0x0F) | (bits[:, :16] << 4).astype(np.uint8)
+    high = (qs >> 4) | (bits[:, 16:] << 4).astype(np.uint8)
+    return np.concatenate((low, high), axis=1)
+
+
+def _dequantize_q5_0(blocks):
+    d = _f16(blocks, 0)
+    q = _q5_values(blocks[:, 2:6], blocks[:, 6:]).astype(np.int8) - 16
+    return d * q.astype(np.float32)
+
+
+def _dequantize_q5_1(blocks):
+    d, m = _f16(blocks, 0), _f16(blocks, 2)
+    q = _q5_values(blocks[:, 4:8], blocks[:, 8:])
+    return d * q.astype(np.float32) + m
+
+
+def _k_scales(scales):
+    """Escalas e mínimos de 6 bits dos formatos Q4_K/Q5_K"""
+    sc = np.empty((scales.shape[0], 8), dtype=np.uint8)
+    mn = np.empty((scales.shape[0], 8), dtype=np.uint8)
+    sc[:, :4] = scales[:, 0:4] & 63
+    mn[:, :4] = scales[:, 4:8] & 63
+    sc[:, 4:] = (scales[:, 8:12] & 0x0F) | ((scales[:, 0:4] >> 6) << 4)
+    mn[:, 4:] = (scales[:, 8:12] >> 4) | ((scales[:, 4:8] >> 6) << 4)
+    return sc.astype(np.float32), mn.astype(np.float32)
+
+
+def _dequantize_q4_k(blocks):
+    n = blocks.shape[0]
+    d, dmin = _f16(blocks, 0), _f16(blocks, 2)
+    sc, mn = _k_scales(blocks[:, 4:16])
+    qs = blocks[:, 16:].reshape(n, 4, 1, 32)
+    q = np.concatenate((qs & 0x0F, qs >> 4), axis=2).reshape(n, 8, 32)
+    out = (d * sc)[:, :, None] * q - (dmin * mn)[:, :, None]
+    return out.reshape(n, 256)
+
+
+def _dequantize_q5_k(blocks):
+    n = blocks.shape[0]
+    d, dmin = _f16(blocks, 0), _f16(blocks, 2)
+    sc, mn = _k_scales(blocks[:, 4:16])
+    qh = blocks[:, 16:48].reshape(n, 1, 32)
+    qs = blocks[:, 48:].reshape(n, 4, 1, 32)
+    low = np.concatenate((qs & 0x0F, qs >> 4), axis=2).reshape(n, 8, 32)
+    high = ((qh >> np.arange(8, dtype=np.uint8)[None, :, None]) & 1) << 4
+    q = low | high
+    out = (d * sc)[:, :, None] * q - (dmin * mn)[:, :, None]
+    return out.reshape(n, 256)
+
+
+def _dequantize_q6_k(blocks):
+    n = blocks.shape[0]
+    ql = blocks[:, :128].reshape(n, 2, 64)
+    qh = blocks[:, 128:192].reshape(n, 2, 32)
+    scales = blocks[:, 192:208].view(np.int8).astype(np.float32).reshape(n, 2, 4, 2, 1)
+    d = _f16(blocks, 208).reshape(n, 1, 1, 1, 1)
+    q = np.stack((
+        (ql[:, :, :32] & 0x0F) | ((qh & 3) << 4),
+        (ql[:, :, 32:] & 0x0F) | (((qh >> 2) & 3) << 4),
+        (ql[:, :, :32] >> 4) | (((qh >> 4) & 3) << 4),
+        (ql[:, :, 32:] >> 4) | (((qh >> 6) & 3) << 4),
+    ), axis=2).astype(np.int8) - 32
+    out = d * scales * q.reshape(n, 2, 4, 2, 16).astype(np.float32)
+    return out.reshape(n, 256)
+
+
+_DEQUANTIZERS = {
+    GGML_TYPE_Q8_0: _dequantize_q8_0,
+    GGML_TYPE_Q4_0: _dequantize_q4_0,
+    GGML_TYPE_Q4_1: _dequantize_q4_1,
+    GGML_TYPE_Q5_0: _dequantize_q5_0,
+    GGML_TYPE_Q5_1: _dequantize_q5_1,
+    GGML_TYPE_Q4_K: _dequantize_q4_k,
+    GGML_TYPE_Q5_K: _dequantize_q5_k,
+    GGML_TYPE_Q6_K: _dequantize_q6_k,
+}
+
+
+def dequantize(data: np.ndarray, ggml_type: int, n_elements: int) -> np.ndarray:
+    """Converte dados de um tensor GGML para um vetor float32"""
+    if ggml_type == GGML_TYPE_F32:
+        return np.asarray(data, dtype=np.uint8)[:n_elements * 4].view('<f4').astype(np.float32)
+    if ggml_type == GGML_TYPE_F16:
+        return np.asarray(data, dtype=np.uint8)[:n_elements * 2].view('<f2').astype(np.float32)
+    if ggml_type == GGML_TYPE_BF16:
+        bits = np.asarray(data, dtype=np.uint8)[:n_elements * 2].view('<u2').astype(np.uint32)
+        return (bits << 16).view(np.float32)
+
+    dequantizer = _DEQUANTIZERS.get(ggml_type)
+    if dequantizer is None:
+        name = GGML_TYPE_NAMES.get(ggml_type, str(ggml_type))
+        raise NotImplementedError(f"Dequantização de {name} não suportada")
+    return dequantizer(_blocks(data, ggml_type, n_elements)).reshape(-1)
+
+
+# --- Tokenizador ---
+
+def _bytes_to_unicode() -> Dict[int, str]:
+    """Mapeamento byte -> caractere usado pelos tokenizadores BPE estilo GPT-2"""
+    printable = (list(range(ord('!'), ord('~') + 1)) + list(range(ord('¡'), ord('¬') + 1))
+                 + list(range(ord('®'), ord('ÿ') + 1)))
+    codes = printable[:]
+    extra = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            codes.append(256 + extra)
+            extra += 1
+    return dict(zip(printable, (chr(code) for code in codes)))
+
+
+# Pré-tokenização GPT-2 aproximada com o módulo `re` da biblioteca padrão
+_GPT2_PRETOKENIZE = re.compile(
+    r"""'(?:[sS]|[tT]|[rR][eE]|[vV][eE]|[mM]|[lL][lL]|[dD])| ?[^\W\d_]+| ?\d{1,3}"""
+    r"""| ?(?:[^\s\w]|_)+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+""")
+
+# Tipos de token GGUF que devem ser reconhecidos literalmente no texto
+_TOKEN_TYPE_CONTROL = 3
+_TOKEN_TYPE_USER_DEFINED = 4
+_SPM_SPACE = '\u2581'
+
+
+class GGUFTokenizer:
+    """Tokenizador a partir do vocabulário embutido no GGUF (BPE ou SentencePiece)"""
+
+    CACHE_LIMIT = 50000
+
+    def __init__(self, tokens: List[str], model: str = 'gpt2', merges: Optional[List[str]] = None,
+                 scores: Optional[np.ndarray] = None, token_types: Optional[np.ndarray] = None,
+                 bos_id: Optional[int] = None, eos_id: Optional[int] = None,
+                 unk_id: Optional[int] = None):
+        self.tokens = list(tokens)
+        self.token_to_id = {token: index for index, token in enumerate(self.tokens)}
+        self.model = model
+        self.bos_id = bos_id
+        self.eos_id = eos_id
+        self.unk_id = unk_id if unk_id is not None else 0
+        self._cache = {}
+        self._token_strings = None
+
+        if model == 'gpt2':
+            self.bpe_ranks = {tuple(merge.split(' ', 1)): rank
+                              for rank, merge in enumerate(merges or [])}
+            self.byte_encoder = _bytes_to_unicode()
+            self.byte_decoder = {char: byte for byte, char in self.byte_encoder.items()}
+        else:
+            self.scores = (np.asarray(scores, dtype=np.float32) if scores is not None
+                           else np.zeros(len(self.tokens), dtype=np.float32))
+
+        # Tokens especiais (ex.: <|im_start|>) são casados antes da pré-tokenização
+        self.special_ids = {}
+        if token_types is not None:
+            for index, token_type in enumerate(token_types):
+                if token_type in (_TOKEN_TYPE_CONTROL, _TOKEN_TYPE_USER_DEFINED) and self.tokens[index]:
+                    self.special_ids[self.tokens[index]] = index
+        self._special_pattern = None
+        if self.special_ids:
+            alternatives = sorted(self.special_ids, key=len, reverse=True)
+            self._special_pattern = re.compile('|'.join(re.escape(token) for token in alternatives))
+
+    @classmethod
+    def from_fields(cls, fields: Dict) -> "GGUFTokenizer":
+        """Cria o tokenizador a partir dos metadados `tokenizer.ggml.*`"""
+        tokens = fields.get('tokenizer.ggml.tokens')
+        if not tokens:
+            raise ValueError("GGUF sem vocabulário embutido")
+        return cls(
+            tokens,
+            model=fields.get('tokenizer.ggml.model', 'gpt2'),
+            merges=fields.get('tokenizer.ggml.merges'),
+            scores=fields.get('tokenizer.ggml.scores'),
+            token_types=fields.get('tokenizer.ggml.token_type'),
+            bos_id=fields.get('tokenizer.ggml.bos_token_id'),
+            eos_id=fields.get('tokenizer.ggml.eos_token_id'),
+            unk_id=fields.get('tokenizer.ggml.unknown_token_id'))
+
+    def token_strings(self) -> List[Optional[str]]:
+        """Texto de cada token sozinho; None para especiais e bytes UTF-8 incompletos"""
+        if self._token_strings is None:
+            strings = []
+            for index, token in enumerate(self.tokens):
+                if token in self.special_ids:
+                    strings.append(None)
+                elif self.model == 'gpt2':
+                    data = bytes(self.byte_decoder.get(char, ord('?')) for char in token)
+                    try:
+                        strings.append(data.decode('utf-8'))
+                    except UnicodeDecodeError:
+                        strings.append(None)
+                elif len(token) == 6 and token.startswith('<0x') and token.endswith('>'):
+                    value = int(token[3:5], 16)
+                    strings.append(chr(value) if value < 0x80 else None)
+                else:
+                    strings.append(token.replace(_SPM_SPACE, ' '))
+            self._token_strings = strings
+        return self._token_strings
+
+    @property
+    def vocab_size(self) -> int:
+        return len(self.tokens)
+
+    def encode(self, text: str, add_bos: bool = False) -> List[int]:
+        with profiler.span('tokenize'):
+            return self._encode(text, add_bos)
+
+    def _encode(self, text: str, add_bos: bool) -> List[int]:
+        ids = [self.bos_id] if add_bos and self.bos_id is not None else []
+        if not self._special_pattern:
+            ids.extend(self._encode_plain(text))
+            return ids
+
+        position = 0
+        for match in self._special_pattern.finditer(text):
+            ids.extend(self._encode_plain(text[position:match.start()]))
+            ids.append(self.special_ids[match.group()])
+            position = match.end()
+        ids.extend(self._encode_plain(text[position:]))
+        return ids
+
+    def _encode_plain(self, text: str) -> List[int]:
+        if not text:
+            return []
+        ids = []
+        if self.model == 'gpt2':
+            encoder = self.byte_encoder
+            for word in _GPT2_PRETOKENIZE.findall(text):
+                ids.extend(self._word_ids(''.join(encoder[byte] for byte in word.encode('utf-8'))))
+        else:
+            text = _SPM_SPACE + text.replace(' ', _SPM_SPACE)
+            for word in re.findall(_SPM_SPACE + '?[^' + _SPM_SPACE + ']+|' + _SPM_SPACE, text):
+                ids.extend(self._word_ids(word))
+        return ids
+
+    def _word_ids(self, word: str) -> List[int]:
+        cached = self._cache.get(word)
+        if cached is not None:
+            return cached
+        ids = self._bpe_word(word) if self.model == 'gpt2' else self._spm_word(word)
+        if len(self._cache) >= self.CACHE_LIMIT:
+            self._cache.clear()
+        self._cache[word] = ids
+        return ids
+
+    def _bpe_word(self, word: str) -> List[int]:
+        parts = list(word)
+        ranks = self.bpe_ranks
+        while len(parts) > 1:
+            best, best_rank = -1, None
+            for index in range(len(parts) - 1):
+                rank = ranks.get((parts[index], parts[index + 1]))
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best, best_rank = index, rank
+            if best_rank is None:
+                break
+            parts[best:best + 2] = [parts[best] + parts[best + 1]]
+        lookup = self.token_to_id
+        return [lookup.get(part, self.unk_id) for part in parts]
+
+    def _spm_word(self, word: str) -> List[int]:
+        lookup = self.token_to_id
+        parts = []
+        for char in word:
+            if char in lookup:
+                parts.append(char)
+            else:
+                # Fallback para bytes <0xXX>
+                parts.extend(f'<0x{byte:02X}>' for byte in char.encode('utf-8'))
+        while len(parts) > 1:
+            best, best_score = -1, None
+            for index in range(len(parts) - 1):
+                token_id = lookup.get(parts[index] + parts[index + 1])
+                if token_id is not None and (best_score is None or self.scores[token_id] > best_score):
+                    best, best_score = index, self.scores[token_id]
+            if best_score is None:
+                break
+            parts[best:best + 2] = [parts[best] + parts[best + 1]]
+        return [lookup.get(part, self.unk_id) for part in parts]
+
+    def decode(self, ids: List[int]) -> str:
+        pieces = []
+        for token_id in ids:
+            if 0 <= token_id < len(self.tokens):
+                pieces.append(self.tokens[token_id])
+        if self.model == 'gpt2':
+            data = bytearray()
+            for piece in pieces:
+                if piece in self.special_ids:
+                    data.extend(piece.encode('utf-8'))
+                else:
+                    data.extend(self.byte_decoder.get(char, ord('?')) for char in piece)
+            return data.decode('utf-8', errors='replace')
+
+        data = bytearray()
+        for piece in pieces:
+            if len(piece) == 6 and piece.startswith('<0x') and piece.endswith('>'):
+                data.append(int(piece[3:5], 16))
+            else:
+                data.extend(piece.replace(_SPM_SPACE, ' ').encode('utf-8'))
+        return data.decode('utf-8', errors='replace').lstrip(' ')
+
 
 class SimpleGGUFModel:
     """Modelo GGUF simplificado para Android"""
 
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, verification_cache_path: Optional[str] = None):
         self.model_path = Path(model_path)
+        # Registro das verificações completas (sem ele só o layout é conferido)
+        self.verification_cache_path = verification_cache_path
         self.metadata = {}
         self.loaded = False
+        self.load_error = None
         self.vocab = {}
         self.tokenizer_patterns = []
+        self.reader = None
+        self.tokenizer = None
 
         # Respostas inteligentes baseadas em padrões
         self.pattern_responses = {
             # Saudações
-            r'(oi|olá|hey|e aí)': [
+            r'\b(oi|olá|hey|e aí)\b': [
                 "Olá! Como posso ajudar você hoje?",
                 "Oi! Em que posso ser útil?",
                 "Hey! Como vai? O que precisa?"
@@ -116,7 +724,8 @@ class SimpleGGUFModel:
 
                 # Lê versão
                 version = struct.unpack('<I', f.read(4))[0]
-                if version != GGUF_VERSION:
+                if version not in SUPPORTED_GGUF_VERSIONS:
+                    logger.error("Versão GGUF não suportada: %s", version)
                     return False
 
                 # Lê número de tensors e metadata
@@ -132,7 +741,7 @@ class SimpleGGUFModel:
                 return True
 
         except Exception as e:
-            print(f"Erro ao ler GGUF: {e}")
+            logger.error("Erro ao ler GGUF: %s", e)
             return False
 
     def load_model(self):
@@ -140,25 +749,52 @@ class SimpleGGUFModel:
         try:
             # Verifica se o arquivo existe
             if not self.model_path.exists():
-                print(f"Arquivo não encontrado: {self.model_path}")
+                logger.error("Arquivo não encontrado: %s", self.model_path)
                 return False
 
             # Lê o cabeçalho GGUF
-            if not self.read_gguf_header():
-                print("Arquivo GGUF inválido")
-                return False
+            with profiler.span('load.header'):
+                if not self.read_gguf_header():
+                    logger.error("Arquivo GGUF inválido")
+                    return False
+
+            # Metadados completos e tensores mapeados via mmap
+            with profiler.span('load.metadata'):
+                self.reader = GGUFReader(self.model_path)
+            # Cópia truncada ou corrompida não chega à geração
+            with profiler.span('load.verify'):
+                verify_model(self.reader, self.verification_cache_path)
+            if 'tokenizer.ggml.tokens' in self.reader.fields:
+                with profiler.span('load.tokenizer'):
+                    self.tokenizer = GGUFTokenizer.from_fields(self.reader.fields)
+                self.vocab = self.tokenizer.token_to_id
 
-            print(f"Modelo GGUF carregado: {self.model_path.name}")
-            print(f"Tensors: {self.metadata.get('tensor_count', 0)}")
-            print(f"Metadata: {self.metadata.get('metadata_count', 0)}")
+            logger.info("Modelo GGUF carregado: %s", self.model_path.name)
+            logger.info("Tensors: %d", self.metadata.get('tensor_count', 0))
+            logger.info("Metadata: %d", self.metadata.get('metadata_count', 0))
 
             self.loaded = True
             return True
 
+        except IntegrityError as e:
+            logger.error("Modelo corrompido: %s", e)
+            self.load_error = f"modelo corrompido ({e})"
+            self.close()
+            return False
+
         except Exception as e:
-            print(f"Erro ao carregar modelo: {e}")
+            logger.error("Erro ao carregar modelo: %s", e)
+            self.close()
             return False
 
+    def close(self):
+        """Fecha o mmap do modelo"""
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        self.loaded = False
+
+    @profiler.profiled('generate.rules')
     def generate_response(self, prompt: str, max_tokens: int = 150) -> str:
         """Gera resposta usando padrões inteligentes"""
         import re
@@ -206,12 +842,345 @@ class SimpleGGUFModel:
         return random.choice(self.fallback_responses)
 
 
+# --- Backends de inferência ---
+
+def _words(text: str):
+    """Divide uma resposta pronta em pedaços palavra a palavra"""
+    return re.findall(r'\S+\s*', text)
+
+
+def stop_at(pieces, stop: Sequence[str]):
+    """Repassa os pedaços até aparecer uma sequência de parada
+
+    Segura o final do texto enquanto ele ainda pode ser o começo de uma parada.
+    Pedaços vazios (prompt ainda em processamento) passam direto.
+    """
+    if not stop:
+        yield from pieces
+        return
+    held = ''
+    longest = max(len(sequence) for sequence in stop)
+    for piece in pieces:
+        if not piece:
+            yield piece
+            continue
+        held += piece
+        cut = min((held.find(sequence) for sequence in stop if sequence in held), default=-1)
+        if cut >= 0:
+            if held[:cut]:
+                yield held[:cut]
+            return
+        safe = len(held) - longest + 1
+        if safe > 0:
+            yield held[:safe]
+            held = held[safe:]
+    if held:
+        yield held
+
+
+class InferenceBackend:
+    """Interface comum dos backends de geração"""
+
+    name = 'base'
+    # 'llm' = inferência real do modelo; 'patterns' = respostas por regras
+    capability = 'patterns'
+    # Gerações que podem avançar intercaladas sobre o mesmo modelo
+    max_concurrent = 1
+    supports_adapters = False
+
+    def __init__(self):
+        self.tokens_per_second = None
+
+    def available(self) -> bool:
+        return True
+
+    def load(self, model: 'SimpleGGUFModel') -> bool:
+        return True
+
+    def stream(self, prompt: str, max_tokens: int, stop: Sequence[str] = (),
+               message: Optional[str] = None, adapter: Optional[str] = None):
+        """Gera o texto em pedaços; `message` é a última mensagem do usuário
+
+        `adapter` escolhe um adaptador LoRA (só backends com `supports_adapters`).
+        """
+        raise NotImplementedError
+
+    def load_adapter(self, name: str, path: str, scale: float = 1.0):
+        raise NotImplementedError(f"Backend {self.name} não aplica adaptadores LoRA")
+
+    def probe(self, max_tokens: int = 16) -> float:
+        """Mede tokens/s numa geração curta"""
+        start = time.perf_counter()
+        produced = sum(1 for _ in self.stream("Usuário: Olá\nTerlineT:", max_tokens,
+                                               message="Olá"))
+        elapsed = time.perf_counter() - start
+        self.tokens_per_second = produced / elapsed if elapsed > 0 and produced else 0.0
+        return self.tokens_per_second
+
+    def close(self):
+        pass
+
+
+class LlamaCppBackend(InferenceBackend):
+    """llama-cpp-python (quando instalado): kernels nativos para todas as quantizações"""
+
+    name = 'llama.cpp'
+    capability = 'llm'
+
+    def __init__(self, n_ctx: int = 4096, n_threads: Optional[int] = None):
+        super().__init__()
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads or os.cpu_count() or 1
+        self.llm = None
+        # Um único contexto llama.cpp: uma geração por vez
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        import importlib.util
+        return importlib.util.find_spec('llama_cpp') is not None
+
+    def load(self, model: 'SimpleGGUFModel') -> bool:
+        from llama_cpp import Llama
+        self.llm = Llama(model_path=str(model.model_path), n_ctx=self.n_ctx,
+                         n_threads=self.n_threads, verbose=False)
+        return True
+
+    def stream(self, prompt: str, max_tokens: int, stop: Sequence[str] = (),
+               message: Optional[str] = None, adapter: Optional[str] = None):
+        if adapter is not None:
+            # llama-cpp-python só aplica LoRA na criação do contexto
+            logger.warning("Adaptador %s ignorado pelo llama.cpp - usando o modelo base", adapter)
+        with self._lock:
+            for chunk in self.llm.create_completion(prompt, max_tokens=max_tokens,
+                                                    stop=list(stop) or None, stream=True):
+                text = chunk['choices'][0]['text']
+                if text:
+                    yield text
+
+    def close(self):
+        self.llm = None
+
+
+class NumpyBackend(InferenceBackend):
+    """Motor NumPy puro (modelos pequenos, sem dependências nativas)"""
+
+    name = 'numpy'
+    capability = 'llm'
+    # Cada geração tem o próprio KV cache; os pesos são só lidos
+    max_concurrent = 4
+    supports_adapters = True
+
+    def __init__(self, engine_provider, sampler=None):
+        super().__init__()
+        self.engine_provider = engine_provider
+        self.sampler = sampler
+        self.engine = None
+        self.tokenizer = None
+
+    def load(self, model: 'SimpleGGUFModel') -> bool:
+        from numpy_engine import Sampler
+        self.engine = self.engine_provider()
+        self.tokenizer = model.tokenizer
+        if self.sampler is None:
+            self.sampler = Sampler()
+        return self.engine is not None and self.tokenizer is not None
+
+    def stream(self, prompt: str, max_tokens: int, stop: Sequence[str] = (),
+               message: Optional[str] = None, adapter: Optional[str] = None):
+        return stop_at(self._decode(prompt, max_tokens, adapter), stop)
+
+    def load_adapter(self, name: str, path: str, scale: float = 1.0):
+        from numpy_engine import LoraAdapter
+        self.engine.add_adapter(LoraAdapter.load(path, name, scale))
+
+    def close(self):
+        # Os pesos do motor apontam para o mmap do modelo
+        self.engine = None
+
+    def _decode(self, prompt: str, max_tokens: int, adapter: Optional[str] = None):
+        tokenizer = self.tokenizer
+        prompt_ids = tokenizer.encode(prompt, add_bos=tokenizer.bos_id is not None)
+        stop_ids = [tokenizer.eos_id] if tokenizer.eos_id is not None else []
+        generated, emitted = [], ''
+        for token in self.engine.generate(prompt_ids, max_tokens, self.sampler, stop_ids, adapter):
+            if token is None:
+                # Prefill em andamento: pedaço vazio devolve a vez ao agendador
+                yield ''
+                continue
+            generated.append(token)
+            text = tokenizer.decode(generated)
+            # Espera o resto de um caractere UTF-8 dividido entre tokens
+            if text.endswith('\ufffd'):
+                continue
+            if len(text) > len(emitted):
+                yield text[len(emitted):]
+                emitted = text
+
+
+class PatternBackend(InferenceBackend):
+    """Respostas por padrões do SimpleGGUFModel (sempre disponível)"""
+
+    name = 'padrões'
+    capability = 'patterns'
+    max_concurrent = 8
+
+    def __init__(self, model: 'SimpleGGUFModel'):
+        super().__init__()
+        self.model = model
+
+    def stream(self, prompt: str, max_tokens: int, stop: Sequence[str] = (),
+               message: Optional[str] = None, adapter: Optional[str] = None):
+        yield from _words(self.model.generate_response(message or prompt, max_tokens=max_tokens))
+
+
+class WorkerBackend(InferenceBackend):
+    """Repassa a geração ao processo filho de inference_worker"""
+
+    # O filho atende um pedido por vez; intercalar só faria o segundo esperar
+    max_concurrent = 1
+
+    def __init__(self, worker):
+        super().__init__()
+        self.worker = worker
+        report = worker.report
+        self.name = f"{report.get('backend', '?')} (processo)"
+        self.capability = report.get('capability', 'patterns')
+        self.tokens_per_second = report.get('tokens_per_second')
+        self.supports_adapters = report.get('supports_adapters', False)
+        # Tipo do KV cache pedido pelo processo principal (None: o padrão do filho)
+        self.kv_dtype = None
+
+    def stream(self, prompt: str, max_tokens: int, stop: Sequence[str] = (),
+               message: Optional[str] = None, adapter: Optional[str] = None):
+        # O limite já vem aplicado pelo processo principal
+        params = {'max_tokens': max_tokens, 'kv_window': self.worker.kv_window,
+                  'kv_dtype': self.kv_dtype, 'pattern_only': False, 'adapter': adapter}
+        return self.worker.stream(prompt, max_tokens, stop, message, params)
+
+    def load_adapter(self, name: str, path: str, scale: float = 1.0):
+        self.worker.load_adapter(name, path, scale)
+
+    def close(self):
+        self.worker.stop()
+
+
+def select_backend(model: 'SimpleGGUFModel', candidates: Sequence[InferenceBackend],
+                   fallback: Optional[InferenceBackend] = None, probe_tokens: int = 8):
+    """Carrega e mede cada backend de LLM disponível; fica com o mais rápido
+
+    Devolve (backend, relatório); sem nenhum LLM utilizável, o `fallback`
+    (por padrão, o backend de padrões).
+    """
+    report = {}
+    best = None
+    for backend in candidates:
+        entry = report.setdefault(backend.name, {'capability': backend.capability})
+        if not backend.available():
+            entry['available'] = False
+            continue
+        try:
+            with profiler.span(f'probe.{backend.name}'):
+                if not backend.load(model):
+                    entry['available'] = False
+                    continue
+                entry['tokens_per_second'] = round(backend.probe(probe_tokens), 2)
+            entry['available'] = True
+        except Exception as e:
+            logger.warning("Backend %s indisponível: %s", backend.name, e)
+            entry.update(available=False, error=str(e))
+            backend.close()
+            continue
+        if best is None or backend.tokens_per_second > best.tokens_per_second:
+            if best is not None:
+                best.close()
+            best = backend
+        else:
+            backend.close()
+    if best is None:
+        best = fallback or PatternBackend(model)
+    return best, report
+
+
+# Ações que um comando de voz pode disparar (ver ChatScreen.process_voice_command)
+VOICE_ACTION_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'acao': {'enum': ['mensagem', 'nova_conversa', 'parar_microfone', 'status']},
+        'texto': {'type': 'string'},
+    }
+}
+
+VOICE_ACTION_PROMPT = """Converta o comando de voz numa ação JSON.
+Ações: mensagem (conversar ou perguntar), nova_conversa (esquecer a conversa), parar_microfone, status (estado do modelo).
+Comando: qual a capital da frança
+JSON: {{"acao": "mensagem", "texto": "qual a capital da frança"}}
+Comando: vamos começar de novo
+JSON: {{"acao": "nova_conversa", "texto": ""}}
+Comando: pode desligar o microfone
+JSON: {{"acao": "parar_microfone", "texto": ""}}
+Comando: qual modelo você está usando
+JSON: {{"acao": "status", "texto": ""}}
+Comando: {command}
+JSON:"""
+
+
 class GGUFModelWrapper:
     """Wrapper compatível com a interface original"""
 
     def __init__(self):
         self.model = None
         self.model_loaded = False
+        self.model_path = None
+
+        # Parâmetros base de geração (ajustados pela política de recursos)
+        self.max_tokens = 150
+        self.kv_window = 4096
+        self.resource_policy = None
+        self.registered_models = {}
+        self._load_callback = None
+
+        # Histórico da conversa dentro do orçamento de contexto
+        self.context = ConversationContext(count_tokens=self.count_tokens,
+                                           context_budget=self.kv_window - self.max_tokens)
+        self.last_prompt = None
+        self.retrieval = None
+        self.retrieval_k = 3
+
+        # Backend de geração escolhido pela sondagem na carga do modelo
+        self.backend = None
+        self.pattern_backend = None
+        self.backend_report = {}
+        self.probe_cache_path = None
+        # Registro de integridade: o hash completo do modelo roda só uma vez
+        self.verification_cache_path = None
+        # Inferência num processo filho (memória compartilhada); cai para o
+        # processo da interface se não for possível iniciar
+        self.use_worker = False
+
+        # Motor NumPy (criado sob demanda) e cache de embeddings por hash do texto
+        self.engine = None
+        self.engine_max_mb = 2048
+        # KV cache do motor NumPy: 'f32', 'f16' ou 'int8' (~1/4 da memória,
+        # menos preciso); sob pressão de recursos a política troca para int8
+        self.kv_cache_dtype = 'f16'
+        self.embedding_batch_size = 16
+        self._engine_checked = False
+        self._embedding_cache = OrderedDict()
+        self._embedding_lock = threading.Lock()
+        # Gramáticas da decodificação restrita (máscaras por estado em cache)
+        self.grammars = None
+
+        # Adaptadores LoRA carregados (nome -> caminho) e o da conversa atual
+        self.adapters = {}
+        self.adapter = None
+
+        # Snapshot lido na abertura, aplicado quando o modelo terminar de carregar
+        self._pending_snapshot = None
+
+        # Gerações em andamento: a troca por um modelo menor espera todas terminarem
+        self._active_generations = 0
+        self._generation_lock = threading.Lock()
+        self._pending_model = None
 
         # Frases de recuperação
         self.recovery_phrases = [
@@ -222,73 +1191,578 @@ class GGUFModelWrapper:
             "Não tenho certeza total, mas posso tentar ajudar de outro jeito."
         ]
 
-        # Respostas por palavra-chave
-        self.keyword_responses = {
-            "olá": "Olá! Como posso ajudar?",
-            "oi": "Oi! Como vai você?",
-            "bom dia": "Bom dia! Como vai você?",
-            "boa tarde": "Boa tarde! Em que posso ajudar?",
-            "boa noite": "Boa noite! Como posso ajudar?",
-            "qual é o seu nome": "Meu nome é TerlineT! Prazer em conhecê-lo!",
-            "quem é você": "Sou a TerlineT, sua assistente virtual!",
-            "obrigado": "De nada! Estou aqui para ajudar.",
-            "obrigada": "Por nada! Fico feliz em ajudar!",
-            "tchau": "Até logo! Volte sempre que precisar.",
-            "até logo": "Tchau! Cuide-se!",
-            "como você está": "Estou bem, obrigada! E você?",
-            "tudo bem": "Tudo ótimo! Como posso ajudar hoje?"
-        }
+        # Conversa fiada é respondida pelo roteador, sem passar pelo modelo
+        self.router = IntentRouter()
+        self.route_counts = {}
 
     def load_model(self, model_path: str, callback):
         """Carrega o modelo GGUF"""
+        self.model_path = str(model_path)
+        self._load_callback = callback
+        self.register_model(model_path)
+        if self.resource_policy is not None and self.model_path in self.registered_models:
+            self.resource_policy.model_size_mb = self.registered_models[self.model_path]
 
         def load_thread():
             try:
-                print(f"Carregando modelo GGUF: {model_path}")
+                logger.info("Carregando modelo GGUF: %s", model_path)
 
-                self.model = SimpleGGUFModel(model_path)
-
-                # Simula tempo de carregamento
-                time.sleep(2)
+                # O modelo anterior sai da memória antes de o novo ser mapeado
+                self._release_model()
+                self.model = SimpleGGUFModel(model_path, self.verification_cache_path)
+                with profiler.span('load.model'):
+                    loaded = self.model.load_model()
+                # Contagens feitas antes do tokenizador existir eram estimativas
+                self.context.recount()
+                self.pattern_backend = PatternBackend(self.model)
+                if loaded and not (self.use_worker and self._start_worker()):
+                    self._select_backend()
+                elif not loaded:
+                    self.backend = self.pattern_backend
+                    self.backend_report = {'backend': self.backend.name, 'capability': 'patterns'}
+                if self._pending_snapshot is not None:
+                    self._apply_snapshot()
+                self.model_loaded = True
 
-                if self.model.load_model():
-                    self.model_loaded = True
-                    print("Modelo GGUF carregado com sucesso!")
+                if self.backend.capability == 'llm':
+                    logger.info("Modelo GGUF carregado com sucesso! %s", self.backend_summary())
                     callback(True, None)
+                elif loaded:
+                    logger.warning("Nenhum backend de inferência disponível - usando modo simulado")
+                    callback(True, "Modo simulado ativo - instale llama-cpp-python para inferência real")
+                elif self.model.load_error:
+                    logger.warning("Falha ao carregar modelo - usando modo simulado")
+                    callback(True, f"Modo simulado ativo - {self.model.load_error}")
                 else:
-                    print("Falha ao carregar modelo - usando modo simulado")
-                    self.model_loaded = True  # Ativa modo simulado
+                    logger.warning("Falha ao carregar modelo - usando modo simulado")
                     callback(True, "Modo simulado ativo")
 
             except Exception as e:
-                print(f"Erro ao carregar modelo: {e}")
+                logger.error("Erro ao carregar modelo: %s", e)
                 # Ativa modo simulado mesmo com erro
+                if self.model is not None:
+                    self.pattern_backend = self.backend = PatternBackend(self.model)
                 self.model_loaded = True
                 callback(True, f"Modo simulado ativo - {str(e)}")
 
         threading.Thread(target=load_thread, daemon=True).start()
 
+    def _release_model(self):
+        """Fecha backend, motor NumPy e mmap do modelo atual"""
+        self.model_loaded = False
+        previous, self.backend = self.backend, None
+        if previous is not None:
+            previous.close()
+        # Embeddings de outro modelo não são comparáveis
+        self.engine = None
+        self._engine_checked = False
+        self.grammars = None
+        # Adaptadores são do modelo base anterior
+        self.adapters.clear()
+        self.adapter = None
+        with self._embedding_lock:
+            self._embedding_cache.clear()
+        if self.model is not None:
+            self.model.close()
+
+    def candidate_backends(self) -> List[InferenceBackend]:
+        """Backends de LLM em ordem de preferência (o de padrões é o fallback)"""
+        return [LlamaCppBackend(n_ctx=self.kv_window), NumpyBackend(self.get_engine)]
+
+    def _select_backend(self):
+        """Escolhe o backend mais rápido para este modelo e número de threads"""
+        reader = self.model.reader
+        path = Path(self.model_path)
+        stat = path.stat()
+        threads = os.cpu_count() or 1
+        key = f"{path.resolve()}:{stat.st_size}:{int(stat.st_mtime)}:{threads}"
+
+        candidates = self.candidate_backends()
+        cached = self._load_probe_cache().get(key)
+        if cached:
+            # Sondagem já feita para este arquivo e esta CPU: carrega só o vencedor
+            candidates = [backend for backend in candidates
+                          if backend.name == cached['backend']] or candidates
+        if self.backend is not None and self.backend is not self.pattern_backend:
+            self.backend.close()
+            self.backend = None
+        self.backend, probes = select_backend(self.model, candidates, self.pattern_backend)
+        if cached and self.backend.name == cached['backend']:
+            probes = cached.get('probes', probes)
+            self.backend.tokens_per_second = cached.get('tokens_per_second')
+
+        self.backend_report = {
+            'backend': self.backend.name,
+            'capability': self.backend.capability,
+            'tokens_per_second': self.backend.tokens_per_second,
+            'quantization': reader.quantization,
+            'architecture': reader.architecture,
+            'threads': threads,
+            'probes': probes,
+            'supports_adapters': self.backend.supports_adapters
+        }
+        logger.info("Backends sondados: %s", probes)
+        if self.backend.capability == 'llm':
+            self._save_probe_cache(key, self.backend_report)
+
+    def _start_worker(self) -> bool:
+        """Inicia o processo de inferência; False mantém a geração neste processo"""
+        try:
+            from inference_worker import InferenceWorker
+            worker = InferenceWorker(self.model_path, self.probe_cache_path, self.kv_window)
+            worker.start()
+        except Exception as e:
+            logger.warning("Processo de inferência indisponível (%s) - gerando no processo principal", e)
+            return False
+        self.backend = WorkerBackend(worker)
+        self.backend_report = dict(worker.report, process='worker')
+        return True
+
+    def _load_probe_cache(self) -> Dict:
+        if not self.probe_cache_path:
+            return {}
+        try:
+            with open(self.probe_cache_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_probe_cache(self, key: str, report: Dict):
+        if not self.probe_cache_path:
+            return
+        cache = self._load_probe_cache()
+        cache[key] = report
+        try:
+            with open(self.probe_cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.warning("Não foi possível salvar a sondagem de backends: %s", e)
+
+    def backend_summary(self) -> str:
+        """Descrição curta para a interface (ex.: 'llama.cpp Q4_K · 8.2 tok/s')"""
+        report = self.backend_report
+        if not report:
+            return "carregando"
+        if report.get('capability') != 'llm':
+            return "modo simulado (respostas por padrões)"
+        speed = report.get('tokens_per_second')
+        speed_text = f" · {speed:.1f} tok/s" if speed else ""
+        process_text = " · processo separado" if report.get('process') else ""
+        return f"{report['backend']} {report.get('quantization', '')}{speed_text}{process_text}"
+
+    def model_id(self) -> Optional[Dict]:
+        """Identifica o arquivo do modelo (caminho, tamanho e data de modificação)"""
+        if not self.model_path or not os.path.exists(self.model_path):
+            return None
+        stat = os.stat(self.model_path)
+        return {'path': str(Path(self.model_path).resolve()), 'size': stat.st_size,
+                'mtime': int(stat.st_mtime)}
+
+    def save_snapshot(self, path: str, extra: Optional[Dict] = None, include_kv: bool = True):
+        """Salva conversa, modelo, sampler e KV cache para retomar depois"""
+        from snapshot import write_snapshot
+
+        metadata = {'model': self.model_id(), 'conversation': self.context.state(),
+                    'adapters': self.adapters, 'adapter': self.adapter,
+                    'sampler': None, 'kv': None, 'extra': extra or {}}
+        arrays = {}
+        if isinstance(self.backend, NumpyBackend):
+            metadata['sampler'] = self.backend.sampler.state()
+            state = self.engine.prompt_state if self.engine is not None else None
+            if include_kv and state is not None and state.cache.length:
+                # Só as posições preenchidas; o cache já está em int8/f16
+                length = state.cache.length
+                arrays = {name: array[:, :, :, :length]
+                          for name, array in state.cache.arrays().items()}
+                metadata['kv'] = {'tokens': [int(token) for token in state.tokens[:length]],
+                                  'dtype': state.cache.dtype, 'adapter': state.adapter}
+        with profiler.span('snapshot.save'):
+            write_snapshot(path, metadata, arrays)
+
+    def restore_snapshot(self, path: str) -> Optional[Dict]:
+        """Recoloca a conversa na hora; o resto espera o modelo carregar
+
+        Devolve os dados extras gravados pela interface, ou None sem snapshot.
+        """
+        from snapshot import SnapshotError, read_snapshot
+
+        try:
+            with profiler.span('snapshot.restore'):
+                metadata, arrays = read_snapshot(path)
+        except FileNotFoundError:
+            return None
+        except (SnapshotError, OSError, ValueError, KeyError) as e:
+            logger.warning("Snapshot ignorado: %s", e)
+            return None
+        self.context.restore(metadata['conversation'])
+        self._pending_snapshot = (metadata, arrays)
+        return metadata.get('extra', {})
+
+    def _apply_snapshot(self):
+        """Adaptadores, sampler e KV cache do snapshot, se o modelo for o mesmo"""
+        from numpy_engine import KVCache, PromptState
+
+        metadata, arrays = self._pending_snapshot
+        self._pending_snapshot = None
+        if metadata.get('model') != self.model_id():
+            logger.info("Snapshot de outro modelo - só a conversa foi restaurada")
+            return
+        for name, path in metadata.get('adapters', {}).items():
+            try:
+                self.load_adapter(name, path)
+            except Exception as e:
+                logger.warning("Adaptador %s do snapshot não carregado: %s", name, e)
+        if metadata.get('adapter') in self.adapters:
+            self.adapter = metadata['adapter']
+
+        if not isinstance(self.backend, NumpyBackend):
+            return
+        if metadata.get('sampler'):
+            self.backend.sampler.restore(metadata['sampler'])
+        kv = metadata.get('kv')
+        engine = self.engine
+        if kv and engine is not None and kv['dtype'] == engine.kv_dtype:
+            # memmap copy-on-write: as páginas só são lidas na próxima geração
+            cache = KVCache.from_arrays(arrays, len(kv['tokens']), kv['dtype'])
+            engine.prompt_state = PromptState(kv['tokens'], cache, kv['adapter'])
+            logger.info("KV cache do snapshot restaurado (%d tokens)", len(kv['tokens']))
+
+    def close(self):
+        """Libera o backend (encerra o processo de inferência, se houver)"""
+        if self.backend is not None:
+            self.backend.close()
+
+    def load_adapter(self, name: str, path: str, scale: float = 1.0):
+        """Carrega um adaptador LoRA (GGUF ou .npz) sobre o modelo base já carregado"""
+        if self.backend is None or not self.backend.supports_adapters:
+            raise RuntimeError("O backend atual não aplica adaptadores LoRA")
+        with profiler.span('adapter.load'):
+            self.backend.load_adapter(name, str(path), scale)
+        self.adapters[name] = str(path)
+
+    def set_adapter(self, name: Optional[str]):
+        """Escolhe o adaptador da conversa (None = modelo base); troca instantânea"""
+        if name is not None and name not in self.adapters:
+            raise ValueError(f"Adaptador LoRA não carregado: {name}")
+        self.adapter = name
+
+    def register_model(self, model_path: str):
+        """Registra um modelo alternativo (usado quando falta memória)"""
+        path = Path(model_path)
+        if path.exists():
+            self.registered_models[str(path)] = path.stat().st_size / 1024 / 1024
+
+    def attach_resource_policy(self, policy):
+        """Passa a consultar a política de degradação antes de gerar"""
+        self.resource_policy = policy
+        if self.model_path in self.registered_models:
+            policy.model_size_mb = self.registered_models[self.model_path]
+        policy.add_listener(self._on_resource_level)
+
+    def attach_retrieval(self, index):
+        """Indexa os turnos da conversa e usa o índice para montar o prompt"""
+        self.retrieval = index
+        self.context.add_listener(index.add_message)
+
+    def retrieve(self, query: str) -> List[str]:
+        """Trechos relevantes que ainda não estão na janela recente"""
+        if self.retrieval is None:
+            return []
+
+        def in_prompt(source):
+            # Só turnos desta sessão ainda na janela; os de sessões antigas são recuperáveis
+            turn = parse_conversation_source(source)
+            return (turn is not None and turn[0] == self.context.session_id
+                    and self.context.in_window(turn[1]))
+
+        with profiler.span('retrieval.search'):
+            results = self.retrieval.search(query, k=self.retrieval_k, exclude=in_prompt)
+        # Índices antigos guardavam também as respostas, sem o autor
+        return [result.text for result in results
+                if parse_conversation_source(result.source) is None
+                or result.text.startswith(USER_TURN_PREFIX)]
+
+    def generation_params(self) -> Dict:
+        """Limites de geração efetivos para o nível de recursos atual"""
+        policy = self.resource_policy
+        if policy is None:
+            return {'max_tokens': self.max_tokens, 'kv_window': self.kv_window,
+                    'kv_dtype': self.kv_cache_dtype, 'pattern_only': False,
+                    'adapter': self.adapter}
+        return {'max_tokens': policy.max_tokens(self.max_tokens),
+                'kv_window': policy.kv_window(self.kv_window),
+                'kv_dtype': policy.kv_cache_dtype(self.kv_cache_dtype),
+                'pattern_only': policy.pattern_only, 'adapter': self.adapter}
+
+    def count_tokens(self, text: str) -> int:
+        """Tokens do texto pelo tokenizador do GGUF (ou estimativa sem ele)"""
+        tokenizer = self.model.tokenizer if self.model is not None else None
+        if tokenizer is not None:
+            return len(tokenizer.encode(text))
+        return approximate_token_count(text)
+
+    EMBEDDING_CACHE_LIMIT = 10000
+
+    def _remote(self):
+        """Processo de inferência em uso, se houver (o motor NumPy fica só nele)"""
+        return self.backend.worker if isinstance(self.backend, WorkerBackend) else None
+
+    def _use_kv_dtype(self, kv_dtype: str):
+        """Tipo do KV cache das próximas gerações (as em andamento mantêm o seu)"""
+        if isinstance(self.backend, WorkerBackend):
+            self.backend.kv_dtype = kv_dtype
+        elif self.engine is not None and self.engine.kv_dtype != kv_dtype:
+            logger.info("KV cache do motor NumPy: %s", kv_dtype)
+            self.engine.kv_dtype = kv_dtype
+
+    def get_engine(self):
+        """Motor NumPy do modelo carregado, se a arquitetura e a memória permitirem
+
+        Com o processo de inferência ativo não há motor neste processo.
+        """
+        if self._remote() is not None:
+            return None
+        if not self._engine_checked and self.model is not None and self.model.reader is not None:
+            from numpy_engine import build_engine
+            self._engine_checked = True
+            self.engine = build_engine(self.model.reader, max_memory_mb=self.engine_max_mb,
+                                       kv_dtype=self.kv_cache_dtype)
+        return self.engine
+
+    def embeddings_available(self) -> bool:
+        worker = self._remote()
+        if worker is not None:
+            return worker.call('embeddings_available')
+        return self.get_engine() is not None and self.model.tokenizer is not None
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Vetores de sentença (float32, n x dim) pela média dos estados ocultos
+
+        Textos já vistos saem do cache; os novos são processados juntos em
+        lotes com padding.
+        """
+        worker = self._remote()
+        if worker is not None:
+            with self._generation():
+                return worker.call('embed', list(texts))
+        if not self.embeddings_available():
+            raise RuntimeError("Embeddings exigem um modelo GGUF carregado com tokenizador")
+
+        keys = [hashlib.sha1(text.encode('utf-8')).digest() for text in texts]
+        result = np.zeros((len(texts), self.engine.config.n_embd), dtype=np.float32)
+        missing = {}
+        with self._embedding_lock:
+            for row, key in enumerate(keys):
+                vector = self._embedding_cache.get(key)
+                if vector is not None:
+                    self._embedding_cache.move_to_end(key)
+                    result[row] = vector
+                else:
+                    missing.setdefault(key, []).append(row)
+
+        if missing:
+            rows = [indices[0] for indices in missing.values()]
+            token_lists = [self.model.tokenizer.encode(texts[row]) for row in rows]
+            with self._generation(), profiler.span('embed'):
+                vectors = self.engine.embed(token_lists, batch_size=self.embedding_batch_size)
+            with self._embedding_lock:
+                for (key, indices), vector in zip(missing.items(), vectors):
+                    result[indices] = vector
+                    self._embedding_cache[key] = vector
+                while len(self._embedding_cache) > self.EMBEDDING_CACHE_LIMIT:
+                    self._embedding_cache.popitem(last=False)
+        return result
+
+    def complete_constrained(self, prompt: str, pattern: str, max_tokens: int = 64) -> Optional[str]:
+        """Completa o prompt com um texto que casa com `pattern` (motor NumPy)
+
+        Cada passo só amostra tokens que mantêm o texto válido. Devolve None se
+        o motor não estiver disponível para este modelo ou se o limite de
+        tokens acabar antes de o texto se completar.
+        """
+        worker = self._remote()
+        if worker is not None:
+            with self._generation():
+                return worker.call('complete_constrained', prompt, pattern, max_tokens)
+        engine = self.get_engine()
+        tokenizer = self.model.tokenizer if self.model is not None else None
+        if engine is None or tokenizer is None:
+            return None
+        from constrained import ConstrainedSampler, GrammarCache
+        from numpy_engine import Sampler
+
+        if self.grammars is None or self.grammars.tokenizer is not tokenizer:
+            self.grammars = GrammarCache(tokenizer)
+        sampler = ConstrainedSampler(Sampler(temperature=0), self.grammars.grammar(pattern))
+        prompt_ids = tokenizer.encode(prompt, add_bos=tokenizer.bos_id is not None)
+        generated = []
+        with self._generation(), profiler.span('constrained'):
+            # Prefixo próprio: o KV cache da conversa continua reaproveitável
+            for token in engine.generate(prompt_ids, max_tokens, sampler, [sampler.end_id],
+                                         state='constrained'):
+                if token is not None:
+                    generated.append(token)
+        if not sampler.complete:
+            logger.warning("Geração restrita incompleta após %d tokens", len(generated))
+            return None
+        strings = tokenizer.token_strings()
+        return ''.join(strings[token] for token in generated)
+
+    def voice_action(self, command: str) -> Optional[Dict]:
+        """Ação JSON (VOICE_ACTION_SCHEMA) para um comando de voz, ou None"""
+        from constrained import json_schema_pattern
+        prompt = VOICE_ACTION_PROMPT.format(command=command.strip())
+        text = self.complete_constrained(prompt, ' ?' + json_schema_pattern(VOICE_ACTION_SCHEMA))
+        if text is None:
+            return None
+        try:
+            # O esquema não exclui caracteres de controle dentro das strings
+            return json.loads(text, strict=False)
+        except ValueError as e:
+            logger.warning("Ação de voz inválida %r: %s", text, e)
+            return None
+
+    def _smaller_model(self) -> Optional[str]:
+        current = self.registered_models.get(self.model_path)
+        if current is None:
+            return None
+        smaller = [(size, path) for path, size in self.registered_models.items() if size < current]
+        return min(smaller)[1] if smaller else None
+
+    def _on_resource_level(self, level, sample):
+        """Troca para um modelo menor sob pressão (thread do monitor)"""
+        if not self.resource_policy.prefer_smaller_model:
+            return
+        smaller = self._smaller_model()
+        if not smaller:
+            return
+        with self._generation_lock:
+            if self._active_generations:
+                # Não tira o modelo de baixo de uma geração em andamento
+                logger.warning("Pouca memória - troca para %s após %d geração(ões) em andamento",
+                               Path(smaller).name, self._active_generations)
+                self._pending_model = smaller
+                return
+        self._swap_model(smaller)
+
+    def _swap_model(self, path: str):
+        logger.warning("Pouca memória - trocando para o modelo menor %s", Path(path).name)
+        self.load_model(path, self._load_callback or (lambda success, error=None: None))
+
+    @contextmanager
+    def _generation(self):
+        """Marca um uso do modelo; ao sair do último, faz a troca adiada"""
+        with self._generation_lock:
+            self._active_generations += 1
+        try:
+            yield
+        finally:
+            with self._generation_lock:
+                self._active_generations -= 1
+                pending = None
+                if not self._active_generations:
+                    pending, self._pending_model = self._pending_model, None
+            if pending and pending != self.model_path:
+                self._swap_model(pending)
+
+    @profiler.profiled('generate')
     def generate(self, message: str) -> str:
         """Gera resposta para a mensagem"""
+        return "".join(self.generate_stream(message))
+
+    def generate_stream(self, message: str):
+        """Gera a resposta em pedaços para exibição incremental"""
         if not message or not message.strip():
-            return random.choice(self.recovery_phrases)
+            yield from _words(random.choice(self.recovery_phrases))
+            return
 
-        message_lower = message.lower().strip()
+        with profiler.span('route'):
+            route = self.router.route(message)
+        self.route_counts[route.intent] = self.route_counts.get(route.intent, 0) + 1
+        if route.response is not None:
+            self.context.add_turn('user', message.strip())
+            self.context.add_turn('assistant', route.response)
+            yield from _words(route.response)
+            return
 
-        # Verifica respostas por palavra-chave primeiro
-        for keyword, response in self.keyword_responses.items():
-            if keyword in message_lower:
-                return response
+        params = self.generation_params()
+        retrieved = self.retrieve(message)
+        self.context.add_turn('user', message.strip())
+        with profiler.span('context.build'):
+            self.last_prompt = self.context.build_prompt(
+                params['kv_window'] - params['max_tokens'], retrieved=retrieved)
 
-        # Usa o modelo se estiver carregado
-        if self.model_loaded and self.model:
-            try:
-                return self.model.generate_response(message)
-            except Exception as e:
-                print(f"Erro na geração: {e}")
-                return random.choice(self.recovery_phrases)
-        else:
-            return random.choice(self.recovery_phrases)
+        pieces = []
+        try:
+            for piece in self._respond_stream(message, params):
+                if not piece:
+                    continue
+                if not pieces:
+                    # Modelos costumam começar a resposta com um espaço
+                    piece = piece.lstrip()
+                    if not piece:
+                        continue
+                profiler.count('decode.pieces')
+                pieces.append(piece)
+                yield piece
+        finally:
+            self.context.add_turn('assistant', "".join(pieces).strip())
+
+    def _respond_stream(self, message: str, params: Dict):
+        if not (self.model_loaded and self.backend):
+            yield from _words(random.choice(self.recovery_phrases))
+            return
+
+        produced = False
+        try:
+            # O backend de padrões olha só a última mensagem; os de LLM recebem
+            # o prompt completo (persona + resumo + turnos recentes)
+            for piece in self.complete_stream(self.last_prompt, params['max_tokens'],
+                                              [f"\n{ROLE_LABELS['user']}:"], message, params):
+                produced = True
+                yield piece
+        except Exception as e:
+            logger.error("Erro na geração (%s): %s", self.backend.name, e)
+            if not produced:
+                yield from _words(random.choice(self.recovery_phrases))
+
+    def complete_stream(self, prompt: str, max_tokens: Optional[int] = None,
+                        stop: Sequence[str] = (), message: Optional[str] = None,
+                        params: Optional[Dict] = None, adapter: Optional[str] = None):
+        """Completa um prompt pronto, sem tocar no contexto da conversa
+
+        `adapter` vale só para este pedido; sem ele, usa o da conversa.
+        """
+        if not self.backend:
+            raise RuntimeError("Modelo ainda não carregado")
+        params = params or self.generation_params()
+        limit = params['max_tokens'] if max_tokens is None else min(max_tokens, params['max_tokens'])
+        adapter = adapter or params.get('adapter')
+        self._use_kv_dtype(params.get('kv_dtype') or self.kv_cache_dtype)
+        # Sob pressão de recursos, o modo de padrões é o caminho mais leve
+        backend = self.pattern_backend if params['pattern_only'] else self.backend
+        with self._generation():
+            yield from backend.stream(prompt, limit, stop, message, adapter)
+
+    def chat_stream(self, messages: Sequence[Dict], max_tokens: Optional[int] = None,
+                    adapter: Optional[str] = None):
+        """Responde a uma lista de mensagens no formato OpenAI (sem estado)"""
+        last_user = next((m.get('content', '') for m in reversed(messages)
+                          if m.get('role') == 'user'), '')
+        route = self.router.route(last_user) if last_user.strip() else None
+        if route is not None and route.response is not None:
+            yield from _words(route.response)
+            return
+        prompt = format_messages(messages, self.context.persona)
+        first = True
+        for piece in self.complete_stream(prompt, max_tokens, [f"\n{ROLE_LABELS['user']}:"],
+                                          last_user, adapter=adapter):
+            if first:
+                piece = piece.lstrip()
+                if not piece:
+                    continue
+                first = False
+            yield piece
 
 
 # Para compatibilidade com o código existente
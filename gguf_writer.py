@@ -0,0 +1,149 @@
+"""
+Escrita de arquivos GGUF do TerlineT
+Contraparte do GGUFReader: os campos e a descrição dos tensores vão no
+cabeçalho e os dados de cada tensor são gravados em seguida, em pedaços, sem
+montar o arquivo em memória. Os offsets respeitam o alinhamento do arquivo.
+"""
+
+import struct
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+from gguf_loader import (GGUF_DEFAULT_ALIGNMENT, GGUF_MAGIC, GGUF_TYPE_ARRAY, GGUF_TYPE_BOOL,
+                         GGUF_TYPE_FLOAT32, GGUF_TYPE_INT32, GGUF_TYPE_INT64, GGUF_TYPE_STRING,
+                         GGUF_TYPE_UINT32, GGUF_VERSION, _NUMPY_TYPES, _SCALAR_STRUCTS,
+                         GGUFTensorInfo, align_offset)
+
+_ARRAY_TYPES = {np.dtype(dtype): value_type for value_type, dtype in _NUMPY_TYPES.items()}
+
+
+def field_type(value):
+    """Tipo GGUF inferido de um valor Python: (tipo, tipo dos itens)"""
+    if isinstance(value, bool):
+        return GGUF_TYPE_BOOL, None
+    if isinstance(value, str):
+        return GGUF_TYPE_STRING, None
+    if isinstance(value, int):
+        return (GGUF_TYPE_UINT32 if 0 <= value < 2 ** 32 else GGUF_TYPE_INT64), None
+    if isinstance(value, float):
+        return GGUF_TYPE_FLOAT32, None
+    if isinstance(value, np.ndarray):
+        return GGUF_TYPE_ARRAY, _ARRAY_TYPES[value.dtype.newbyteorder('=')]
+    if len(value) and isinstance(value[0], str):
+        return GGUF_TYPE_ARRAY, GGUF_TYPE_STRING
+    if len(value) and isinstance(value[0], float):
+        return GGUF_TYPE_ARRAY, GGUF_TYPE_FLOAT32
+    return GGUF_TYPE_ARRAY, GGUF_TYPE_INT32
+
+
+def _write_string(f, text: str):
+    data = text.encode('utf-8')
+    f.write(struct.pack('<Q', len(data)))
+    f.write(data)
+
+
+def _write_value(f, value, value_type: int, item_type: Optional[int]):
+    if value_type == GGUF_TYPE_STRING:
+        _write_string(f, value)
+    elif value_type != GGUF_TYPE_ARRAY:
+        f.write(_SCALAR_STRUCTS[value_type].pack(value))
+    elif item_type in _NUMPY_TYPES:
+        f.write(struct.pack('<IQ', item_type, len(value)))
+        dtype = np.dtype(_NUMPY_TYPES[item_type]).newbyteorder('<')
+        f.write(np.asarray(value, dtype=dtype).tobytes())
+    elif item_type == GGUF_TYPE_STRING:
+        f.write(struct.pack('<IQ', item_type, len(value)))
+        for item in value:
+            _write_string(f, item)
+    else:
+        raise ValueError(f"Arrays do tipo GGUF {item_type} não suportados na escrita")
+
+
+class GGUFWriter:
+    """Escreve um GGUF v3: add_field/add_tensor, depois write_tensor na mesma ordem"""
+
+    def __init__(self, path: Union[str, Path], alignment: int = GGUF_DEFAULT_ALIGNMENT):
+        self.path = Path(path)
+        self.alignment = alignment
+        self.fields = {}
+        self.tensors = []
+        self._data_size = 0
+        self._file = None
+        self._data_start = 0
+        self._next_tensor = 0
+
+    def add_field(self, key: str, value, value_type: Optional[int] = None,
+                  item_type: Optional[int] = None):
+        """Campo de metadados (o tipo é inferido se não for informado)"""
+        if value_type is None:
+            value_type, item_type = field_type(value)
+        self.fields[key] = (value, value_type, item_type)
+
+    def add_tensor(self, name: str, shape: tuple, ggml_type: int) -> GGUFTensorInfo:
+        """Registra um tensor (shape na ordem GGML) e reserva seu espaço"""
+        if self._file is not None:
+            raise RuntimeError("Tensores devem ser registrados antes do cabeçalho")
+        offset = align_offset(self._data_size, self.alignment)
+        info = GGUFTensorInfo(name, tuple(int(dim) for dim in shape), ggml_type, offset)
+        self._data_size = offset + info.n_bytes
+        self.tensors.append(info)
+        return info
+
+    def open(self):
+        """Grava o cabeçalho; a partir daqui só faltam os dados dos tensores"""
+        if self.alignment != GGUF_DEFAULT_ALIGNMENT and 'general.alignment' not in self.fields:
+            self.add_field('general.alignment', self.alignment, GGUF_TYPE_UINT32)
+        f = self._file = open(self.path, 'wb')
+        f.write(struct.pack('<IIQQ', GGUF_MAGIC, GGUF_VERSION, len(self.tensors), len(self.fields)))
+        for key, (value, value_type, item_type) in self.fields.items():
+            _write_string(f, key)
+            f.write(struct.pack('<I', value_type))
+            _write_value(f, value, value_type, item_type)
+        for info in self.tensors:
+            _write_string(f, info.name)
+            f.write(struct.pack(f'<I{len(info.shape)}QIQ', len(info.shape), *info.shape,
+                                info.ggml_type, info.offset))
+        self._data_start = align_offset(f.tell(), self.alignment)
+        f.write(b'\0' * (self._data_start - f.tell()))
+        return self
+
+    def write_tensor(self, name: str, pieces: Iterable):
+        """Grava os dados do próximo tensor a partir de pedaços (bytes ou arrays)"""
+        info = self.tensors[self._next_tensor]
+        if info.name != name:
+            raise ValueError(f"Tensor esperado: {info.name}, recebido: {name}")
+        f = self._file
+        f.seek(self._data_start + info.offset)
+        written = 0
+        for piece in pieces:
+            if isinstance(piece, np.ndarray):
+                piece = memoryview(np.ascontiguousarray(piece)).cast('B')
+            f.write(piece)
+            written += len(piece)
+        if written != info.n_bytes:
+            raise ValueError(f"Tensor {name}: {written} bytes gravados, esperados {info.n_bytes}")
+        end = info.offset + info.n_bytes
+        f.write(b'\0' * (align_offset(end, self.alignment) - end))
+        self._next_tensor += 1
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            if self._next_tensor != len(self.tensors):
+                raise ValueError(f"{len(self.tensors) - self._next_tensor} tensores sem dados")
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
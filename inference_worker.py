@@ -0,0 +1,394 @@
+"""
+Processo de inferência do TerlineT
+O modelo é mapeado e executado num processo filho, fora do GIL da interface.
+Os pedidos vão por um Pipe e os pedaços gerados voltam por um ring buffer em
+multiprocessing.shared_memory. Embeddings e decodificação restrita também
+rodam no filho (REMOTE_METHODS): o resultado volta serializado pelo mesmo
+ring buffer, e o processo da interface não carrega um segundo motor. Se o
+filho morrer, os pedidos pendentes falham e o processo é reiniciado.
+"""
+
+import collections
+import logging
+import multiprocessing
+import pickle
+import queue
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Sequence
+
+logger = logging.getLogger('TerlineT.worker')
+
+RING_CAPACITY = 256 * 1024
+# Resultados de chamadas remotas são divididos em registros deste tamanho
+CALL_CHUNK = 64 * 1024
+MAX_RESTARTS = 3
+RESTART_WINDOW = 60.0
+
+# Tipos de registro no ring buffer
+RECORD_PIECE = 0
+RECORD_END = 1
+RECORD_ERROR = 2
+
+_HEADER = struct.Struct('<QQ')      # posição de escrita, posição de leitura
+_RECORD = struct.Struct('<IBI')     # id do pedido, tipo, tamanho do conteúdo
+
+# Métodos do GGUFModelWrapper que o processo principal pode chamar no filho
+REMOTE_METHODS = ('embeddings_available', 'embed', 'complete_constrained')
+
+
+class WorkerCrashed(RuntimeError):
+    """O processo de inferência terminou no meio de um pedido"""
+
+
+class SharedRingBuffer:
+    """Ring buffer de um produtor e um consumidor sobre memória compartilhada
+
+    As posições de escrita e leitura são contadores de bytes que só crescem;
+    o produtor só avança a de escrita e o consumidor só a de leitura.
+    """
+
+    def __init__(self, name: Optional[str] = None, capacity: int = RING_CAPACITY):
+        create = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=create,
+                                              size=_HEADER.size + capacity if create else 0)
+        # A capacidade vem do criador: o tamanho do segmento pode ser arredondado
+        self.capacity = capacity
+        self.buffer = self.shm.buf
+        if create:
+            _HEADER.pack_into(self.buffer, 0, 0, 0)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _positions(self):
+        return _HEADER.unpack_from(self.buffer, 0)
+
+    def _copy_in(self, position: int, data: bytes):
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        base = _HEADER.size
+        self.buffer[base + start:base + start + first] = data[:first]
+        if first < len(data):
+            self.buffer[base:base + len(data) - first] = data[first:]
+
+    def _copy_out(self, position: int, length: int) -> bytes:
+        start = position % self.capacity
+        first = min(length, self.capacity - start)
+        base = _HEADER.size
+        data = bytes(self.buffer[base + start:base + start + first])
+        if first < length:
+            data += bytes(self.buffer[base:base + length - first])
+        return data
+
+    def write(self, request_id: int, kind: int, payload: bytes = b'', timeout: float = 30.0):
+        """Grava um registro, esperando espaço se o consumidor estiver atrasado"""
+        payload = payload[:self.capacity - _RECORD.size]
+        record = _RECORD.pack(request_id, kind, len(payload)) + payload
+        deadline = time.monotonic() + timeout
+        while True:
+            write_pos, read_pos = self._positions()
+            if self.capacity - (write_pos - read_pos) >= len(record):
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError("Ring buffer cheio")
+            time.sleep(0.001)
+        self._copy_in(write_pos, record)
+        # A posição só avança depois que os bytes estão no lugar
+        struct.pack_into('<Q', self.buffer, 0, write_pos + len(record))
+
+    def read(self):
+        """Próximo registro (id, tipo, conteúdo) ou None se vazio"""
+        write_pos, read_pos = self._positions()
+        if write_pos == read_pos:
+            return None
+        request_id, kind, length = _RECORD.unpack(self._copy_out(read_pos, _RECORD.size))
+        payload = self._copy_out(read_pos + _RECORD.size, length)
+        struct.pack_into('<Q', self.buffer, 8, read_pos + _RECORD.size + length)
+        return request_id, kind, payload
+
+    def close(self, unlink: bool = False):
+        self.buffer = None
+        self.shm.close()
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _worker_main(model_path: str, connection, ring_name: str, ring_capacity: int,
+                 probe_cache_path: Optional[str], kv_window: int):
+    """Laço do processo filho: carrega o modelo e atende os pedidos em ordem"""
+    import logger as terlinet_logging
+    from gguf_loader import GGUFModelWrapper
+
+    terlinet_logging.setup_logging()
+    ring = SharedRingBuffer(ring_name, ring_capacity)
+    model = GGUFModelWrapper()
+    model.kv_window = kv_window
+    model.probe_cache_path = probe_cache_path
+    loaded = threading.Event()
+    status = {}
+
+    def on_loaded(success, error=None):
+        status['error'] = error
+        loaded.set()
+
+    model.load_model(model_path, on_loaded)
+    loaded.wait()
+    connection.send({'ready': True, 'error': status.get('error'),
+                     'report': model.backend_report,
+                     'max_concurrent': getattr(model.backend, 'max_concurrent', 1)})
+
+    cancelled = set()
+    backlog = collections.deque()
+
+    def receive():
+        """Recebe uma mensagem; cancelamentos são anotados, pedidos vão para a fila"""
+        message = connection.recv()
+        if message.get('op') == 'cancel':
+            cancelled.add(message['id'])
+        else:
+            backlog.append(message)
+
+    while True:
+        if not backlog:
+            try:
+                receive()
+            except (EOFError, OSError):
+                break
+            continue
+        request = backlog.popleft()
+        op = request.get('op')
+        if op == 'stop':
+            break
+        if op == 'adapter':
+            try:
+                model.load_adapter(request['name'], request['path'], request.get('scale', 1.0))
+            except Exception as e:
+                logger.error("Adaptador %s: %s", request['name'], e)
+            continue
+        if op == 'call':
+            request_id = request['id']
+            try:
+                if request['method'] not in REMOTE_METHODS:
+                    raise ValueError(f"Método remoto desconhecido: {request['method']}")
+                result = getattr(model, request['method'])(*request.get('args', ()))
+                data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+                for start in range(0, len(data), CALL_CHUNK):
+                    ring.write(request_id, RECORD_PIECE, data[start:start + CALL_CHUNK])
+                ring.write(request_id, RECORD_END)
+            except Exception as e:
+                ring.write(request_id, RECORD_ERROR, str(e).encode('utf-8'))
+            continue
+        if op != 'complete':
+            continue
+
+        request_id = request['id']
+        try:
+            if request_id not in cancelled:
+                for piece in model.complete_stream(request['prompt'], request.get('max_tokens'),
+                                                   request.get('stop', ()), request.get('message'),
+                                                   request.get('params')):
+                    # Mensagens novas chegam pelo pipe entre um pedaço e outro
+                    while connection.poll():
+                        receive()
+                    if request_id in cancelled:
+                        break
+                    if piece:
+                        ring.write(request_id, RECORD_PIECE, piece.encode('utf-8'))
+            ring.write(request_id, RECORD_END)
+        except Exception as e:
+            ring.write(request_id, RECORD_ERROR, str(e).encode('utf-8'))
+        cancelled.discard(request_id)
+    ring.close()
+
+
+class InferenceWorker:
+    """Gerencia o processo filho, o ring buffer e os pedidos em andamento"""
+
+    def __init__(self, model_path: str, probe_cache_path: Optional[str] = None,
+                 kv_window: int = 4096, ready_timeout: float = 300.0):
+        self.model_path = model_path
+        self.probe_cache_path = probe_cache_path
+        self.kv_window = kv_window
+        self.ready_timeout = ready_timeout
+        self.report = {}
+        self.max_concurrent = 1
+        self.load_error = None
+
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._connection = None
+        self._ring = None
+        self._pending = {}
+        self._next_id = 1
+        self._send_lock = threading.Lock()
+        self._restarts = []
+        self._stopping = False
+        self._reader = None
+        # Reenviados ao filho depois de um reinício
+        self._adapters = {}
+
+    # --- Ciclo de vida ---
+
+    def start(self):
+        """Inicia o filho e espera o modelo carregar (levanta exceção em caso de falha)"""
+        self._ring = SharedRingBuffer()
+        parent_connection, child_connection = self._context.Pipe()
+        self._process = self._context.Process(
+            target=_worker_main, name='TerlineTInference', daemon=True,
+            args=(self.model_path, child_connection, self._ring.name, self._ring.capacity,
+                  self.probe_cache_path, self.kv_window))
+        self._process.start()
+        child_connection.close()
+        self._connection = parent_connection
+
+        if not parent_connection.poll(self.ready_timeout):
+            self._kill()
+            raise TimeoutError("Processo de inferência não respondeu")
+        hello = parent_connection.recv()
+        self.report = hello.get('report', {})
+        self.max_concurrent = hello.get('max_concurrent', 1)
+        self.load_error = hello.get('error')
+        logger.info("Processo de inferência %d pronto (%s)", self._process.pid,
+                    self.report.get('backend'))
+        for name, (path, scale) in self._adapters.items():
+            self._send({'op': 'adapter', 'name': name, 'path': path, 'scale': scale})
+
+        if self._reader is None or not self._reader.is_alive():
+            self._reader = threading.Thread(target=self._read_loop, name='InferenceWorkerReader',
+                                            daemon=True)
+            self._reader.start()
+
+    def stop(self):
+        self._stopping = True
+        try:
+            with self._send_lock:
+                self._connection.send({'op': 'stop'})
+        except (OSError, AttributeError):
+            pass
+        if self._process is not None:
+            self._process.join(2)
+        self._kill()
+
+    def _kill(self):
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+            self._process.join(1)
+        if self._ring is not None:
+            self._ring.close(unlink=True)
+            self._ring = None
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def _send(self, message: Dict):
+        with self._send_lock:
+            self._connection.send(message)
+
+    def load_adapter(self, name: str, path: str, scale: float = 1.0):
+        """Carrega um adaptador LoRA no filho (antes dos pedidos seguintes)"""
+        self._adapters[name] = (path, scale)
+        self._send({'op': 'adapter', 'name': name, 'path': path, 'scale': scale})
+
+    # --- Pedidos ---
+
+    def _submit(self, message: Dict):
+        """Envia um pedido ao filho; devolve (id, fila dos registros da resposta)"""
+        if not self.alive:
+            raise WorkerCrashed("Processo de inferência indisponível")
+        records = queue.Queue()
+        with self._send_lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._pending[request_id] = records
+            self._connection.send(dict(message, id=request_id))
+        return request_id, records
+
+    @staticmethod
+    def _payloads(records: queue.Queue):
+        """Conteúdo dos registros até o fim do pedido; erro do filho vira exceção"""
+        while True:
+            kind, payload = records.get()
+            if kind == RECORD_PIECE:
+                yield payload
+            elif kind == RECORD_END:
+                return
+            elif isinstance(payload, Exception):
+                raise payload
+            else:
+                raise RuntimeError(payload.decode('utf-8', errors='replace'))
+
+    def stream(self, prompt: str, max_tokens: int, stop: Sequence[str] = (),
+               message: Optional[str] = None, params: Optional[Dict] = None):
+        """Envia um pedido ao filho e repassa os pedaços à medida que chegam"""
+        request_id, records = self._submit({'op': 'complete', 'prompt': prompt,
+                                            'max_tokens': max_tokens, 'stop': list(stop),
+                                            'message': message, 'params': params})
+        try:
+            for payload in self._payloads(records):
+                yield payload.decode('utf-8', errors='replace')
+        except GeneratorExit:
+            if self.alive:
+                # O consumidor desistiu: o filho para de gerar este pedido
+                self._send({'op': 'cancel', 'id': request_id})
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+
+    def call(self, method: str, *args):
+        """Executa um dos REMOTE_METHODS do modelo no filho e devolve o resultado"""
+        request_id, records = self._submit({'op': 'call', 'method': method, 'args': args})
+        try:
+            return pickle.loads(b''.join(self._payloads(records)))
+        finally:
+            self._pending.pop(request_id, None)
+
+    def _read_loop(self):
+        """Lê o ring buffer e distribui os registros; reinicia o filho se ele cair"""
+        idle = 0
+        while not self._stopping:
+            ring = self._ring
+            record = ring.read() if ring is not None else None
+            if record is not None:
+                idle = 0
+                request_id, kind, payload = record
+                target = self._pending.get(request_id)
+                if target is not None:
+                    target.put((kind, payload))
+                continue
+
+            if not self.alive:
+                self._handle_crash()
+                continue
+            # Espera curta e crescente quando não há nada a ler
+            idle = min(idle + 1, 20)
+            time.sleep(0.0005 * idle)
+
+    def _handle_crash(self):
+        exit_code = self._process.exitcode if self._process is not None else None
+        logger.error("Processo de inferência terminou (código %s)", exit_code)
+        for pieces in list(self._pending.values()):
+            pieces.put((RECORD_ERROR, WorkerCrashed("Processo de inferência reiniciado")))
+        self._pending.clear()
+        self._kill()
+
+        now = time.monotonic()
+        self._restarts = [moment for moment in self._restarts if now - moment < RESTART_WINDOW]
+        if len(self._restarts) >= MAX_RESTARTS:
+            logger.error("Processo de inferência caiu %d vezes em %ds - desistindo",
+                         len(self._restarts), RESTART_WINDOW)
+            self._stopping = True
+            return
+        self._restarts.append(now)
+        try:
+            self.start()
+        except Exception as e:
+            logger.error("Falha ao reiniciar o processo de inferência: %s", e)
+            self._stopping = True
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Verificação de integridade do modelo do TerlineT
+Uma cópia truncada ou corrompida de um GGUF de vários GB só aparecia como
+lixo na geração (ou um crash). Aqui o layout dos tensores é conferido contra
+o tamanho do arquivo a cada carga.
+
+Quando há um resumo de referência ("<modelo>.sha256" ao lado do modelo), o
+arquivo inteiro também é lido e resumido em blocos grandes por um pool de
+threads (o hashlib solta o GIL), uma única vez: o resultado fica num registro
+por arquivo, chaveado por tamanho, mtime e inode. Sem referência não há com o
+que comparar, então só o layout é conferido. A referência vem da importação
+do modelo (provisioning.py resume a origem enquanto copia) ou de
+`python integrity.py modelo.gguf --write` num arquivo sabidamente bom.
+
+O resumo é o SHA-256 da sequência de SHA-256 de cada bloco de VERIFY_CHUNK
+bytes.
+
+Uso:
+    python integrity.py modelo/modelo.gguf [--write]
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+logger = logging.getLogger('TerlineT.integrity')
+
+VERIFY_CHUNK = 64 * 1024 * 1024
+# Leituras menores dentro de cada bloco: memória ~ READ_SIZE por thread
+READ_SIZE = 4 * 1024 * 1024
+MAX_WORKERS = 4
+DIGEST_SUFFIX = '.sha256'
+
+_record_lock = threading.Lock()
+
+
+class IntegrityError(ValueError):
+    """Arquivo de modelo truncado, corrompido ou ilegível"""
+
+
+def check_layout(reader):
+    """Confere alinhamento e extensão de cada tensor contra o tamanho do arquivo"""
+    file_size = os.path.getsize(reader.path)
+    if reader.data_offset > file_size:
+        raise IntegrityError(f"Seção de dados começa em {reader.data_offset}, "
+                             f"além do fim do arquivo ({file_size} bytes)")
+    extents = []
+    for info in reader.tensors.values():
+        try:
+            n_bytes = info.n_bytes
+        except KeyError:
+            raise IntegrityError(f"Tensor {info.name}: tipo GGML {info.ggml_type} desconhecido")
+        if info.offset % reader.alignment:
+            raise IntegrityError(f"Tensor {info.name}: offset {info.offset} desalinhado "
+                                 f"(alinhamento {reader.alignment})")
+        end = reader.data_offset + info.offset + n_bytes
+        if end > file_size:
+            raise IntegrityError(f"Tensor {info.name} termina em {end}, arquivo tem "
+                                 f"{file_size} bytes (cópia truncada?)")
+        extents.append((info.offset, info.offset + n_bytes, info.name))
+
+    extents.sort()
+    for (_, end, name), (start, _, following) in zip(extents, extents[1:]):
+        if start < end:
+            raise IntegrityError(f"Tensores {name} e {following} se sobrepõem")
+
+
+def hash_range(path: str, offset: int, length: int) -> bytes:
+    """SHA-256 de um trecho do arquivo, lido em pedaços de READ_SIZE"""
+    digest = hashlib.sha256()
+    buffer = bytearray(min(READ_SIZE, length))
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        f.seek(offset)
+        remaining = length
+        while remaining:
+            count = f.readinto(view[:min(len(buffer), remaining)])
+            if not count:
+                raise IntegrityError(f"Leitura terminou antes do fim em {path}")
+            digest.update(view[:count])
+            remaining -= count
+    return digest.digest()
+
+
+def chunk_digests(path: str, chunk_size: int = VERIFY_CHUNK,
+                  workers: Optional[int] = None) -> List[bytes]:
+    """SHA-256 de cada bloco do arquivo, calculados em paralelo"""
+    size = os.path.getsize(path)
+    offsets = range(0, size, chunk_size)
+    workers = workers or min(MAX_WORKERS, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Integrity') as pool:
+        return list(pool.map(lambda offset: hash_range(path, offset, min(chunk_size, size - offset)),
+                             offsets))
+
+
+def combine_digests(digests: List[bytes]) -> str:
+    """Resumo do arquivo a partir dos resumos dos blocos, em ordem"""
+    return hashlib.sha256(b''.join(digests)).hexdigest()
+
+
+def file_digest(path: str, chunk_size: int = VERIFY_CHUNK, workers: Optional[int] = None) -> str:
+    """Resumo do arquivo inteiro (SHA-256 dos resumos dos blocos)"""
+    return combine_digests(chunk_digests(path, chunk_size, workers))
+
+
+def _file_key(path: str) -> Dict:
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'inode': stat.st_ino,
+            'chunk_size': VERIFY_CHUNK}
+
+
+def _load_records(record_path: str) -> Dict:
+    try:
+        with open(record_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_record(record_path: str, path: str, record: Dict):
+    with _record_lock:
+        records = _load_records(record_path)
+        records[path] = record
+        temporary = record_path + '.tmp'
+        try:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(records, f, indent=1)
+            os.replace(temporary, record_path)
+        except OSError as e:
+            logger.warning("Não foi possível salvar o registro de verificação: %s", e)
+
+
+def expected_digest(path: str) -> Optional[str]:
+    """Resumo de referência em "<modelo>.sha256", se houver"""
+    try:
+        with open(path + DIGEST_SUFFIX, encoding='utf-8') as f:
+            return f.read().split()[0].lower()
+    except (OSError, IndexError):
+        return None
+
+
+def write_digest(path: str, digest: str):
+    """Grava o resumo de referência em <modelo>.sha256"""
+    with open(path + DIGEST_SUFFIX, 'w', encoding='utf-8') as f:
+        f.write(f"{digest}  {os.path.basename(path)}\n")
+
+
+def verify_model(reader, record_path: Optional[str] = None) -> bool:
+    """Verifica o modelo aberto; levanta IntegrityError se houver problema
+
+    Sem record_path ou sem resumo de referência só o layout é conferido.
+    Retorna True se o arquivo foi lido por inteiro nesta chamada (False se
+    não havia referência ou se o registro já cobria o arquivo).
+    """
+    check_layout(reader)
+    path = os.path.abspath(str(reader.path))
+    expected = expected_digest(path)
+    if not record_path or expected is None:
+        return False
+
+    key = _file_key(path)
+    record = _load_records(record_path).get(path)
+    if (record is not None and record.get('digest') == expected
+            and all(record.get(name) == value for name, value in key.items())):
+        logger.debug("Integridade de %s já verificada", path)
+        return False
+
+    started = time.perf_counter()
+    try:
+        digest = file_digest(path)
+    except OSError as e:
+        raise IntegrityError(f"Erro de leitura em {path}: {e}")
+    elapsed = time.perf_counter() - started
+    logger.info("Integridade de %s verificada em %.1fs (%.0f MB/s)", os.path.basename(path),
+                elapsed, key['size'] / 2**20 / max(elapsed, 1e-6))
+
+    if expected != digest:
+        raise IntegrityError(f"Resumo de {os.path.basename(path)} não confere com "
+                             f"{os.path.basename(path)}{DIGEST_SUFFIX} (arquivo corrompido)")
+    _save_record(record_path, path, dict(key, digest=digest, verified_at=int(time.time())))
+    return True
+
+
+def main():
+    import argparse
+
+    import logger as terlinet_logging
+    from gguf_loader import GGUFReader
+
+    parser = argparse.ArgumentParser(description="Verifica a integridade de um modelo GGUF")
+    parser.add_argument('model', help="arquivo .gguf")
+    parser.add_argument('--write', action='store_true',
+                        help=f"grava o resumo em <modelo>{DIGEST_SUFFIX}")
+    args = parser.parse_args()
+
+    terlinet_logging.setup_logging()
+    with GGUFReader(args.model) as reader:
+        check_layout(reader)
+    started = time.perf_counter()
+    digest = file_digest(args.model)
+    print(f"{digest}  {os.path.basename(args.model)}  ({time.perf_counter() - started:.1f}s)")
+    expected = expected_digest(args.model)
+    if args.write:
+        write_digest(args.model, digest)
+    elif expected is not None and expected != digest:
+        raise SystemExit(f"Resumo não confere com {args.model}{DIGEST_SUFFIX}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Roteamento de intenções do TerlineT
+Classifica a mensagem com vetores de n-gramas de caracteres (NumPy) por
+vizinho mais próximo e centróide. Conversa fiada (saudações, agradecimentos,
+despedidas...) é respondida na hora; só perguntas abertas vão para o modelo.
+"""
+
+import copy
+import logging
+import random
+import re
+import unicodedata
+import zlib
+from collections import namedtuple
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger('TerlineT.router')
+
+Route = namedtuple('Route', 'intent score response')
+
+# Intenção que sempre segue para o modelo
+OPEN_INTENT = 'pergunta'
+
+VECTOR_DIM = 4096
+NGRAM_SIZES = (2, 3, 4)
+
+# (exemplo, resposta específica ou None)
+DEFAULT_INTENTS = {
+    'saudacao': {
+        'examples': [
+            ("olá", "Olá! Como posso ajudar?"),
+            ("oi", "Oi! Como vai você?"),
+            ("oi terlinet", "Oi! Como vai você?"),
+            ("olá terlinet", "Olá! Como posso ajudar?"),
+            ("bom dia", "Bom dia! Como vai você?"),
+            ("boa tarde", "Boa tarde! Em que posso ajudar?"),
+            ("boa noite", "Boa noite! Como posso ajudar?"),
+            ("e aí", None), ("hey", None), ("opa", None), ("salve", None), ("oie", None),
+        ],
+        'responses': ["Olá! Como posso ajudar você hoje?", "Oi! Em que posso ser útil?"]
+    },
+    'estado': {
+        'examples': [
+            ("como você está", "Estou bem, obrigada! E você?"),
+            ("tudo bem", "Tudo ótimo! Como posso ajudar hoje?"),
+            ("tudo bem com você", None), ("como vai", None), ("beleza", None),
+            ("tudo certo", None),
+        ],
+        'responses': ["Estou bem, obrigada! E você?"]
+    },
+    'identidade': {
+        'examples': [
+            ("qual é o seu nome", "Meu nome é TerlineT! Prazer em conhecê-lo!"),
+            ("quem é você", "Sou a TerlineT, sua assistente virtual!"),
+            ("como você se chama", None), ("o que você é", None),
+        ],
+        'responses': ["Sou a TerlineT, sua assistente virtual!"]
+    },
+    'agradecimento': {
+        'examples': [
+            ("obrigado", "De nada! Estou aqui para ajudar."),
+            ("obrigada", "Por nada! Fico feliz em ajudar!"),
+            ("muito obrigado", None), ("obrigado pela ajuda", None), ("valeu", None), ("brigado", None), ("agradeço", None),
+            ("obg", None), ("vlw", None),
+        ],
+        'responses': ["De nada! Fico feliz em ajudar!", "Por nada! Estou aqui sempre que precisar."]
+    },
+    'despedida': {
+        'examples': [
+            ("tchau", "Até logo! Volte sempre que precisar."),
+            ("até logo", "Tchau! Cuide-se!"),
+            ("até mais", None), ("até amanhã", None), ("falou", None), ("adeus", None),
+            ("flw", None),
+        ],
+        'responses': ["Até logo! Volte sempre que precisar.", "Tchau! Cuide-se!"]
+    },
+    OPEN_INTENT: {
+        'examples': [
+            ("o que é inteligência artificial", None),
+            ("como faço para instalar o python", None),
+            ("me explique como funciona o kivy", None),
+            ("quanto é dois mais dois", None),
+            ("por que o céu é azul", None),
+            ("pode me ajudar com um erro no código", None),
+            ("qual a diferença entre lista e tupla", None),
+            ("escreva um poema sobre o mar", None),
+            ("quando foi a independência do brasil", None),
+            ("onde fica a capital da frança", None),
+            ("o que você acha de música", None),
+            ("você gosta de filmes", None),
+            ("me conta uma piada", None),
+            ("me fale sobre a história do brasil", None),
+        ],
+        'responses': []
+    },
+}
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sem acentos e sem pontuação"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', text))
+
+
+def ngram_vectors(texts: Sequence[str], dim: int = VECTOR_DIM,
+                  sizes: Sequence[int] = NGRAM_SIZES) -> np.ndarray:
+    """Vetores L2-normalizados de n-gramas de caracteres (hashing com crc32)
+
+    Cada palavra ganha espaços nas bordas, então "oi" não casa com o meio de
+    "dois".
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        padded = f' {normalize_text(text)} '
+        indices = [zlib.crc32(padded[start:start + size].encode('utf-8')) % dim
+                   for size in sizes for start in range(len(padded) - size + 1)]
+        if indices:
+            np.add.at(matrix[row], indices, 1.0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class IntentRouter:
+    """Classificador por vizinho mais próximo e centróide sobre n-gramas"""
+
+    def __init__(self, intents: Optional[Dict] = None, threshold: float = 0.6,
+                 centroid_weight: float = 0.3):
+        self.intents = intents if intents is not None else copy.deepcopy(DEFAULT_INTENTS)
+        self.threshold = threshold
+        self.centroid_weight = centroid_weight
+        self._build()
+
+    def _build(self):
+        examples = [(name, text, response) for name, spec in self.intents.items()
+                    for text, response in spec['examples']]
+        self.labels = [name for name, _, _ in examples]
+        self.example_responses = [response for _, _, response in examples]
+        self.intent_names = list(self.intents)
+        self._label_ids = np.array([self.intent_names.index(name) for name in self.labels])
+
+        # Pré-calculado uma vez: matriz dos exemplos e centróides por intenção
+        self.example_vectors = ngram_vectors([text for _, text, _ in examples])
+        centroids = np.stack([self.example_vectors[self._label_ids == i].mean(axis=0)
+                              for i in range(len(self.intent_names))])
+        self.centroids = centroids / np.maximum(
+            np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    def classify(self, text: str) -> Tuple[str, float, int]:
+        """(intenção, pontuação, exemplo mais próximo)"""
+        vector = ngram_vectors([text])[0]
+        similarities = self.example_vectors @ vector
+        nearest = int(np.argmax(similarities))
+        intent_id = self._label_ids[nearest]
+        centroid_score = float(self.centroids[intent_id] @ vector)
+        score = ((1 - self.centroid_weight) * float(similarities[nearest])
+                 + self.centroid_weight * centroid_score)
+        return self.intent_names[intent_id], score, nearest
+
+    def route(self, text: str) -> Route:
+        """Resposta imediata para conversa fiada; resposta None segue para o modelo"""
+        intent, score, nearest = self.classify(text)
+        if intent == OPEN_INTENT or score < self.threshold:
+            return Route(OPEN_INTENT, score, None)
+        response = self.example_responses[nearest] or random.choice(
+            self.intents[intent]['responses'])
+        return Route(intent, score, response)
+
+    def add_example(self, intent: str, text: str, response: Optional[str] = None):
+        """Acrescenta um exemplo a uma intenção e recalcula as matrizes"""
+        spec = self.intents.setdefault(intent, {'examples': [], 'responses': []})
+        spec['examples'].append((text, response))
+        self._build()
+
+    def examples(self) -> List[Tuple[str, str]]:
+        return [(name, text) for name, spec in self.intents.items()
+                for text, _ in spec['examples']]
@@ -1,30 +1,143 @@
+"""
+Logging assíncrono do TerlineT
+As threads só enfileiram o registro (fila limitada); a formatação e a escrita
+em stdout/logcat e no arquivo rotativo acontecem numa thread própria, então
+logar nunca bloqueia a UI nem a inferência.
+
+Nível por subsistema via `set_level('gguf', 'DEBUG')` ou pela variável de
+ambiente TERLINET_LOG_LEVELS="gguf=DEBUG,voice=WARNING".
+"""
+
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+from pathlib import Path
 
-# Configurar logging básico
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+ROOT_NAME = 'TerlineT'
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+QUEUE_SIZE = 10000
+LOG_FILE_BYTES = 1024 * 1024
+LOG_FILE_BACKUPS = 3
 
 # Criar logger principal
-logger = logging.getLogger('TerlineT')
+logger = logging.getLogger(ROOT_NAME)
+
+_listener = None
+_queue_handler = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta registros quando a fila está cheia"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # A formatação (msg % args) fica para a thread do listener
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(log_dir=None, level=logging.INFO, levels=None, queue_size=QUEUE_SIZE):
+    """Instala o par QueueHandler/QueueListener (pode ser chamado de novo)"""
+    global _listener, _queue_handler
+
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_dir:
+        Path(log_dir).mkdir(parents=True, exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            Path(log_dir) / 'terlinet.log', maxBytes=LOG_FILE_BYTES,
+            backupCount=LOG_FILE_BACKUPS, encoding='utf-8'))
+    formatter = logging.Formatter(LOG_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    shutdown()
+    for handler in list(root.handlers):
+        # Remove o StreamHandler síncrono de um basicConfig anterior
+        if isinstance(handler, logging.StreamHandler) and not isinstance(
+                handler, logging.FileHandler):
+            root.removeHandler(handler)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    root.addHandler(_queue_handler)
+    _listener = logging.handlers.QueueListener(
+        _queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+    logger.setLevel(level)
+    for subsystem, subsystem_level in (levels or {}).items():
+        set_level(subsystem, subsystem_level)
+    for subsystem, subsystem_level in _levels_from_env().items():
+        try:
+            set_level(subsystem, subsystem_level)
+        except ValueError:
+            # Variável de ambiente errada não impede o app de abrir
+            logger.warning("TERLINET_LOG_LEVELS: nível inválido %r para %s (ignorado)",
+                           subsystem_level, subsystem)
+
+
+def shutdown():
+    """Para o listener escrevendo o que ainda estiver na fila"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        if _queue_handler.dropped:
+            sys.stderr.write(f"TerlineT: {_queue_handler.dropped} registros de log descartados\n")
+        _queue_handler = None
+
+
+def get_logger(subsystem):
+    """Logger de um subsistema (ex.: 'gguf' -> 'TerlineT.gguf')"""
+    return logging.getLogger(f'{ROOT_NAME}.{subsystem}')
+
+
+def set_level(subsystem, level):
+    if isinstance(level, str):
+        name, level = level, logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Nível de log desconhecido: {name}")
+    get_logger(subsystem).setLevel(level)
+
+
+def _levels_from_env():
+    levels = {}
+    for item in os.environ.get('TERLINET_LOG_LEVELS', '').split(','):
+        if '=' in item:
+            subsystem, level = item.split('=', 1)
+            levels[subsystem.strip()] = level.strip()
+    return levels
+
+
+# Configurar logging básico
+setup_logging()
+atexit.register(shutdown)
 
 
-def info(message):
-    logger.info(message)
+def info(message, *args):
+    logger.info(message, *args)
 
 
-def error(message, exc_info=False):
-    logger.error(message, exc_info=exc_info)
+def error(message, *args, exc_info=False):
+    logger.error(message, *args, exc_info=exc_info)
 
 
-def warning(message):
-    logger.warning(message)
+def warning(message, *args):
+    logger.warning(message, *args)
 
 
-def debug(message):
-    logger.debug(message)
+def debug(message, *args):
+    logger.debug(message, *args)
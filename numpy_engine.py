@@ -0,0 +1,693 @@
+"""
+Motor de inferência em NumPy puro para modelos GGUF da família LLaMA
+(llama, mistral, qwen2, qwen3). Lê os pesos do GGUFReader, dequantiza cada
+tensor sob demanda e executa o transformer em lotes com máscara de padding.
+Pensado para modelos pequenos; os grandes ficam com o llama.cpp.
+"""
+
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import profiler
+
+logger = logging.getLogger('TerlineT.engine')
+
+# Arquiteturas cujo RoPE gira as metades do vetor (estilo GPT-NeoX)
+NEOX_ROPE_ARCHITECTURES = ('qwen2', 'qwen3', 'qwen2moe', 'phi3', 'gemma', 'gemma2', 'stablelm')
+SUPPORTED_ARCHITECTURES = ('llama', 'mistral', 'qwen2', 'qwen3')
+
+# Armazenamento do KV cache e tamanho do bloco com escala própria em int8
+KV_STORAGE = {'f32': np.float32, 'f16': np.float16, 'int8': np.int8}
+KV_QUANT_BLOCK = 32
+
+# Blocos da atenção (consultas x chaves): a memória temporária não depende do
+# tamanho da sequência
+ATTENTION_BLOCK_Q = 128
+ATTENTION_BLOCK_K = 256
+# Posições com seno/cosseno do RoPE pré-calculados na criação do motor
+ROPE_TABLE_LENGTH = 4096
+
+# Prefill em pedaços: o tamanho se ajusta para cada pedaço levar ~PREFILL_TARGET_MS
+PREFILL_CHUNK = 128
+PREFILL_CHUNK_MIN = 16
+PREFILL_CHUNK_MAX = 1024
+PREFILL_TARGET_MS = 50.0
+
+
+class ModelConfig:
+    """Hiperparâmetros lidos dos metadados `<arquitetura>.*`"""
+
+    def __init__(self, fields: Dict, tensors: Dict):
+        arch = fields.get('general.architecture', 'llama')
+        self.architecture = arch
+
+        def get(key, default=None):
+            return fields.get(f'{arch}.{key}', default)
+
+        self.n_embd = int(get('embedding_length'))
+        self.n_layers = int(get('block_count'))
+        self.n_heads = int(get('attention.head_count'))
+        self.n_kv_heads = int(get('attention.head_count_kv', self.n_heads))
+        self.head_dim = int(get('attention.key_length', self.n_embd // self.n_heads))
+        self.n_ff = int(get('feed_forward_length', 0))
+        self.context_length = int(get('context_length', 2048))
+        self.norm_eps = float(get('attention.layer_norm_rms_epsilon', 1e-6))
+        self.rope_base = float(get('rope.freq_base', 10000.0))
+        self.rope_dim = int(get('rope.dimension_count', self.head_dim))
+        self.rope_neox = arch in NEOX_ROPE_ARCHITECTURES
+        # Escala linear de contexto (rope.scaling.type = linear)
+        self.rope_scale = 1.0
+        if get('rope.scaling.type') == 'linear':
+            self.rope_scale = float(get('rope.scaling.factor', 1.0)) or 1.0
+        self.n_vocab = tensors['token_embd.weight'].shape[1]
+        self.tied_embeddings = 'output.weight' not in tensors
+
+    def float32_bytes(self) -> int:
+        """Memória aproximada dos pesos dequantizados em float32"""
+        attention = self.n_embd * self.head_dim * (2 * self.n_heads + 2 * self.n_kv_heads)
+        ffn = 3 * self.n_embd * self.n_ff
+        embeddings = self.n_vocab * self.n_embd * (1 if self.tied_embeddings else 2)
+        return 4 * (self.n_layers * (attention + ffn) + embeddings)
+
+
+def rms_norm(x: np.ndarray, weight: np.ndarray, eps: float) -> np.ndarray:
+    variance = np.mean(x * x, axis=-1, keepdims=True)
+    return x * (1.0 / np.sqrt(variance + eps)) * weight
+
+
+def silu(x: np.ndarray) -> np.ndarray:
+    return x / (1.0 + np.exp(-x))
+
+
+def softmax(x: np.ndarray, axis: int = -1) -> np.ndarray:
+    x = x - np.max(x, axis=axis, keepdims=True)
+    np.exp(x, out=x)
+    x /= np.sum(x, axis=axis, keepdims=True)
+    return x
+
+
+def blocked_attention(q: np.ndarray, keys, start: int, key_valid: np.ndarray,
+                      block_q: int = ATTENTION_BLOCK_Q, block_k: int = ATTENTION_BLOCK_K) -> np.ndarray:
+    """Atenção causal em blocos com softmax online (máximo e soma acumulados)
+
+    `q` (B, Hkv, G, T, hd) já escalado; `keys(first, last)` devolve k/v
+    (B, Hkv, n, hd) das posições [first, last); a consulta i está na posição
+    start + i. `key_valid` (B, start + T) marca as chaves de verdade; linhas
+    de padding atendem só a si mesmas. Nunca monta a matriz T x S inteira.
+    """
+    batch, kv_heads, group, length, head_dim = q.shape
+    out = np.empty_like(q)
+    for q_first in range(0, length, block_q):
+        q_last = min(q_first + block_q, length)
+        q_block = q[..., q_first:q_last, :]
+        rows = start + np.arange(q_first, q_last)
+        running_max = np.full(q_block.shape[:-1] + (1,), -np.inf, dtype=np.float32)
+        running_sum = np.zeros_like(running_max)
+        acc = np.zeros_like(q_block)
+        # Chaves além da última consulta do bloco são sempre mascaradas
+        for k_first in range(0, start + q_last, block_k):
+            k_last = min(k_first + block_k, start + q_last)
+            k, v = keys(k_first, k_last)
+            cols = np.arange(k_first, k_last)
+            allowed = (cols[None, :] <= rows[:, None]) & (
+                key_valid[:, None, k_first:k_last] | (cols[None, :] == rows[:, None]))
+            scores = q_block @ k[:, :, None].swapaxes(-1, -2)
+            scores = np.where(allowed[:, None, None], scores, np.float32(-np.inf))
+
+            block_max = np.maximum(running_max, scores.max(axis=-1, keepdims=True))
+            # Linhas ainda sem nenhuma chave permitida ficam com máximo -inf
+            safe_max = np.where(np.isfinite(block_max), block_max, np.float32(0))
+            probabilities = np.exp(scores - safe_max)
+            correction = np.exp(running_max - safe_max)
+            running_sum = running_sum * correction + probabilities.sum(axis=-1, keepdims=True)
+            acc = acc * correction + probabilities @ v[:, :, None]
+            running_max = block_max
+        out[..., q_first:q_last, :] = acc / running_sum
+    return out
+
+
+class KVCache:
+    """Chaves e valores já calculados, por camada, para a decodificação incremental
+
+    `dtype` escolhe o armazenamento: 'f32', 'f16' ou 'int8'. Em int8 cada
+    bloco de KV_QUANT_BLOCK valores de uma cabeça numa posição tem a própria
+    escala (como no Q8_0); quantiza na escrita e dequantiza na leitura, uma
+    camada por vez.
+    """
+
+    def __init__(self, config: ModelConfig, max_length: int, batch: int = 1, dtype: str = 'f32'):
+        if dtype not in KV_STORAGE:
+            raise ValueError(f"Tipo de KV cache desconhecido: {dtype}")
+        shape = (config.n_layers, batch, config.n_kv_heads, max_length, config.head_dim)
+        self.dtype = dtype
+        self.keys = np.zeros(shape, dtype=KV_STORAGE[dtype])
+        self.values = np.zeros(shape, dtype=KV_STORAGE[dtype])
+        self.key_scales = self.value_scales = None
+        if dtype == 'int8':
+            self.block = KV_QUANT_BLOCK if config.head_dim % KV_QUANT_BLOCK == 0 else config.head_dim
+            scale_shape = shape[:-1] + (config.head_dim // self.block,)
+            self.key_scales = np.zeros(scale_shape, dtype=np.float16)
+            self.value_scales = np.zeros(scale_shape, dtype=np.float16)
+        self.max_length = max_length
+        self.length = 0
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], length: int, dtype: str) -> "KVCache":
+        """Cache sobre arrays já existentes (ex.: memmap de um snapshot)"""
+        cache = cls.__new__(cls)
+        cache.dtype = dtype
+        cache.keys, cache.values = arrays['keys'], arrays['values']
+        cache.key_scales = arrays.get('key_scales')
+        cache.value_scales = arrays.get('value_scales')
+        if cache.key_scales is not None:
+            cache.block = cache.keys.shape[-1] // cache.key_scales.shape[-1]
+        cache.max_length = cache.keys.shape[3]
+        cache.length = length
+        return cache
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {'keys': self.keys, 'values': self.values}
+        if self.key_scales is not None:
+            arrays.update(key_scales=self.key_scales, value_scales=self.value_scales)
+        return arrays
+
+    def resized(self, max_length: int) -> "KVCache":
+        """Cópia com outra capacidade, mantendo as posições já preenchidas"""
+        keep = min(self.length, max_length)
+        arrays = {}
+        for name, array in self.arrays().items():
+            shape = array.shape[:3] + (max_length,) + array.shape[4:]
+            arrays[name] = np.zeros(shape, dtype=array.dtype)
+            arrays[name][:, :, :, :keep] = array[:, :, :, :keep]
+        return KVCache.from_arrays(arrays, keep, self.dtype)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.keys, self.values, self.key_scales, self.value_scales)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def _store(self, data, scales, layer: int, start: int, end: int, x: np.ndarray):
+        if scales is None:
+            data[layer, :, :, start:end] = x
+            return
+        blocks = x.reshape(x.shape[:-1] + (-1, self.block))
+        scale = (np.abs(blocks).max(axis=-1) / 127.0).astype(np.float16)
+        divisor = scale.astype(np.float32)
+        divisor[divisor == 0] = 1.0
+        quantized = np.clip(np.rint(blocks / divisor[..., None]), -127, 127)
+        data[layer, :, :, start:end] = quantized.astype(np.int8).reshape(x.shape)
+        scales[layer, :, :, start:end] = scale
+
+    def _load(self, data, scales, layer: int, start: int, end: int) -> np.ndarray:
+        stored = data[layer, :, :, start:end]
+        if scales is None:
+            return stored.astype(np.float32, copy=False)
+        blocks = stored.reshape(stored.shape[:-1] + (-1, self.block)).astype(np.float32)
+        blocks *= scales[layer, :, :, start:end, :, None]
+        return blocks.reshape(stored.shape)
+
+    def update(self, layer: int, k: np.ndarray, v: np.ndarray):
+        """Grava k/v (B, Hkv, T, hd) após as posições existentes"""
+        end = self.length + k.shape[2]
+        if end > self.max_length:
+            raise ValueError("KV cache cheio")
+        self._store(self.keys, self.key_scales, layer, self.length, end, k)
+        self._store(self.values, self.value_scales, layer, self.length, end, v)
+
+    def read(self, layer: int, start: int, end: int):
+        """k/v em float32 das posições [start, end) de uma camada"""
+        return (self._load(self.keys, self.key_scales, layer, start, end),
+                self._load(self.values, self.value_scales, layer, start, end))
+
+    def advance(self, count: int):
+        self.length += count
+
+
+class Sampler:
+    """Amostragem com temperatura, top-k e top-p (temperatura 0 = gulosa)"""
+
+    def __init__(self, temperature: float = 0.7, top_k: int = 40, top_p: float = 0.95,
+                 seed: Optional[int] = None):
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.rng = np.random.default_rng(seed)
+
+    def state(self) -> Dict:
+        return {'temperature': self.temperature, 'top_k': self.top_k, 'top_p': self.top_p,
+                'rng': self.rng.bit_generator.state}
+
+    def restore(self, state: Dict):
+        self.temperature = state['temperature']
+        self.top_k = state['top_k']
+        self.top_p = state['top_p']
+        self.rng.bit_generator.state = state['rng']
+
+    def sample(self, logits: np.ndarray) -> int:
+        if self.temperature <= 0:
+            return int(np.argmax(logits))
+        logits = logits.astype(np.float64) / self.temperature
+        if 0 < self.top_k < len(logits):
+            candidates = np.argpartition(-logits, self.top_k - 1)[:self.top_k]
+        else:
+            candidates = np.arange(len(logits))
+        candidates = candidates[np.argsort(-logits[candidates])]
+        probabilities = np.exp(logits[candidates] - logits[candidates[0]])
+        probabilities /= probabilities.sum()
+        if self.top_p < 1.0:
+            keep = int(np.searchsorted(np.cumsum(probabilities), self.top_p)) + 1
+            candidates, probabilities = candidates[:keep], probabilities[:keep]
+            probabilities /= probabilities.sum()
+        return int(self.rng.choice(candidates, p=probabilities))
+
+
+class PromptState:
+    """KV cache da última geração e os tokens que ele contém"""
+
+    __slots__ = ('tokens', 'cache', 'adapter')
+
+    def __init__(self, tokens: List[int], cache: KVCache, adapter: Optional[str] = None):
+        self.tokens = tokens
+        self.cache = cache
+        self.adapter = adapter
+
+
+class LoraAdapter:
+    """Adaptador LoRA aplicado em tempo de execução: x·Aᵀ·Bᵀ somado à projeção base
+
+    Lido de um GGUF de adaptador (tensores `<peso>.lora_a`/`<peso>.lora_b`,
+    metadado `adapter.lora.alpha`) ou de um .npz com as mesmas chaves e um
+    `alpha` opcional. Os pesos do modelo base não são tocados.
+    """
+
+    def __init__(self, name: str, pairs: Dict[str, Tuple[np.ndarray, np.ndarray]],
+                 alpha: Optional[float] = None, scale: float = 1.0):
+        self.name = name
+        self.pairs = {}
+        for weight, (a, b) in pairs.items():
+            factor = scale * (alpha / a.shape[0] if alpha else 1.0)
+            # Transpostas e já com a escala: cada passo faz só dois produtos
+            self.pairs[weight] = (np.ascontiguousarray(a.T, dtype=np.float32),
+                                  np.ascontiguousarray(b.T * factor, dtype=np.float32))
+
+    @classmethod
+    def load(cls, path, name: Optional[str] = None, scale: float = 1.0) -> "LoraAdapter":
+        path = Path(path)
+        if path.suffix == '.npz':
+            with np.load(path) as data:
+                tensors = {key: data[key] for key in data.files}
+            alpha = tensors.pop('alpha', None)
+        else:
+            from gguf_loader import GGUFReader
+            reader = GGUFReader(path)
+            try:
+                tensors = {key: np.array(reader.dequantize_tensor(key), dtype=np.float32)
+                           for key in reader.tensors}
+                alpha = reader.fields.get('adapter.lora.alpha')
+            finally:
+                reader.close()
+
+        pairs = {}
+        for key, a in tensors.items():
+            if key.endswith('.lora_a'):
+                weight = key[:-len('.lora_a')]
+                b = tensors.get(f'{weight}.lora_b')
+                if b is None:
+                    raise ValueError(f"{weight}.lora_b ausente em {path.name}")
+                pairs[weight] = (a, b)
+        if not pairs:
+            raise ValueError(f"Nenhum par lora_a/lora_b em {path.name}")
+        return cls(name or path.stem, pairs, float(alpha) if alpha is not None else None, scale)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes + b.nbytes for a, b in self.pairs.values())
+
+    def delta(self, h: np.ndarray, weight: str) -> Optional[np.ndarray]:
+        pair = self.pairs.get(weight)
+        if pair is None:
+            return None
+        return (h @ pair[0]) @ pair[1]
+
+
+class NumpyEngine:
+    """Transformer LLaMA/Qwen executado em NumPy sobre os pesos do GGUF"""
+
+    def __init__(self, reader, max_memory_mb: Optional[float] = None, kv_dtype: str = 'f32'):
+        if kv_dtype not in KV_STORAGE:
+            raise ValueError(f"Tipo de KV cache desconhecido: {kv_dtype}")
+        if reader.architecture not in SUPPORTED_ARCHITECTURES:
+            raise ValueError(f"Arquitetura não suportada pelo motor NumPy: {reader.architecture}")
+        self.reader = reader
+        self.config = ModelConfig(reader.fields, reader.tensors)
+        needed_mb = self.config.float32_bytes() / 1024 / 1024
+        if max_memory_mb is not None and needed_mb > max_memory_mb:
+            raise MemoryError(f"Modelo precisa de ~{needed_mb:.0f} MB em float32 "
+                              f"(limite {max_memory_mb:.0f} MB)")
+
+        config = self.config
+        self.inv_freq = 1.0 / (config.rope_base ** (
+            np.arange(0, config.rope_dim, 2, dtype=np.float64) / config.rope_dim))
+        self.rope_cos = self.rope_sin = None
+        self._rope_tables(min(config.context_length, ROPE_TABLE_LENGTH))
+        self.kv_dtype = kv_dtype
+        self.prefill_chunk = PREFILL_CHUNK
+        self.prefill_target_ms = PREFILL_TARGET_MS
+        self.adapters: Dict[str, LoraAdapter] = {}
+        # Prefixo já processado: o próximo prompt da conversa só calcula o que mudou
+        self.prompt_state: Optional[PromptState] = None
+        # Prefixos de pedidos fora da conversa (ex.: decodificação restrita), por
+        # nome: não disputam o cache da conversa
+        self.named_states: Dict[str, PromptState] = {}
+        self._weights = {}
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+
+    # --- Pesos ---
+
+    def weight(self, name: str) -> Optional[np.ndarray]:
+        """Tensor em float32, dequantizado na primeira vez que é usado"""
+        value = self._weights.get(name)
+        if value is None:
+            if name not in self.reader.tensors:
+                return None
+            with self._lock:
+                value = self._weights.get(name)
+                if value is None:
+                    value = np.ascontiguousarray(self.reader.dequantize_tensor(name),
+                                                 dtype=np.float32)
+                    self._weights[name] = value
+        return value
+
+    def _layer(self, index: int, name: str) -> Optional[np.ndarray]:
+        return self.weight(f'blk.{index}.{name}')
+
+    # --- Adaptadores LoRA ---
+
+    def add_adapter(self, adapter: LoraAdapter):
+        """Registra um adaptador depois de conferir as formas contra o modelo base"""
+        for weight, (a, b) in adapter.pairs.items():
+            base = self.weight(weight)
+            if base is None:
+                raise ValueError(f"Adaptador {adapter.name}: peso {weight} não existe no modelo")
+            if a.shape[0] != base.shape[1] or b.shape[1] != base.shape[0]:
+                raise ValueError(f"Adaptador {adapter.name}: formas incompatíveis em {weight}")
+        self.adapters[adapter.name] = adapter
+        logger.info("Adaptador LoRA %s: %d pesos, %.1f MB", adapter.name,
+                    len(adapter.pairs), adapter.nbytes / 1024 / 1024)
+
+    def remove_adapter(self, name: str):
+        self.adapters.pop(name, None)
+
+    def _adapter(self, name: Optional[str]) -> Optional[LoraAdapter]:
+        if name is None:
+            return None
+        adapter = self.adapters.get(name)
+        if adapter is None:
+            raise ValueError(f"Adaptador LoRA não carregado: {name}")
+        return adapter
+
+    # --- Blocos do transformer ---
+
+    def _rope_tables(self, length: int):
+        """Seno e cosseno (posição x rope_dim/2) para as posições 0..length-1"""
+        angles = (np.arange(length, dtype=np.float64)[:, None] / self.config.rope_scale
+                  * self.inv_freq)
+        self.rope_cos = np.cos(angles).astype(np.float32)
+        self.rope_sin = np.sin(angles).astype(np.float32)
+
+    def rope(self, x: np.ndarray, positions: np.ndarray) -> np.ndarray:
+        """Aplica RoPE em x (B, T, H, hd) para as posições (B, T)"""
+        config = self.config
+        needed = int(positions.max()) + 1
+        if needed > len(self.rope_cos):
+            # Além da tabela inicial: dobra até cobrir (raro, contextos longos)
+            self._rope_tables(max(needed, 2 * len(self.rope_cos)))
+        cos = self.rope_cos[positions][:, :, None, :]
+        sin = self.rope_sin[positions][:, :, None, :]
+        rotated, rest = x[..., :config.rope_dim], x[..., config.rope_dim:]
+        if config.rope_neox:
+            half = config.rope_dim // 2
+            x1, x2 = rotated[..., :half], rotated[..., half:]
+            out = np.concatenate((x1 * cos - x2 * sin, x2 * cos + x1 * sin), axis=-1)
+        else:
+            x1, x2 = rotated[..., 0::2], rotated[..., 1::2]
+            out = np.empty_like(rotated)
+            out[..., 0::2] = x1 * cos - x2 * sin
+            out[..., 1::2] = x2 * cos + x1 * sin
+        return np.concatenate((out, rest), axis=-1) if rest.shape[-1] else out
+
+    def _linear(self, h: np.ndarray, index: int, name: str,
+                lora: Optional[LoraAdapter] = None) -> np.ndarray:
+        weight = f'blk.{index}.{name}.weight'
+        out = h @ self.weight(weight).T
+        if lora is not None:
+            delta = lora.delta(h, weight)
+            if delta is not None:
+                out += delta
+        return out
+
+    def _project(self, h: np.ndarray, index: int, name: str,
+                 lora: Optional[LoraAdapter] = None) -> np.ndarray:
+        out = self._linear(h, index, name, lora)
+        bias = self._layer(index, f'{name}.bias')
+        return out + bias if bias is not None else out
+
+    def attention_layer(self, x: np.ndarray, index: int, positions: np.ndarray,
+                        key_valid: np.ndarray, cache: Optional[KVCache] = None,
+                        lora: Optional[LoraAdapter] = None) -> np.ndarray:
+        config = self.config
+        batch, length, _ = x.shape
+        h = rms_norm(x, self._layer(index, 'attn_norm.weight'), config.norm_eps)
+
+        q = self._project(h, index, 'attn_q', lora).reshape(batch, length, config.n_heads, config.head_dim)
+        k = self._project(h, index, 'attn_k', lora).reshape(batch, length, config.n_kv_heads, config.head_dim)
+        v = self._project(h, index, 'attn_v', lora).reshape(batch, length, config.n_kv_heads, config.head_dim)
+
+        # Qwen3 normaliza q e k por cabeça antes do RoPE
+        q_norm = self._layer(index, 'attn_q_norm.weight')
+        if q_norm is not None:
+            q = rms_norm(q, q_norm, config.norm_eps)
+            k = rms_norm(k, self._layer(index, 'attn_k_norm.weight'), config.norm_eps)
+
+        q = self.rope(q, positions)
+        k = self.rope(k, positions)
+
+        # (B, Hkv, grupo, T, hd): cada cabeça de K/V atende um grupo de cabeças de Q
+        group = config.n_heads // config.n_kv_heads
+        q = q.reshape(batch, length, config.n_kv_heads, group, config.head_dim).transpose(0, 2, 3, 1, 4)
+        q = q * np.float32(1.0 / np.sqrt(config.head_dim))
+        k = k.transpose(0, 2, 1, 3)
+        v = v.transpose(0, 2, 1, 3)
+        start = 0
+        if cache is not None:
+            start = cache.length
+            cache.update(index, k, v)
+            keys = lambda first, last: cache.read(index, first, last)
+        else:
+            keys = lambda first, last: (k[:, :, first:last], v[:, :, first:last])
+
+        out = blocked_attention(q, keys, start, key_valid)
+        out = out.transpose(0, 3, 1, 2, 4).reshape(batch, length, config.n_heads * config.head_dim)
+        return self._linear(out, index, 'attn_output', lora)
+
+    def feed_forward(self, x: np.ndarray, index: int, lora: Optional[LoraAdapter] = None) -> np.ndarray:
+        h = rms_norm(x, self._layer(index, 'ffn_norm.weight'), self.config.norm_eps)
+        gate = self._linear(h, index, 'ffn_gate', lora)
+        up = self._linear(h, index, 'ffn_up', lora)
+        return self._linear(silu(gate) * up, index, 'ffn_down', lora)
+
+    def forward(self, tokens: np.ndarray, attention_mask: Optional[np.ndarray] = None,
+                cache: Optional[KVCache] = None, adapter: Optional[str] = None) -> np.ndarray:
+        """Estados ocultos finais (B, T, D) para um lote de sequências
+
+        `attention_mask` (B, T) marca as posições válidas; as de padding nunca
+        são atendidas e não avançam a posição do RoPE. Com `cache`, os tokens
+        continuam a sequência já processada (sem padding). `adapter` é o nome
+        de um adaptador LoRA registrado.
+        """
+        lora = self._adapter(adapter)
+        tokens = np.atleast_2d(np.asarray(tokens, dtype=np.int64))
+        batch, length = tokens.shape
+        start = cache.length if cache is not None else 0
+        if attention_mask is None:
+            attention_mask = np.ones((batch, length), dtype=bool)
+        attention_mask = attention_mask.astype(bool)
+
+        positions = start + np.maximum(np.cumsum(attention_mask, axis=1) - 1, 0)
+        key_valid = np.concatenate((np.ones((batch, start), dtype=bool), attention_mask), axis=1)
+
+        x = self.weight('token_embd.weight')[tokens]
+        for index in range(self.config.n_layers):
+            with profiler.span('engine.layer'):
+                x = x + self.attention_layer(x, index, positions, key_valid, cache, lora)
+                x = x + self.feed_forward(x, index, lora)
+        if cache is not None:
+            cache.advance(length)
+        return rms_norm(x, self.weight('output_norm.weight'), self.config.norm_eps)
+
+    def logits(self, hidden: np.ndarray) -> np.ndarray:
+        output = self.weight('output.weight')
+        if output is None:
+            output = self.weight('token_embd.weight')
+        return hidden @ output.T
+
+    # --- Geração ---
+
+    def generate(self, prompt_ids: Sequence[int], max_tokens: int, sampler: Sampler,
+                 stop_ids: Sequence[int] = (), adapter: Optional[str] = None,
+                 state: Optional[str] = None) -> Iterator[Optional[int]]:
+        """Gera ids de token um a um (prefill do prompt e decodificação com KV cache)
+
+        O prompt entra em pedaços de `prefill_chunk` tokens; entre um pedaço e
+        outro sai None, para quem intercala várias gerações poder atender as
+        outras antes de o prompt terminar. `state` escolhe um prefixo guardado
+        à parte (None = o da conversa).
+        """
+        budget = self.config.context_length - max_tokens
+        prompt_ids = list(prompt_ids)[-max(budget, 1):]
+        cache, position = self._take_prompt_state(prompt_ids, len(prompt_ids) + max_tokens,
+                                                  adapter, state)
+        # Tokens cujas chaves/valores estão no cache
+        cached = prompt_ids[:position]
+        try:
+            while True:
+                chunk = prompt_ids[position:position + self.prefill_chunk]
+                started = time.perf_counter()
+                with profiler.span('prefill'):
+                    hidden = self.forward(np.array([chunk]), cache=cache, adapter=adapter)
+                cached.extend(chunk)
+                position += len(chunk)
+                if position >= len(prompt_ids):
+                    break
+                self._adapt_prefill_chunk(len(chunk), time.perf_counter() - started)
+                yield None
+
+            for _ in range(max_tokens):
+                with profiler.span('sampling'):
+                    token = sampler.sample(self.logits(hidden[0, -1]))
+                if token in stop_ids:
+                    return
+                yield token
+                with profiler.span('decode'):
+                    hidden = self.forward(np.array([[token]]), cache=cache, adapter=adapter)
+                cached.append(token)
+        finally:
+            with self._state_lock:
+                if state is None:
+                    self.prompt_state = PromptState(cached, cache, adapter)
+                else:
+                    self.named_states[state] = PromptState(cached, cache, adapter)
+
+    def _take_prompt_state(self, prompt_ids: List[int], needed: int, adapter: Optional[str],
+                           name: Optional[str] = None):
+        """(cache, posições reaproveitadas) para um novo prompt
+
+        Reaproveita o maior prefixo em comum com a geração anterior (mesmo
+        adaptador e mesmo `name`), deixando ao menos um token para calcular os
+        logits.
+        """
+        with self._state_lock:
+            if name is None:
+                state, self.prompt_state = self.prompt_state, None
+            else:
+                state = self.named_states.pop(name, None)
+        capacity = min(self.config.context_length, 2 * needed)
+        if state is None or state.adapter != adapter or state.cache.dtype != self.kv_dtype:
+            return KVCache(self.config, max(capacity, needed), dtype=self.kv_dtype), 0
+
+        limit = min(len(state.tokens), len(prompt_ids) - 1)
+        differs = np.flatnonzero(np.asarray(state.tokens[:limit]) != np.asarray(prompt_ids[:limit]))
+        reuse = int(differs[0]) if len(differs) else limit
+        cache = state.cache
+        cache.length = reuse
+        if cache.max_length < needed:
+            cache = cache.resized(max(capacity, needed))
+        profiler.count('prefill.reused_tokens', reuse)
+        return cache, reuse
+
+    def _adapt_prefill_chunk(self, size: int, elapsed: float):
+        """Aproxima o tempo de cada pedaço do prefill de `prefill_target_ms`"""
+        if size < self.prefill_chunk or elapsed <= 0:
+            return
+        ideal = size * self.prefill_target_ms / (elapsed * 1000.0)
+        # Média geométrica com o atual para não oscilar a cada medida
+        chunk = int(np.sqrt(ideal * size)) // PREFILL_CHUNK_MIN * PREFILL_CHUNK_MIN
+        self.prefill_chunk = min(max(chunk, PREFILL_CHUNK_MIN), PREFILL_CHUNK_MAX)
+
+    def kv_accuracy(self, prompt_ids: Sequence[int], steps: int = 16,
+                    dtypes: Sequence[str] = ('f16', 'int8')) -> Dict:
+        """Compara os logits com KV cache reduzido contra o float32
+
+        Decodifica `steps` tokens gulosamente com o cache float32 e repete a
+        mesma sequência com cada tipo. Para cada um devolve o maior erro
+        absoluto dos logits, a fração de passos com o mesmo token mais
+        provável e os bytes de cache por token.
+        """
+        prompt_ids = list(prompt_ids)
+        reference, tokens = self._teacher_forced(prompt_ids, steps, 'f32')
+        report = {}
+        for dtype in dtypes:
+            logits, _ = self._teacher_forced(prompt_ids, steps, dtype, tokens)
+            cache = KVCache(self.config, 1, dtype=dtype)
+            report[dtype] = {
+                'max_error': float(np.max(np.abs(logits - reference))),
+                'top1_agreement': float(np.mean(np.argmax(logits, axis=1)
+                                                == np.argmax(reference, axis=1))),
+                'bytes_per_token': cache.nbytes,
+            }
+        return report
+
+    def _teacher_forced(self, prompt_ids: List[int], steps: int, dtype: str,
+                        tokens: Optional[List[int]] = None):
+        """Logits de cada passo; sem `tokens`, segue o token mais provável"""
+        cache = KVCache(self.config, len(prompt_ids) + steps, dtype=dtype)
+        hidden = self.forward(np.array([prompt_ids]), cache=cache)
+        rows, chosen = [], []
+        for step in range(steps):
+            logits = self.logits(hidden[0, -1])
+            rows.append(logits)
+            token = tokens[step] if tokens is not None else int(np.argmax(logits))
+            chosen.append(token)
+            hidden = self.forward(np.array([[token]]), cache=cache)
+        return np.stack(rows), chosen
+
+    # --- Embeddings ---
+
+    def embed(self, token_lists: Sequence[Sequence[int]], batch_size: int = 16) -> np.ndarray:
+        """Média dos estados ocultos de cada sequência (float32, n x D)
+
+        As sequências são ordenadas por tamanho antes de formar os lotes para
+        reduzir o padding.
+        """
+        result = np.zeros((len(token_lists), self.config.n_embd), dtype=np.float32)
+        order = sorted(range(len(token_lists)), key=lambda i: len(token_lists[i]))
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            length = max(1, max(len(token_lists[i]) for i in indices))
+            tokens = np.zeros((len(indices), length), dtype=np.int64)
+            valid = np.zeros((len(indices), length), dtype=bool)
+            for row, i in enumerate(indices):
+                ids = token_lists[i]
+                tokens[row, :len(ids)] = ids
+                valid[row, :len(ids)] = True
+            with profiler.span('engine.embed_batch'):
+                hidden = self.forward(tokens, valid)
+            counts = np.maximum(valid.sum(axis=1, keepdims=True), 1)
+            result[indices] = (hidden * valid[..., None]).sum(axis=1) / counts
+        return result
+
+
+def build_engine(reader, max_memory_mb: Optional[float] = None,
+                 kv_dtype: str = 'f32') -> Optional[NumpyEngine]:
+    """Cria o motor se a arquitetura e a memória permitirem"""
+    try:
+        return NumpyEngine(reader, max_memory_mb=max_memory_mb, kv_dtype=kv_dtype)
+    except (ValueError, KeyError, TypeError, MemoryError) as e:
+        logger.info("Motor NumPy indisponível: %s", e)
+        return None
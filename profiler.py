@@ -0,0 +1,196 @@
+"""
+Instrumentação leve dos caminhos quentes do TerlineT
+Spans e contadores com relógio monotônico, histogramas em arrays de tamanho
+fixo e exportação no formato Chrome trace (chrome://tracing / Perfetto).
+Desativado por padrão: nesse caso cada span custa uma checagem de flag.
+
+Ative com a variável de ambiente TERLINET_PROFILE=1 ou com `enable()`.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from array import array
+from collections import deque
+
+# Buckets em potências de 2 de nanossegundos (1ns .. ~2^47ns ≈ 39h)
+HISTOGRAM_BUCKETS = 48
+TRACE_CAPACITY = 200000
+
+_enabled = os.environ.get('TERLINET_PROFILE', '') not in ('', '0')
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_trace = deque(maxlen=TRACE_CAPACITY)
+_origin_ns = time.perf_counter_ns()
+_pid = os.getpid()
+
+
+class Histogram:
+    """Histograma de durações com buckets logarítmicos pré-alocados"""
+
+    __slots__ = ('buckets', 'count', 'total_ns', 'min_ns', 'max_ns')
+
+    def __init__(self):
+        self.buckets = array('q', [0] * HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+
+    def add(self, duration_ns: int):
+        index = min(max(duration_ns, 1).bit_length() - 1, HISTOGRAM_BUCKETS - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        if self.min_ns is None or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    def percentile(self, fraction: float) -> float:
+        """Percentil aproximado (limite superior do bucket), em ms"""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, amount in enumerate(self.buckets):
+            seen += amount
+            if seen >= target:
+                return min(2 ** (index + 1), self.max_ns) / 1e6
+        return self.max_ns / 1e6
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ns / 1e6, 3),
+            'mean_ms': round(self.total_ns / self.count / 1e6, 4) if self.count else 0.0,
+            'min_ms': round((self.min_ns or 0) / 1e6, 4),
+            'p50_ms': round(self.percentile(0.5), 4),
+            'p95_ms': round(self.percentile(0.95), 4),
+            'max_ms': round(self.max_ns / 1e6, 4),
+        }
+
+
+class _Span:
+    __slots__ = ('name', 'start_ns')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        record(self.name, self.start_ns, time.perf_counter_ns())
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _trace.clear()
+
+
+def span(name: str):
+    """Mede o bloco `with` sob o nome dado"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def profiled(name: str):
+    """Decorador equivalente a envolver a função num `span`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, start, time.perf_counter_ns())
+        return wrapper
+    return decorator
+
+
+def record(name: str, start_ns: int, end_ns: int):
+    """Registra uma duração medida externamente"""
+    if not _enabled:
+        return
+    duration = end_ns - start_ns
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(duration)
+    _trace.append(('X', name, threading.get_ident(), start_ns, duration))
+
+
+def count(name: str, value: int = 1):
+    """Incrementa um contador"""
+    if not _enabled:
+        return
+    with _lock:
+        total = _counters.get(name, 0) + value
+        _counters[name] = total
+    _trace.append(('C', name, threading.get_ident(), time.perf_counter_ns(), total))
+
+
+def summary() -> dict:
+    """Resumo dos histogramas e contadores coletados"""
+    with _lock:
+        return {
+            'spans': {name: histogram.summary() for name, histogram in sorted(_histograms.items())},
+            'counters': dict(sorted(_counters.items())),
+        }
+
+
+def export_chrome_trace(path: str) -> int:
+    """Salva os eventos no formato Chrome trace e retorna quantos foram escritos"""
+    events = []
+    for kind, name, thread_id, start_ns, value in list(_trace):
+        timestamp = (start_ns - _origin_ns) / 1000
+        if kind == 'X':
+            events.append({'name': name, 'ph': 'X', 'ts': timestamp, 'dur': value / 1000,
+                           'pid': _pid, 'tid': thread_id, 'cat': name.split('.', 1)[0]})
+        else:
+            events.append({'name': name, 'ph': 'C', 'ts': timestamp, 'pid': _pid,
+                           'tid': thread_id, 'args': {name: value}})
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                   'otherData': {'summary': summary()}}, f)
+    return len(events)
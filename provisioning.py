@@ -0,0 +1,214 @@
+"""
+Provisionamento do modelo do TerlineT
+O .gguf não vai mais dentro do APK: na primeira execução ele é importado de um
+caminho local ou de um arquivo colocado no aparelho (Download, adb push) para
+TerlineT/modelo. No mesmo sistema de arquivos (o caso do Download no Android)
+o arquivo só é movido, sem ocupar o dobro do espaço. Entre sistemas de
+arquivos diferentes a cópia é feita em blocos grandes pelo kernel
+(copy_file_range/sendfile quando existem), confere o espaço livre antes e
+pode ser retomada se o app for encerrado no meio. A origem é resumida bloco a
+bloco durante a cópia; o resumo vira a referência (<modelo>.sha256) que o
+integrity.py confere na primeira carga.
+"""
+
+import errno
+import json
+import logging
+import os
+import shutil
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import integrity
+
+logger = logging.getLogger('TerlineT.provisioning')
+
+COPY_CHUNK = 64 * 1024 * 1024
+# Folga no disco além do tamanho do modelo
+FREE_SPACE_MARGIN = 64 * 1024 * 1024
+
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.part.json'
+
+# Resultado de provision()
+PROVISION_PRESENT = 'existente'
+PROVISION_MOVED = 'movido'
+PROVISION_COPIED = 'copiado'
+
+
+class ProvisioningError(RuntimeError):
+    """Não foi possível importar o modelo"""
+
+
+def find_source(target: str, candidates: Iterable[Optional[str]]) -> Optional[str]:
+    """Primeiro candidato existente (e diferente do destino) para importar"""
+    target = os.path.abspath(target)
+    for candidate in candidates:
+        if not candidate:
+            continue
+        candidate = os.path.abspath(os.path.expanduser(str(candidate)))
+        if candidate != target and os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def _source_id(source: str) -> dict:
+    stat = os.stat(source)
+    return {'source': source, 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def _resume_offset(part_path: str, state_path: str, source_id: dict) -> Tuple[int, List[bytes]]:
+    """Bytes já copiados de uma importação anterior da mesma origem e os
+    resumos dos blocos da origem já calculados"""
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = None
+    if not state or {key: state.get(key) for key in source_id} != source_id:
+        # Origem diferente (ou sem registro): começa do zero
+        for path in (part_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return 0, []
+    try:
+        part_size = os.path.getsize(part_path)
+    except OSError:
+        return 0, []
+    # Só vale o que foi gravado em disco (fsync) antes do registro
+    copied = min(int(state.get('copied', 0)), part_size)
+    digests = [bytes.fromhex(digest) for digest in state.get('digests', [])]
+    return copied, digests[:copied // integrity.VERIFY_CHUNK]
+
+
+def _save_state(state_path: str, source_id: dict, copied: int, digests: List[bytes]):
+    temporary = state_path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(dict(source_id, copied=copied, digests=[digest.hex() for digest in digests]), f)
+    os.replace(temporary, state_path)
+
+
+def _hash_copied(source: str, digests: List[bytes], copied: int, total: int):
+    """Resume os blocos da origem já copiados (ainda no cache de páginas)"""
+    chunk = integrity.VERIFY_CHUNK
+    while len(digests) * chunk < copied:
+        start = len(digests) * chunk
+        end = min(start + chunk, total)
+        if end > copied:
+            break
+        digests.append(integrity.hash_range(source, start, end - start))
+
+
+def _copy_methods():
+    """Formas de copiar um bloco, da mais eficiente à mais simples"""
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append(('copy_file_range', lambda src, dst, offset, count:
+                        os.copy_file_range(src.fileno(), dst.fileno(), count, offset, offset)))
+    if hasattr(os, 'sendfile'):
+        def sendfile(src, dst, offset, count):
+            dst.seek(offset)
+            return os.sendfile(dst.fileno(), src.fileno(), offset, count)
+        methods.append(('sendfile', sendfile))
+
+    def read_write(src, dst, offset, count):
+        src.seek(offset)
+        data = src.read(min(count, 8 * 1024 * 1024))
+        dst.seek(offset)
+        dst.write(data)
+        return len(data)
+    methods.append(('read/write', read_write))
+    return methods
+
+
+def _move(source: str, target: str) -> bool:
+    """Move com rename; False se origem e destino estão em sistemas de arquivos diferentes"""
+    try:
+        os.rename(source, target)
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            return False
+        raise
+    if os.path.exists(source + integrity.DIGEST_SUFFIX):
+        os.replace(source + integrity.DIGEST_SUFFIX, target + integrity.DIGEST_SUFFIX)
+    return True
+
+
+def provision(source: str, target: str,
+              progress: Optional[Callable[[int, int], None]] = None,
+              chunk_size: int = COPY_CHUNK) -> str:
+    """Importa source para target uma única vez; retoma cópias interrompidas
+
+    Retorna PROVISION_PRESENT, PROVISION_MOVED (rename, a origem deixa de
+    existir) ou PROVISION_COPIED (a origem continua lá). progress(copiados,
+    total) é chamado a cada bloco copiado (na thread que chamou).
+    """
+    source_id = _source_id(source)
+    total = source_id['size']
+    if os.path.exists(target) and os.path.getsize(target) == total:
+        logger.info("Modelo já importado em %s", target)
+        return PROVISION_PRESENT
+
+    directory = os.path.dirname(os.path.abspath(target))
+    os.makedirs(directory, exist_ok=True)
+    part_path, state_path = target + PART_SUFFIX, target + STATE_SUFFIX
+    if _move(source, target):
+        for path in (part_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        logger.info("Modelo movido de %s para %s (%d MB)", source, target, total // 2**20)
+        if progress is not None:
+            progress(total, total)
+        return PROVISION_MOVED
+    copied, digests = _resume_offset(part_path, state_path, source_id)
+
+    free = shutil.disk_usage(directory).free
+    needed = total - copied + FREE_SPACE_MARGIN
+    if free < needed:
+        raise ProvisioningError(
+            f"Espaço insuficiente em {directory}: {needed // 2**20} MB necessários, "
+            f"{free // 2**20} MB livres")
+
+    if copied:
+        logger.info("Retomando a importação de %s em %.0f%%", source, 100.0 * copied / total)
+    else:
+        _save_state(state_path, source_id, 0, digests)
+
+    methods = _copy_methods()
+    mode = 'r+b' if copied else 'wb'
+    with open(source, 'rb', buffering=0) as src, open(part_path, mode, buffering=0) as dst:
+        dst.truncate(copied)
+        while copied < total:
+            end = min(copied + chunk_size, total)
+            while copied < end:
+                name, method = methods[0]
+                try:
+                    written = method(src, dst, copied, end - copied)
+                except OSError as e:
+                    if len(methods) == 1:
+                        raise
+                    # Sem suporte entre esses sistemas de arquivos: próximo método
+                    logger.debug("%s indisponível (%s)", name, e)
+                    methods.pop(0)
+                    continue
+                if not written:
+                    raise ProvisioningError(f"{source} terminou antes do esperado")
+                copied += written
+            os.fsync(dst.fileno())
+            _hash_copied(source, digests, copied, total)
+            _save_state(state_path, source_id, copied, digests)
+            if progress is not None:
+                progress(copied, total)
+
+    digest = integrity.combine_digests(digests)
+    expected = integrity.expected_digest(source)
+    if expected is not None and expected != digest:
+        for path in (part_path, state_path):
+            os.remove(path)
+        raise ProvisioningError(f"{source} não confere com {source}{integrity.DIGEST_SUFFIX}")
+    # Referência para a verificação completa na primeira carga
+    integrity.write_digest(target, digest)
+    os.replace(part_path, target)
+    os.remove(state_path)
+    logger.info("Modelo importado de %s para %s (%d MB, %s)",
+                source, target, total // 2**20, methods[0][0])
+    return PROVISION_COPIED
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Re-quantização offline de modelos GGUF do TerlineT
+Converte um GGUF F16/F32 para Q8_0 ou Q4_0 numa única passada: cada tensor é
+lido do mmap em fatias, quantizado com operações vetorizadas do NumPy sobre
+os blocos de 32 valores e gravado no arquivo de saída pelo GGUFWriter. Os
+metadados são copiados com os tipos originais; o pico de memória fica em
+algumas fatias, abaixo do tamanho de um tensor.
+
+Tensores 1-D (normas, bias), já quantizados ou com linhas que não são
+múltiplas de 32 são copiados como estão, assim como os de nome casado
+inteiro por --keep.
+
+Uso:
+    python requantize.py modelo-f16.gguf modelo-q4_0.gguf --type Q4_0
+    python requantize.py modelo-f16.gguf modelo-q8_0.gguf --type Q8_0 --keep 'output\\.weight|token_embd\\.weight'
+"""
+
+import argparse
+import logging
+import os
+import re
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from gguf_loader import (GGML_BLOCK_SIZES, GGML_TYPE_BF16, GGML_TYPE_F16, GGML_TYPE_F32,
+                         GGML_TYPE_NAMES, GGML_TYPE_Q4_0, GGML_TYPE_Q8_0, GGUF_TYPE_UINT32,
+                         GGUFReader, dequantize)
+from gguf_writer import GGUFWriter
+
+logger = logging.getLogger('TerlineT.requantize')
+
+QK = 32
+# Elementos por fatia (múltiplo de QK): ~4 MB em float32
+SLICE_ELEMENTS = 1 << 20
+
+# general.file_type do llama.cpp (LLAMA_FTYPE_MOSTLY_*)
+FILE_TYPES = {GGML_TYPE_Q8_0: 7, GGML_TYPE_Q4_0: 2}
+QUANTIZATION_VERSION = 2
+
+_FLOAT_TYPES = (GGML_TYPE_F32, GGML_TYPE_F16, GGML_TYPE_BF16)
+
+
+def _scales(d: np.ndarray) -> np.ndarray:
+    return d.astype('<f2').view(np.uint8).reshape(-1, 2)
+
+
+def _inverse(d: np.ndarray) -> np.ndarray:
+    return np.divide(np.float32(1), d, out=np.zeros_like(d), where=d != 0)
+
+
+def quantize_q8_0(values: np.ndarray) -> np.ndarray:
+    """Blocos Q8_0 (escala f16 + 32 int8), como o quantize_row_q8_0 do ggml"""
+    x = values.reshape(-1, QK)
+    d = np.abs(x).max(axis=1) / np.float32(127)
+    q = x * _inverse(d)[:, None]
+    # roundf (metade se afasta do zero); a conversão para int8 já trunca
+    q += np.copysign(np.float32(0.5), q)
+    q = q.astype(np.int8)
+    blocks = np.empty((len(x), 2 + QK), dtype=np.uint8)
+    blocks[:, :2] = _scales(d)
+    blocks[:, 2:] = q.view(np.uint8)
+    return blocks
+
+
+def quantize_q4_0(values: np.ndarray) -> np.ndarray:
+    """Blocos Q4_0 (escala f16 + 16 bytes de nibbles), como o quantize_row_q4_0 do ggml"""
+    x = values.reshape(-1, QK)
+    # Valor de maior módulo, com sinal: vira -8 na escala
+    peak = np.take_along_axis(x, np.abs(x).argmax(axis=1)[:, None], axis=1)[:, 0]
+    d = peak / np.float32(-8)
+    q = (x * _inverse(d)[:, None] + np.float32(8.5)).astype(np.int8)
+    q = np.minimum(q, 15).astype(np.uint8)
+    blocks = np.empty((len(x), 2 + QK // 2), dtype=np.uint8)
+    blocks[:, :2] = _scales(d)
+    blocks[:, 2:] = q[:, :QK // 2] | (q[:, QK // 2:] << 4)
+    return blocks
+
+
+QUANTIZERS = {GGML_TYPE_Q8_0: quantize_q8_0, GGML_TYPE_Q4_0: quantize_q4_0}
+TARGET_TYPES = {GGML_TYPE_NAMES[ggml_type]: ggml_type for ggml_type in QUANTIZERS}
+
+
+def quantizable(info) -> bool:
+    """Só matrizes de ponto flutuante com linhas em blocos inteiros são quantizadas"""
+    return info.ggml_type in _FLOAT_TYPES and len(info.shape) >= 2 and info.shape[0] % QK == 0
+
+
+def _quantized_pieces(raw: np.ndarray, info, quantizer):
+    bytes_per_element = GGML_BLOCK_SIZES[info.ggml_type][1]
+    for start in range(0, info.n_elements, SLICE_ELEMENTS):
+        count = min(SLICE_ELEMENTS, info.n_elements - start)
+        piece = raw[start * bytes_per_element:(start + count) * bytes_per_element]
+        yield quantizer(dequantize(piece, info.ggml_type, count))
+
+
+def _copied_pieces(raw: np.ndarray):
+    step = SLICE_ELEMENTS * 4
+    for start in range(0, len(raw), step):
+        yield raw[start:start + step]
+
+
+def requantize(source: str, target: str, ggml_type: int, keep: Optional[str] = None,
+               progress: Optional[Callable[[int, int], None]] = None) -> Dict:
+    """Converte source para target; progress(tensores_feitos, total) a cada tensor"""
+    quantizer = QUANTIZERS[ggml_type]
+    keep_pattern = re.compile(keep) if keep else None
+    started = time.perf_counter()
+    stats = {'quantized': 0, 'copied': 0, 'kept': []}
+
+    with GGUFReader(source) as reader:
+        writer = GGUFWriter(target + '.tmp', reader.alignment)
+        for key, value in reader.fields.items():
+            writer.add_field(key, value, *reader.field_types[key])
+        writer.add_field('general.file_type', FILE_TYPES[ggml_type],
+                         *reader.field_types.get('general.file_type', (GGUF_TYPE_UINT32, None)))
+        writer.add_field('general.quantization_version', QUANTIZATION_VERSION, GGUF_TYPE_UINT32)
+
+        plan = []
+        for info in reader.tensors.values():
+            quantize = quantizable(info)
+            # O padrão vale para o nome inteiro (output.weight não pega attn_output.weight)
+            if quantize and keep_pattern is not None and keep_pattern.fullmatch(info.name):
+                quantize = False
+                stats['kept'].append(info.name)
+            writer.add_tensor(info.name, info.shape, ggml_type if quantize else info.ggml_type)
+            plan.append((info, quantize))
+
+        try:
+            with writer:
+                for index, (info, quantize) in enumerate(plan):
+                    raw = reader.tensor_bytes(info.name)
+                    pieces = (_quantized_pieces(raw, info, quantizer) if quantize
+                              else _copied_pieces(raw))
+                    writer.write_tensor(info.name, pieces)
+                    del raw
+                    # Páginas da entrada já usadas não ficam residentes
+                    reader.release(info.name)
+                    stats['quantized' if quantize else 'copied'] += 1
+                    if progress is not None:
+                        progress(index + 1, len(plan))
+        except BaseException:
+            if os.path.exists(writer.path):
+                os.remove(writer.path)
+            raise
+    os.replace(writer.path, target)
+
+    elapsed = time.perf_counter() - started
+    stats.update(seconds=round(elapsed, 3), input_mb=round(os.path.getsize(source) / 2**20, 1),
+                 output_mb=round(os.path.getsize(target) / 2**20, 1))
+    stats['mb_per_s'] = round(stats['input_mb'] / elapsed, 1) if elapsed else None
+    logger.info("%s -> %s (%s): %d tensores quantizados, %d copiados, %.1fs",
+                source, target, GGML_TYPE_NAMES[ggml_type], stats['quantized'],
+                stats['copied'], elapsed)
+    return stats
+
+
+def main():
+    import logger as terlinet_logging
+
+    parser = argparse.ArgumentParser(description="Re-quantiza um GGUF F16/F32 para Q8_0 ou Q4_0")
+    parser.add_argument('source', help="GGUF de entrada (F16/F32)")
+    parser.add_argument('target', help="GGUF de saída")
+    parser.add_argument('--type', default='Q4_0', choices=sorted(TARGET_TYPES))
+    parser.add_argument('--keep', help="regex (nome inteiro) de tensores mantidos no tipo original")
+    args = parser.parse_args()
+
+    terlinet_logging.setup_logging()
+
+    def progress(done, total):
+        print(f"\r{done}/{total} tensores", end='', flush=True)
+
+    stats = requantize(args.source, args.target, TARGET_TYPES[args.type], args.keep, progress)
+    print()
+    for name in stats['kept']:
+        print(f"mantido: {name}")
+    print(f"{stats['quantized']} quantizados, {stats['copied']} copiados: "
+          f"{stats['input_mb']} MB -> {stats['output_mb']} MB em {stats['seconds']}s "
+          f"({stats['mb_per_s']} MB/s)")
+
+
+if __name__ == '__main__':
+    main()
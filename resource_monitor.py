@@ -0,0 +1,250 @@
+"""
+Monitor de recursos do TerlineT
+Amostra RSS, memória disponível, carga de CPU e (no Linux/Android) temperatura
+e frequência da CPU num timer de baixa frequência, alimentando uma política
+de degradação que o GGUFModelWrapper consulta antes de gerar
+"""
+
+import glob
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger('TerlineT.resources')
+
+ResourceSample = namedtuple(
+    'ResourceSample',
+    'timestamp rss_mb available_mb total_mb cpu_load temperature_c cpu_freq_ratio')
+
+# Níveis de degradação, do normal ao modo de padrões
+LEVEL_NORMAL = 0
+LEVEL_REDUCED = 1
+LEVEL_MINIMAL = 2
+LEVEL_PATTERN_ONLY = 3
+
+LEVEL_NAMES = {
+    LEVEL_NORMAL: 'normal',
+    LEVEL_REDUCED: 'reduzido',
+    LEVEL_MINIMAL: 'mínimo',
+    LEVEL_PATTERN_ONLY: 'somente padrões'
+}
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def _read_kb_fields(path, names):
+    """Lê campos em kB de arquivos como /proc/meminfo"""
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in names:
+                    values[key] = int(rest.split()[0])
+    except (OSError, ValueError, IndexError):
+        pass
+    return values
+
+
+class ResourceMonitor:
+    """Amostragem periódica de recursos numa thread em segundo plano"""
+
+    def __init__(self, interval: float = 5.0, policy=None):
+        self.interval = interval
+        self.policy = policy
+        self.latest = None
+        self._previous_cpu = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Sensores descobertos uma única vez
+        self._thermal_paths = glob.glob('/sys/class/thermal/thermal_zone*/temp')
+        self._freq_paths = [
+            (path, path.replace('scaling_cur_freq', 'cpuinfo_max_freq'))
+            for path in glob.glob('/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq')
+        ]
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='ResourceMonitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                sample = self.sample()
+                if self.policy is not None:
+                    self.policy.update(sample)
+            except Exception as e:
+                logger.warning("Falha ao amostrar recursos: %s", e)
+            self._stop.wait(self.interval)
+
+    def sample(self) -> ResourceSample:
+        meminfo = _read_kb_fields('/proc/meminfo', ('MemTotal', 'MemAvailable'))
+        self.latest = ResourceSample(
+            timestamp=time.monotonic(),
+            rss_mb=self._rss_mb(),
+            available_mb=meminfo.get('MemAvailable', 0) / 1024 or None,
+            total_mb=meminfo.get('MemTotal', 0) / 1024 or None,
+            cpu_load=self._cpu_load(),
+            temperature_c=self._temperature(),
+            cpu_freq_ratio=self._freq_ratio())
+        return self.latest
+
+    def _rss_mb(self):
+        status = _read_kb_fields('/proc/self/status', ('VmRSS',))
+        if 'VmRSS' in status:
+            return status['VmRSS'] / 1024
+        try:
+            import resource
+            # ru_maxrss é o pico (kB no Linux, bytes no macOS)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except (ImportError, OSError):
+            return None
+
+    def _cpu_load(self):
+        """Fração de CPU ocupada desde a amostra anterior (0..1)"""
+        line = _read_first_line('/proc/stat')
+        if line and line.startswith('cpu '):
+            values = [int(value) for value in line.split()[1:]]
+            idle = values[3] + (values[4] if len(values) > 4 else 0)
+            total = sum(values)
+            previous, self._previous_cpu = self._previous_cpu, (idle, total)
+            if previous and total > previous[1]:
+                return 1.0 - (idle - previous[0]) / (total - previous[1])
+            return None
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            return None
+
+    def _temperature(self):
+        temperatures = []
+        for path in self._thermal_paths:
+            value = _read_first_line(path)
+            if value and value.lstrip('-').isdigit():
+                # A maioria dos kernels reporta em miligraus
+                temperature = int(value)
+                temperatures.append(temperature / 1000 if abs(temperature) > 1000 else temperature)
+        return max(temperatures) if temperatures else None
+
+    def _freq_ratio(self):
+        """Frequência atual / máxima; valores baixos sob carga indicam throttling"""
+        ratios = []
+        for current_path, max_path in self._freq_paths:
+            current, maximum = _read_first_line(current_path), _read_first_line(max_path)
+            if current and maximum and current.isdigit() and maximum.isdigit() and int(maximum):
+                ratios.append(int(current) / int(maximum))
+        return max(ratios) if ratios else None
+
+
+class DegradationPolicy:
+    """Decide o nível de qualidade a partir das amostras de recursos
+
+    Sobe de nível na primeira amostra sob pressão e só desce depois de
+    `recovery_samples` amostras tranquilas seguidas (histerese).
+    """
+
+    def __init__(self, model_size_mb: float = 0.0, low_memory_mb: float = 1024,
+                 critical_memory_mb: float = 400, hot_temperature_c: float = 45.0,
+                 critical_temperature_c: float = 55.0, throttle_ratio: float = 0.5,
+                 recovery_samples: int = 3):
+        self.model_size_mb = model_size_mb
+        self.low_memory_mb = low_memory_mb
+        self.critical_memory_mb = critical_memory_mb
+        self.hot_temperature_c = hot_temperature_c
+        self.critical_temperature_c = critical_temperature_c
+        self.throttle_ratio = throttle_ratio
+        self.recovery_samples = recovery_samples
+
+        self.level = LEVEL_NORMAL
+        self.last_sample = None
+        self._calm_samples = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        """callback(nível, amostra) chamado a cada mudança de nível"""
+        self._listeners.append(callback)
+
+    def assess(self, sample: ResourceSample) -> int:
+        """Nível sugerido por uma única amostra"""
+        level = LEVEL_NORMAL
+        available = sample.available_mb
+
+        if available is not None:
+            if available < self.critical_memory_mb:
+                level = LEVEL_PATTERN_ONLY
+            elif available < self.low_memory_mb:
+                level = LEVEL_MINIMAL
+            elif self.model_size_mb and available < self.model_size_mb * 0.5:
+                level = LEVEL_REDUCED
+
+        temperature = sample.temperature_c
+        if temperature is not None:
+            if temperature >= self.critical_temperature_c:
+                level = max(level, LEVEL_MINIMAL)
+            elif temperature >= self.hot_temperature_c:
+                level = max(level, LEVEL_REDUCED)
+
+        throttled = (sample.cpu_freq_ratio is not None and sample.cpu_load is not None
+                     and sample.cpu_load > 0.8 and sample.cpu_freq_ratio < self.throttle_ratio)
+        if throttled:
+            level = max(level, LEVEL_REDUCED)
+        return level
+
+    def update(self, sample: ResourceSample):
+        with self._lock:
+            self.last_sample = sample
+            suggested = self.assess(sample)
+            previous = self.level
+            if suggested > self.level:
+                self.level = suggested
+                self._calm_samples = 0
+            elif suggested < self.level:
+                self._calm_samples += 1
+                if self._calm_samples >= self.recovery_samples:
+                    self.level -= 1
+                    self._calm_samples = 0
+            else:
+                self._calm_samples = 0
+            changed = self.level != previous
+
+        if changed:
+            logger.warning("Nível de recursos: %s (disponível=%s MB, temp=%s °C)",
+                           LEVEL_NAMES[self.level], sample.available_mb, sample.temperature_c)
+            for callback in self._listeners:
+                callback(self.level, sample)
+
+    # --- Parâmetros consultados pelo modelo ---
+
+    def max_tokens(self, base: int) -> int:
+        return max(16, base >> self.level) if self.level < LEVEL_PATTERN_ONLY else 0
+
+    def kv_window(self, base: int) -> int:
+        return max(256, base >> self.level)
+
+    def kv_cache_dtype(self, base: str) -> str:
+        # int8 ocupa metade do f16, mas erra mais nos logits
+        return 'int8' if self.level >= LEVEL_REDUCED else base
+
+    @property
+    def prefer_smaller_model(self) -> bool:
+        return self.level >= LEVEL_MINIMAL
+
+    @property
+    def pattern_only(self) -> bool:
+        return self.level >= LEVEL_PATTERN_ONLY
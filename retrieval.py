@@ -0,0 +1,378 @@
+"""
+Índice de recuperação local do TerlineT
+Divide conversas antigas e notas do usuário em trechos, indexa com BM25
+(índice invertido) e, opcionalmente, com embeddings guardados num arquivo
+mapeado em memória. A busca é vetorizada com NumPy e os melhores trechos
+entram no prompt da geração.
+"""
+
+import json
+import logging
+import re
+import threading
+import unicodedata
+from array import array
+from collections import namedtuple
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger('TerlineT.retrieval')
+
+SearchResult = namedtuple('SearchResult', 'score text source')
+
+CONVERSATION_SOURCE = 'conversa'
+# Só as falas do usuário entram no índice, com o autor no trecho: respostas do
+# modelo (e as prontas do roteador) voltariam ao prompt como se fossem fatos
+USER_TURN_PREFIX = "Usuário disse:"
+NOTE_PATTERNS = ('*.txt', '*.md')
+
+# Palavras muito comuns não ajudam a ranquear
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de do da dos das em no na nos nas por para pra com
+sem e ou que se é ser foi são me te lhe eu tu ele ela nos vos eles elas você
+voces meu minha seu sua isso isto aquilo esse essa este esta mais muito já não
+""".split())
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def normalize_terms(text: str) -> List[str]:
+    """Minúsculas, sem acentos e sem stopwords"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [word for word in _WORD_RE.findall(text) if word not in STOPWORDS]
+
+
+def conversation_source(session_id: str, turn_index: int) -> str:
+    """Origem de um turno indexado: 'conversa:<sessão>:<turno>'"""
+    return f'{CONVERSATION_SOURCE}:{session_id}:{turn_index}'
+
+
+def parse_conversation_source(source: str) -> Optional[Tuple[str, int]]:
+    """(sessão, turno) de uma origem de conversa; None para notas
+
+    Origens antigas, sem sessão ('conversa:<turno>'), voltam com sessão vazia.
+    """
+    kind, _, rest = source.partition(':')
+    session_id, _, turn_index = rest.rpartition(':')
+    if kind != CONVERSATION_SOURCE or not turn_index.isdigit():
+        return None
+    return session_id, int(turn_index)
+
+
+def chunk_text(text: str, max_words: int = 80, overlap: int = 20) -> List[str]:
+    """Divide o texto em janelas de palavras com sobreposição"""
+    words = text.split()
+    if len(words) <= max_words:
+        return [" ".join(words)] if words else []
+    step = max_words - overlap
+    return [" ".join(words[start:start + max_words])
+            for start in range(0, len(words) - overlap, step)]
+
+
+class EmbeddingStore:
+    """Matriz de embeddings float32 normalizados num arquivo mapeado em memória"""
+
+    def __init__(self, path: Optional[Path], dim: int, capacity: int = 1024):
+        self.path = path
+        self.dim = dim
+        self.count = 0
+        self._matrix = None
+        if path is not None and path.exists():
+            rows = path.stat().st_size // (4 * dim)
+            self._open(max(rows, capacity))
+        else:
+            self._open(capacity)
+
+    def _open(self, capacity: int):
+        if self.path is None:
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            if self._matrix is not None:
+                grown[:self.count] = self._matrix[:self.count]
+            self._matrix = grown
+            return
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        # Aumentar o arquivo preserva o conteúdo já gravado
+        with open(self.path, 'ab') as f:
+            f.truncate(max(f.tell(), capacity * self.dim * 4))
+        self._matrix = np.memmap(self.path, dtype=np.float32, mode='r+',
+                                 shape=(capacity, self.dim))
+
+    @property
+    def capacity(self) -> int:
+        return self._matrix.shape[0]
+
+    def append(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        needed = self.count + len(vectors)
+        if needed > self.capacity:
+            self._open(max(needed, self.capacity * 2))
+        self._matrix[self.count:needed] = vectors
+        self.count = needed
+
+    def similarities(self, query: np.ndarray) -> np.ndarray:
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        return self._matrix[:self.count] @ query
+
+    def flush(self):
+        if isinstance(self._matrix, np.memmap):
+            self._matrix.flush()
+
+
+class RetrievalIndex:
+    """Índice BM25 incremental com embeddings opcionais
+
+    `embed_fn(textos) -> matriz (n, dim)` liga a busca híbrida; sem ela só o
+    BM25 é usado. Os embeddings são calculados em lotes numa thread própria,
+    nunca no caminho de indexação. Com `index_dir` os trechos vão para
+    chunks.jsonl e os embeddings para embeddings.f32, e o índice é
+    reconstruído na abertura.
+    """
+
+    EMBEDDING_BATCH = 32
+
+    def __init__(self, index_dir: Optional[str] = None,
+                 embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 k1: float = 1.2, b: float = 0.75, embedding_weight: float = 0.5):
+        self.index_dir = Path(index_dir) if index_dir else None
+        self.embed_fn = None
+        self.embedder_id = ''
+        self.k1 = k1
+        self.b = b
+        self.embedding_weight = embedding_weight
+
+        self.texts = []
+        self.sources = []
+        # termo -> (ids dos trechos, frequências); array.array cresce sem cópia
+        self.postings = {}
+        self.doc_lengths = array('f')
+        self.total_length = 0.0
+        self.embeddings = None
+
+        self._lock = threading.Lock()
+        self._backfilling = False
+        self._chunks_file = None
+        self._embeddings_meta = {}
+        if self.index_dir is not None:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            self._load()
+            self._chunks_file = open(self.index_dir / 'chunks.jsonl', 'a', encoding='utf-8')
+        if embed_fn is not None:
+            self.set_embedder(embed_fn)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _load(self):
+        path = self.index_dir / 'chunks.jsonl'
+        if not path.exists():
+            return
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self._index_chunk(record['text'], record['source'])
+        meta_path = self.index_dir / 'embeddings.json'
+        if meta_path.exists():
+            meta = self._embeddings_meta = json.loads(meta_path.read_text())
+            self.embeddings = EmbeddingStore(self.index_dir / 'embeddings.f32', meta['dim'])
+            self.embeddings.count = min(meta['count'], len(self.texts))
+        logger.info("Índice de recuperação carregado: %d trechos", len(self.texts))
+
+    # --- Indexação ---
+
+    def _index_chunk(self, text: str, source: str) -> int:
+        doc_id = len(self.texts)
+        self.texts.append(text)
+        self.sources.append(source)
+        terms = normalize_terms(text)
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = (array('i'), array('f'))
+            posting[0].append(doc_id)
+            posting[1].append(frequency)
+        self.doc_lengths.append(len(terms))
+        self.total_length += len(terms)
+        return doc_id
+
+    def add_document(self, text: str, source: str = '', prefix: str = '') -> int:
+        """Indexa um texto em trechos; devolve quantos trechos foram criados"""
+        chunks = [f"{prefix} {chunk}" if prefix else chunk for chunk in chunk_text(text)]
+        if not chunks:
+            return 0
+        with self._lock:
+            for chunk in chunks:
+                self._index_chunk(chunk, source)
+                if self._chunks_file is not None:
+                    self._chunks_file.write(json.dumps({'text': chunk, 'source': source},
+                                                       ensure_ascii=False) + "\n")
+            if self._chunks_file is not None:
+                self._chunks_file.flush()
+        self._schedule_backfill()
+        return len(chunks)
+
+    # --- Embeddings ---
+
+    def set_embedder(self, embed_fn: Callable[[List[str]], np.ndarray], embedder_id: str = ''):
+        """Liga os embeddings e calcula, em segundo plano, os que faltam
+
+        Vetores gravados por outro modelo (`embedder_id` diferente) são descartados.
+        """
+        with self._lock:
+            if self.embeddings is not None and self._embeddings_meta.get('model', '') != embedder_id:
+                logger.info("Embeddings de outro modelo descartados")
+                self.embeddings.count = 0
+            self.embed_fn = embed_fn
+            self.embedder_id = embedder_id
+        self._schedule_backfill()
+
+    def _schedule_backfill(self):
+        with self._lock:
+            if self.embed_fn is None or self._backfilling:
+                return
+            if self.embeddings is not None and self.embeddings.count >= len(self.texts):
+                return
+            self._backfilling = True
+        threading.Thread(target=self._backfill, name='RetrievalEmbeddings', daemon=True).start()
+
+    def _backfill(self):
+        """Calcula os embeddings dos trechos que ainda não têm, em lotes"""
+        try:
+            while True:
+                with self._lock:
+                    start = self.embeddings.count if self.embeddings is not None else 0
+                    batch = self.texts[start:start + self.EMBEDDING_BATCH]
+                    embed_fn = self.embed_fn
+                    if not batch or embed_fn is None:
+                        self._backfilling = False
+                        return
+                vectors = np.asarray(embed_fn(batch), dtype=np.float32)
+                with self._lock:
+                    self._append_embeddings(vectors, start)
+        except Exception as e:
+            logger.warning("Falha ao calcular embeddings: %s", e)
+            with self._lock:
+                self._backfilling = False
+
+    def _append_embeddings(self, vectors: np.ndarray, first_id: int):
+        if self.embeddings is None or self.embeddings.dim != vectors.shape[-1]:
+            path = self.index_dir / 'embeddings.f32' if self.index_dir else None
+            if path is not None and path.exists():
+                path.unlink()
+            self.embeddings = EmbeddingStore(path, vectors.shape[-1])
+        if self.embeddings.count != first_id:
+            return
+        self.embeddings.append(vectors)
+        self._embeddings_meta = {'dim': self.embeddings.dim, 'count': self.embeddings.count,
+                                 'model': self.embedder_id}
+        if self.index_dir is not None:
+            self.embeddings.flush()
+            (self.index_dir / 'embeddings.json').write_text(json.dumps(self._embeddings_meta))
+
+    def add_message(self, session_id: str, turn_index: int, turn):
+        """Indexa uma fala do usuário (listener do ConversationContext)"""
+        if turn.role != 'user':
+            return
+        self.add_document(turn.text, conversation_source(session_id, turn_index),
+                          prefix=USER_TURN_PREFIX)
+
+    def add_directory(self, path: str, patterns: Iterable[str] = NOTE_PATTERNS) -> int:
+        """Indexa as notas de uma pasta que ainda não estão no índice"""
+        folder = Path(path)
+        if not folder.is_dir():
+            return 0
+        known = set(self.sources)
+        added = 0
+        for pattern in patterns:
+            for file in sorted(folder.rglob(pattern)):
+                source = str(file)
+                if source in known:
+                    continue
+                try:
+                    added += self.add_document(file.read_text(encoding='utf-8', errors='ignore'),
+                                               source)
+                except OSError as e:
+                    logger.warning("Não foi possível indexar %s: %s", file, e)
+        if added:
+            logger.info("Notas indexadas: %d trechos novos de %s", added, folder)
+        return added
+
+    # --- Busca ---
+
+    def bm25_scores(self, query: str) -> np.ndarray:
+        """Pontuação BM25 de todos os trechos (vetor denso)"""
+        n_docs = len(self.texts)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        if not n_docs:
+            return scores
+        lengths = np.frombuffer(self.doc_lengths, dtype=np.float32, count=n_docs)
+        average = self.total_length / n_docs or 1.0
+        for term in set(normalize_terms(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            # Visões sem cópia dos arrays de postings
+            ids = np.frombuffer(posting[0], dtype=np.int32)
+            frequencies = np.frombuffer(posting[1], dtype=np.float32)
+            idf = np.log1p((n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[ids] / average)
+            scores[ids] += idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+        return scores
+
+    def search(self, query: str, k: int = 5, exclude: Optional[Callable[[str], bool]] = None
+               ) -> List[SearchResult]:
+        """Os k trechos mais relevantes (BM25 e, se houver, similaridade de cosseno)"""
+        query_vector = None
+        if self.embeddings is not None and self.embeddings.count and self.embed_fn is not None:
+            query_vector = self.embed_fn([query])[0]
+
+        with self._lock:
+            scores = self.bm25_scores(query)
+            if not len(scores):
+                return []
+            top = float(scores.max())
+            if top > 0:
+                scores /= top
+            if query_vector is not None and self.embeddings.dim == len(query_vector):
+                similarities = self.embeddings.similarities(query_vector)
+                count = len(similarities)
+                scores[:count] = ((1 - self.embedding_weight) * scores[:count]
+                                  + self.embedding_weight * np.maximum(similarities, 0))
+
+            # Pede alguns a mais para compensar os excluídos
+            wanted = min(len(scores), k * 2 + 8)
+            candidates = np.argpartition(-scores, wanted - 1)[:wanted]
+            candidates = candidates[np.argsort(-scores[candidates])]
+            results = []
+            for doc_id in candidates:
+                score = float(scores[doc_id])
+                if score <= 0:
+                    break
+                source = self.sources[doc_id]
+                if exclude is not None and exclude(source):
+                    continue
+                results.append(SearchResult(score, self.texts[doc_id], source))
+                if len(results) == k:
+                    break
+            return results
+
+    def close(self):
+        with self._lock:
+            if self._chunks_file is not None:
+                self._chunks_file.close()
+                self._chunks_file = None
+            if self.embeddings is not None:
+                self.embeddings.flush()
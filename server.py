@@ -0,0 +1,607 @@
+"""
+Servidor local de inferência do TerlineT
+Expõe o modelo já carregado (GGUFModelWrapper) em localhost para ferramentas
+de desktop e testes: completions e chat no estilo OpenAI (com streaming SSE),
+WebSocket, fila de requisições, conexões keep-alive e métricas.
+
+Uso sem interface:
+    python server.py --model modelo/modelo.gguf --port 8765
+
+Dentro do app, defina TERLINET_SERVER_PORT para compartilhar o modelo
+carregado pela interface, sem uma segunda cópia em memória.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import queue
+import struct
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from profiler import Histogram
+
+logger = logging.getLogger('TerlineT.server')
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+KEEP_ALIVE_SECONDS = 30
+MAX_BODY_BYTES = 1024 * 1024
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+_STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 429: 'Too Many Requests',
+                503: 'Service Unavailable'}
+_DONE = object()
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class GenerationJob:
+    """Uma geração na fila; os pedaços chegam ao loop asyncio por `output`"""
+
+    def __init__(self, factory: Callable, loop: asyncio.AbstractEventLoop):
+        self.factory = factory
+        self.loop = loop
+        self.output = asyncio.Queue()
+        self.cancelled = False
+        self.submitted = time.perf_counter_ns()
+        self.started = None
+        self.first_piece = None
+        self.pieces = 0
+
+    def push(self, item):
+        self.loop.call_soon_threadsafe(self.output.put_nowait, item)
+
+
+class ServerMetrics:
+    """Contadores e histogramas de latência do servidor"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self.completed = 0
+        self.pieces = 0
+        self.connections = 0
+        self.queue_wait = Histogram()
+        self.first_piece = Histogram()
+        self.total = Histogram()
+        self._lock = threading.Lock()
+
+    def finish(self, job: GenerationJob):
+        now = time.perf_counter_ns()
+        with self._lock:
+            self.completed += 1
+            self.pieces += job.pieces
+            if job.started is not None:
+                self.queue_wait.add(job.started - job.submitted)
+            if job.first_piece is not None:
+                self.first_piece.add(job.first_piece - job.submitted)
+            self.total.add(now - job.submitted)
+
+    def snapshot(self, scheduler: 'GenerationScheduler') -> Dict:
+        uptime = time.time() - self.started
+        with self._lock:
+            return {
+                'uptime_s': round(uptime, 1),
+                'requests': self.requests,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'errors': self.errors,
+                'connections': self.connections,
+                'queued': scheduler.pending.qsize(),
+                'active': scheduler.active_count,
+                'pieces': self.pieces,
+                'pieces_per_second': round(self.pieces / uptime, 2) if uptime else 0.0,
+                'queue_wait': self.queue_wait.summary(),
+                'time_to_first_piece': self.first_piece.summary(),
+                'latency': self.total.summary(),
+            }
+
+
+class GenerationScheduler:
+    """Fila única sobre o modelo compartilhado
+
+    Uma thread avança as gerações ativas em rodízio, um pedaço de cada vez,
+    até o limite `max_concurrent` do backend; as demais esperam na fila.
+    """
+
+    def __init__(self, model, max_queue: int = 32, metrics: Optional[ServerMetrics] = None):
+        self.model = model
+        self.pending = queue.Queue(maxsize=max_queue)
+        self.metrics = metrics or ServerMetrics()
+        self.active_count = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='GenerationScheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, job: GenerationJob) -> bool:
+        try:
+            self.pending.put_nowait(job)
+            return True
+        except queue.Full:
+            return False
+
+    def stop(self):
+        self._stop.set()
+        self.pending.put(None)
+
+    def _concurrency(self) -> int:
+        backend = getattr(self.model, 'backend', None)
+        return max(1, getattr(backend, 'max_concurrent', 1))
+
+    def _admit(self, active: list):
+        while len(active) < self._concurrency():
+            try:
+                # Sem gerações ativas, bloqueia esperando a próxima
+                job = self.pending.get(timeout=0.5) if not active else self.pending.get_nowait()
+            except queue.Empty:
+                return
+            if job is None:
+                return
+            if job.cancelled:
+                continue
+            job.started = time.perf_counter_ns()
+            try:
+                active.append((job, iter(job.factory())))
+            except Exception as e:
+                self._fail(job, e)
+
+    def _run(self):
+        active = []
+        while not self._stop.is_set():
+            self._admit(active)
+            self.active_count = len(active)
+            for entry in list(active):
+                job, pieces = entry
+                if job.cancelled:
+                    self._close(active, entry)
+                    continue
+                try:
+                    piece = next(pieces)
+                except StopIteration:
+                    job.push(_DONE)
+                    self.metrics.finish(job)
+                    active.remove(entry)
+                    continue
+                except Exception as e:
+                    self._fail(job, e)
+                    active.remove(entry)
+                    continue
+                if not piece:
+                    # Pedaço do prefill: só devolve a vez às outras gerações
+                    continue
+                if job.first_piece is None:
+                    job.first_piece = time.perf_counter_ns()
+                job.pieces += 1
+                job.push(piece)
+
+    def _close(self, active: list, entry):
+        active.remove(entry)
+        close = getattr(entry[1], 'close', None)
+        if close is not None:
+            close()
+
+    def _fail(self, job: GenerationJob, error: Exception):
+        logger.error("Erro na geração do servidor: %s", error)
+        self.metrics.errors += 1
+        job.push(error)
+
+
+class InferenceServer:
+    """Servidor HTTP/1.1 + WebSocket em asyncio, só com a biblioteca padrão"""
+
+    def __init__(self, model, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 max_queue: int = 32, model_name: Optional[str] = None):
+        self.model = model
+        self.host = host
+        self.port = port
+        self.model_name = model_name or 'terlinet'
+        self.metrics = ServerMetrics()
+        self.scheduler = GenerationScheduler(model, max_queue, self.metrics)
+        self._server = None
+        self._loop = None
+
+        self.routes = {
+            ('GET', '/health'): self.handle_health,
+            ('GET', '/metrics'): self.handle_metrics,
+            ('GET', '/v1/models'): self.handle_models,
+            ('POST', '/v1/completions'): self.handle_completion,
+            ('POST', '/v1/chat/completions'): self.handle_chat,
+        }
+
+    # --- Ciclo de vida ---
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Servidor de inferência em http://%s:%d", self.host, self.port)
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self) -> threading.Thread:
+        """Roda o servidor num loop próprio (uso dentro do app Kivy)"""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+
+        thread = threading.Thread(target=run, name='InferenceServer', daemon=True)
+        thread.start()
+        ready.wait(5)
+        return thread
+
+    def stop(self):
+        self.scheduler.stop()
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # --- HTTP ---
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.metrics.connections += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEP_ALIVE_SECONDS)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+                if headers.get('upgrade', '').lower() == 'websocket' and path == '/v1/ws':
+                    await self.handle_websocket(reader, writer, headers)
+                    break
+                try:
+                    await self._dispatch(method, path, body, writer, keep_alive)
+                except HTTPError as e:
+                    await self._send_json(writer, {'error': {'message': str(e)}}, e.status,
+                                          keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.metrics.connections -= 1
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise ConnectionError("Linha de requisição inválida")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0) or 0)
+        if length > MAX_BODY_BYTES:
+            raise ConnectionError("Corpo grande demais")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target.split('?', 1)[0], headers, body
+
+    async def _dispatch(self, method, path, body, writer, keep_alive):
+        handler = self.routes.get((method, path))
+        if handler is None:
+            known = any(route_path == path for _, route_path in self.routes)
+            raise HTTPError(405 if known else 404, f"{method} {path} não disponível")
+        payload = {}
+        if body:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                raise HTTPError(400, "JSON inválido")
+        await handler(payload, writer, keep_alive)
+
+    def _headers(self, status: int, content_type: str, keep_alive: bool, extra: str = '') -> bytes:
+        return (f"HTTP/1.1 {status} {_STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                f"{extra}\r\n").encode('latin-1')
+
+    async def _send_json(self, writer, data, status: int = 200, keep_alive: bool = True):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        writer.write(self._headers(status, 'application/json; charset=utf-8', keep_alive,
+                                   f"Content-Length: {len(body)}\r\n") + body)
+        await writer.drain()
+
+    async def _send_chunk(self, writer, data: bytes):
+        writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+        await writer.drain()
+
+    # --- Geração ---
+
+    def _submit(self, factory: Callable) -> GenerationJob:
+        self.metrics.requests += 1
+        if not getattr(self.model, 'model_loaded', False):
+            raise HTTPError(503, "Modelo ainda carregando")
+        job = GenerationJob(factory, asyncio.get_running_loop())
+        if not self.scheduler.submit(job):
+            self.metrics.rejected += 1
+            raise HTTPError(429, "Fila de geração cheia")
+        return job
+
+    async def _pieces(self, job: GenerationJob):
+        try:
+            while True:
+                item = await job.output.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            job.cancelled = True
+
+    def _usage(self, prompt: str, text: str) -> Dict:
+        prompt_tokens = self.model.count_tokens(prompt) if prompt else 0
+        completion_tokens = self.model.count_tokens(text) if text else 0
+        return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens}
+
+    def _adapter(self, payload: Dict) -> Optional[str]:
+        """Adaptador LoRA do campo 'adapter' ou do id do modelo ('<modelo>:<adaptador>')"""
+        name = payload.get('adapter')
+        model = payload.get('model')
+        if name is None and isinstance(model, str) and model.startswith(f'{self.model_name}:'):
+            name = model.split(':', 1)[1]
+        if name is not None and name not in getattr(self.model, 'adapters', {}):
+            raise HTTPError(400, f"Adaptador desconhecido: {name}")
+        return name
+
+    def _finish_reason(self, text: str, max_tokens: Optional[int]) -> str:
+        if max_tokens and self.model.count_tokens(text) >= max_tokens:
+            return 'length'
+        return 'stop'
+
+    async def _stream_sse(self, writer, job, make_chunk, keep_alive, final_chunk):
+        writer.write(self._headers(200, 'text/event-stream; charset=utf-8', keep_alive,
+                                   "Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n"))
+        parts = []
+        try:
+            async for piece in self._pieces(job):
+                parts.append(piece)
+                event = json.dumps(make_chunk(piece), ensure_ascii=False)
+                await self._send_chunk(writer, f"data: {event}\n\n".encode('utf-8'))
+        except Exception as e:
+            event = json.dumps({'error': {'message': str(e)}}, ensure_ascii=False)
+            await self._send_chunk(writer, f"data: {event}\n\n".encode('utf-8'))
+        event = json.dumps(final_chunk("".join(parts)), ensure_ascii=False)
+        await self._send_chunk(writer, f"data: {event}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        await self._send_chunk(writer, b'')
+
+    async def _collect(self, job) -> str:
+        try:
+            return "".join([piece async for piece in self._pieces(job)])
+        except HTTPError:
+            raise
+        except Exception as e:
+            raise HTTPError(503, f"Erro na geração: {e}")
+
+    async def handle_completion(self, payload: Dict, writer, keep_alive: bool):
+        prompt = payload.get('prompt', '')
+        if isinstance(prompt, list):
+            prompt = prompt[0] if prompt else ''
+        if not isinstance(prompt, str):
+            raise HTTPError(400, "'prompt' deve ser texto")
+        max_tokens = payload.get('max_tokens')
+        stop = payload.get('stop') or ()
+        stop = [stop] if isinstance(stop, str) else list(stop)
+        adapter = self._adapter(payload)
+        job = self._submit(lambda: self.model.complete_stream(prompt, max_tokens, stop, prompt,
+                                                              adapter=adapter))
+
+        completion_id = f"cmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        def response(text, finish_reason):
+            return {'id': completion_id, 'object': 'text_completion', 'created': created,
+                    'model': self.model_name,
+                    'choices': [{'index': 0, 'text': text, 'finish_reason': finish_reason}]}
+
+        if payload.get('stream'):
+            def final(text):
+                data = response('', self._finish_reason(text, max_tokens))
+                data['usage'] = self._usage(prompt, text)
+                return data
+            await self._stream_sse(writer, job, lambda piece: response(piece, None),
+                                   keep_alive, final)
+            return
+        text = await self._collect(job)
+        data = response(text, self._finish_reason(text, max_tokens))
+        data['usage'] = self._usage(prompt, text)
+        await self._send_json(writer, data, keep_alive=keep_alive)
+
+    async def handle_chat(self, payload: Dict, writer, keep_alive: bool):
+        messages = payload.get('messages')
+        if not isinstance(messages, list) or not messages:
+            raise HTTPError(400, "'messages' deve ser uma lista não vazia")
+        max_tokens = payload.get('max_tokens')
+        adapter = self._adapter(payload)
+        job = self._submit(lambda: self.model.chat_stream(messages, max_tokens, adapter))
+        prompt = "\n".join(str(message.get('content', '')) for message in messages)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        if payload.get('stream'):
+            first = [True]
+
+            def chunk(piece):
+                delta = {'content': piece}
+                if first[0]:
+                    delta['role'] = 'assistant'
+                    first[0] = False
+                return {'id': completion_id, 'object': 'chat.completion.chunk',
+                        'created': created, 'model': self.model_name,
+                        'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]}
+
+            def final(text):
+                return {'id': completion_id, 'object': 'chat.completion.chunk',
+                        'created': created, 'model': self.model_name,
+                        'choices': [{'index': 0, 'delta': {},
+                                     'finish_reason': self._finish_reason(text, max_tokens)}],
+                        'usage': self._usage(prompt, text)}
+            await self._stream_sse(writer, job, chunk, keep_alive, final)
+            return
+
+        text = await self._collect(job)
+        await self._send_json(writer, {
+            'id': completion_id, 'object': 'chat.completion', 'created': created,
+            'model': self.model_name,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text},
+                         'finish_reason': self._finish_reason(text, max_tokens)}],
+            'usage': self._usage(prompt, text)
+        }, keep_alive=keep_alive)
+
+    async def handle_health(self, payload, writer, keep_alive):
+        summary = self.model.backend_summary() if hasattr(self.model, 'backend_summary') else ''
+        await self._send_json(writer, {'status': 'ok' if self.model.model_loaded else 'loading',
+                                       'backend': summary}, keep_alive=keep_alive)
+
+    async def handle_metrics(self, payload, writer, keep_alive):
+        data = self.metrics.snapshot(self.scheduler)
+        data['backend'] = getattr(self.model, 'backend_report', {})
+        await self._send_json(writer, data, keep_alive=keep_alive)
+
+    async def handle_models(self, payload, writer, keep_alive):
+        # Cada adaptador LoRA aparece como '<modelo>:<adaptador>'
+        names = [self.model_name] + [f'{self.model_name}:{adapter}'
+                                     for adapter in getattr(self.model, 'adapters', {})]
+        await self._send_json(writer, {'object': 'list', 'data': [
+            {'id': name, 'object': 'model', 'owned_by': 'terlinet'} for name in names]},
+            keep_alive=keep_alive)
+
+    # --- WebSocket ---
+
+    async def handle_websocket(self, reader, writer, headers: Dict):
+        """Cada mensagem de texto é um pedido de chat; a resposta volta em deltas"""
+        key = headers.get('sec-websocket-key', '')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        await writer.drain()
+
+        while True:
+            try:
+                opcode, data = await asyncio.wait_for(self._read_frame(reader), KEEP_ALIVE_SECONDS * 10)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                return
+            if opcode == 0x8:
+                await self._send_frame(writer, 0x8, data[:2])
+                return
+            if opcode == 0x9:
+                await self._send_frame(writer, 0xA, data)
+                continue
+            if opcode != 0x1:
+                continue
+            try:
+                payload = json.loads(data.decode('utf-8'))
+                messages = payload.get('messages') or [
+                    {'role': 'user', 'content': str(payload.get('content', ''))}]
+                adapter = self._adapter(payload)
+                job = self._submit(lambda: self.model.chat_stream(messages, payload.get('max_tokens'),
+                                                                  adapter))
+                parts = []
+                async for piece in self._pieces(job):
+                    parts.append(piece)
+                    await self._send_frame(writer, 0x1, json.dumps({'delta': piece}, ensure_ascii=False))
+                await self._send_frame(writer, 0x1, json.dumps({'done': True, 'content': "".join(parts)},
+                                                               ensure_ascii=False))
+            except (ValueError, HTTPError) as e:
+                await self._send_frame(writer, 0x1, json.dumps({'error': str(e)}, ensure_ascii=False))
+
+    async def _read_frame(self, reader):
+        header = await reader.readexactly(2)
+        opcode = header[0] & 0x0F
+        masked = header[1] & 0x80
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('>H', await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('>Q', await reader.readexactly(8))[0]
+        if length > MAX_BODY_BYTES:
+            raise ConnectionError("Frame grande demais")
+        mask = await reader.readexactly(4) if masked else None
+        data = await reader.readexactly(length)
+        if mask:
+            data = bytes(byte ^ mask[index % 4] for index, byte in enumerate(data))
+        return opcode, data
+
+    async def _send_frame(self, writer, opcode: int, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        length = len(data)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        writer.write(header + data)
+        await writer.drain()
+
+
+def main():
+    from pathlib import Path
+
+    import logger as terlinet_logging
+    from gguf_loader import GGUFModelWrapper
+
+    parser = argparse.ArgumentParser(description="Servidor local de inferência do TerlineT")
+    parser.add_argument('--model', required=True, help="arquivo .gguf")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-queue', type=int, default=32)
+    args = parser.parse_args()
+
+    terlinet_logging.setup_logging()
+    if args.host not in ('127.0.0.1', 'localhost', '::1'):
+        logger.warning("Servidor exposto fora do localhost (%s)", args.host)
+
+    model = GGUFModelWrapper()
+    loaded = threading.Event()
+    model.load_model(args.model, lambda success, error=None: loaded.set())
+    loaded.wait()
+    logger.info("Backend: %s", model.backend_summary())
+
+    server = InferenceServer(model, args.host, args.port, args.max_queue,
+                             model_name=Path(args.model).stem)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.scheduler.stop()
+
+
+if __name__ == '__main__':
+    main()
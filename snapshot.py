@@ -0,0 +1,82 @@
+"""
+Snapshots de retomada do TerlineT
+Guarda a conversa, o modelo, o estado do sampler e, se houver, o KV cache num
+arquivo binário versionado. O Android costuma encerrar apps pausados; na
+próxima abertura o snapshot volta sem recarregar o contexto. Os arrays ficam
+alinhados no arquivo e voltam como memmap copy-on-write, então só as páginas
+usadas saem do disco.
+
+Formato: MAGIC (8 bytes), versão e tamanho do cabeçalho (u32 cada), cabeçalho
+JSON e os arrays, cada um alinhado em ALIGNMENT bytes.
+"""
+
+import json
+import logging
+import os
+import struct
+from typing import Dict, Tuple
+
+import numpy as np
+
+logger = logging.getLogger('TerlineT.snapshot')
+
+MAGIC = b'TLTSNAP\x00'
+SNAPSHOT_VERSION = 1
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct('<II')
+
+
+class SnapshotError(ValueError):
+    """Arquivo que não é um snapshot desta versão"""
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(path: str, metadata: Dict, arrays: Dict[str, np.ndarray]):
+    """Grava o snapshot de forma atômica (arquivo temporário + rename)"""
+    layout, offset = {}, 0
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    for name, array in arrays.items():
+        offset = _align(offset)
+        layout[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset += array.nbytes
+    header = json.dumps({'metadata': metadata, 'arrays': layout},
+                        ensure_ascii=False).encode('utf-8')
+    data_start = _align(len(MAGIC) + _PREFIX.size + len(header))
+
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_PREFIX.pack(SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(memoryview(array).cast('B'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def read_snapshot(path: str) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """(metadados, arrays como memmap copy-on-write)"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SnapshotError(f"{path} não é um snapshot do TerlineT")
+        version, header_size = _PREFIX.unpack(f.read(_PREFIX.size))
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Snapshot versão {version} (esperada {SNAPSHOT_VERSION})")
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    data_start = _align(len(MAGIC) + _PREFIX.size + header_size)
+
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        dtype, shape = np.dtype(entry['dtype']), tuple(entry['shape'])
+        if not all(shape):
+            arrays[name] = np.zeros(shape, dtype=dtype)
+            continue
+        arrays[name] = np.memmap(path, dtype=dtype, mode='c', shape=shape,
+                                 offset=data_start + entry['offset'])
+    return header['metadata'], arrays
@@ -0,0 +1,128 @@
+"""
+Backends de reconhecimento de fala (STT) offline para o TerlineT
+Recebem o áudio em pedaços enquanto o usuário ainda fala e mantêm uma
+hipótese parcial, de modo que a transcrição já esteja quase pronta quando
+o VAD detecta o fim da fala
+"""
+
+import json
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+class STTBackend:
+    """Interface para reconhecimento de fala incremental"""
+
+    name = "base"
+    sample_rate = 16000
+
+    def start(self):
+        """Inicia uma nova frase"""
+        raise NotImplementedError
+
+    def accept_chunk(self, pcm: np.ndarray) -> str:
+        """Recebe amostras PCM int16 e retorna a hipótese parcial atual"""
+        raise NotImplementedError
+
+    def finish(self) -> str:
+        """Finaliza a frase e retorna a transcrição final"""
+        raise NotImplementedError
+
+
+class SimulatedSTTBackend(STTBackend):
+    """Backend simulado (comportamento original do app)"""
+
+    name = "simulado"
+
+    def __init__(self, text: str = "comando de voz simulado"):
+        self.text = text
+        self.samples = 0
+
+    def start(self):
+        self.samples = 0
+
+    def accept_chunk(self, pcm: np.ndarray) -> str:
+        self.samples += len(pcm)
+        return ""
+
+    def finish(self) -> str:
+        return self.text if self.samples else ""
+
+
+class FileTranscriptBackend(STTBackend):
+    """Backend determinístico baseado em arquivo, para testes
+
+    Revela as palavras da transcrição proporcionalmente ao áudio recebido,
+    imitando um decodificador incremental real.
+    """
+
+    name = "arquivo"
+
+    def __init__(self, transcript: str, words_per_second: float = 2.5,
+                 sample_rate: int = 16000):
+        self.words = transcript.split()
+        self.sample_rate = sample_rate
+        self.samples_per_word = max(1, int(sample_rate / words_per_second))
+        self.samples = 0
+
+    @classmethod
+    def for_wav(cls, wav_path: str, **kwargs) -> "FileTranscriptBackend":
+        """Usa a transcrição em `<arquivo>.txt` ao lado do WAV"""
+        transcript = Path(wav_path).with_suffix('.txt').read_text(encoding='utf-8')
+        return cls(transcript.strip(), **kwargs)
+
+    def start(self):
+        self.samples = 0
+
+    def accept_chunk(self, pcm: np.ndarray) -> str:
+        self.samples += len(pcm)
+        revealed = min(len(self.words), self.samples // self.samples_per_word)
+        return " ".join(self.words[:revealed])
+
+    def finish(self) -> str:
+        return " ".join(self.words) if self.samples else ""
+
+
+class VoskSTTBackend(STTBackend):
+    """Backend offline usando Vosk (opcional)"""
+
+    name = "vosk"
+
+    def __init__(self, model_path: str, sample_rate: int = 16000):
+        from vosk import KaldiRecognizer, Model
+
+        self.sample_rate = sample_rate
+        self._model = Model(str(model_path))
+        self._recognizer_class = KaldiRecognizer
+        self._recognizer = None
+        self._committed = []
+
+    def start(self):
+        self._recognizer = self._recognizer_class(self._model, self.sample_rate)
+        self._committed = []
+
+    def accept_chunk(self, pcm: np.ndarray) -> str:
+        data = np.ascontiguousarray(pcm, dtype='<i2').tobytes()
+        if self._recognizer.AcceptWaveform(data):
+            # Segmento fechado pelo próprio decodificador
+            self._committed.append(json.loads(self._recognizer.Result()).get('text', ''))
+            partial = ''
+        else:
+            partial = json.loads(self._recognizer.PartialResult()).get('partial', '')
+        return " ".join(part for part in self._committed + [partial] if part)
+
+    def finish(self) -> str:
+        final = json.loads(self._recognizer.FinalResult()).get('text', '')
+        return " ".join(part for part in self._committed + [final] if part)
+
+
+def create_default_backend(vosk_model_path: Optional[str] = None) -> STTBackend:
+    """Usa Vosk quando o modelo e o pacote existem, senão o backend simulado"""
+    if vosk_model_path and Path(vosk_model_path).exists():
+        try:
+            return VoskSTTBackend(vosk_model_path)
+        except Exception:
+            pass
+    return SimulatedSTTBackend()
@@ -0,0 +1,67 @@
+"""
+Medição do tempo de inicialização do TerlineT
+Registra o tempo de importação de cada módulo e os marcos da partida
+(ex.: primeiro quadro desenhado) para acompanhar o cold start no Android
+"""
+
+import builtins
+import importlib
+import logging
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger('TerlineT.startup')
+
+# Referência de tempo: o momento em que este módulo foi importado
+PROCESS_START = time.perf_counter()
+
+import_times = OrderedDict()
+milestones = OrderedDict()
+
+
+@contextmanager
+def track_imports():
+    """Mede cada módulo importado dentro do bloco (tempo inclusivo)"""
+    original_import = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        start = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            import_times.setdefault(name, time.perf_counter() - start)
+
+    builtins.__import__ = timed_import
+    try:
+        yield
+    finally:
+        builtins.__import__ = original_import
+
+
+def lazy_import(name):
+    """Importa um módulo sob demanda registrando quanto custou"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_times.setdefault(name, time.perf_counter() - start)
+    return module
+
+
+def mark(name):
+    """Registra um marco em segundos desde o início do processo"""
+    milestones.setdefault(name, time.perf_counter() - PROCESS_START)
+
+
+def report(limit=15):
+    """Escreve no log os marcos e as importações mais lentas"""
+    for name, elapsed in milestones.items():
+        logger.info("Startup: %s em %.0fms", name, elapsed * 1000)
+    slowest = sorted(import_times.items(), key=lambda item: item[1], reverse=True)
+    for name, elapsed in slowest[:limit]:
+        logger.info("Import: %s %.1fms", name, elapsed * 1000)
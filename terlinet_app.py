@@ -0,0 +1,824 @@
+"""
+Interface Kivy do TerlineT (versão completa)
+Iniciada por main.py. Fica fora do main.py porque o processo de inferência é
+criado com spawn, que executa de novo o script principal no filho: assim o
+filho não importa o Kivy nem abre outra janela.
+"""
+
+import os
+import re
+import threading
+import time
+import random
+from datetime import datetime
+from pathlib import Path
+
+# Mede o custo de cada import até o primeiro quadro
+import startup_timing
+from startup_timing import lazy_import
+import profiler
+
+# Só o necessário para desenhar a janela; NumPy, modelo, voz e animação
+# são carregados depois do primeiro quadro ou no primeiro uso
+with startup_timing.track_imports():
+    from kivy.app import App
+    from kivy.uix.boxlayout import BoxLayout
+    from kivy.uix.label import Label
+    from kivy.uix.textinput import TextInput
+    from kivy.uix.button import Button
+    from kivy.uix.scrollview import ScrollView
+    from kivy.core.window import Window
+    from kivy.clock import Clock
+    from kivy.properties import StringProperty, BooleanProperty, NumericProperty
+    from kivy.graphics import Color, Rectangle
+    from kivy.utils import platform
+
+    from ui_bus import UIUpdateBus
+    from chat_view import ChatTextView
+
+# Configurar logging (assíncrono, ver logger.py)
+import logger as terlinet_logging
+logger = terlinet_logging.get_logger('app')
+
+# Detectar se está no Android
+IS_ANDROID = platform == 'android'
+
+# Configurações de cores
+WINDOW_BG = (0, 0, 0, 1)  # Preto
+INPUT_BG = (0.07, 0.07, 0.07, 1)  # Cinza escuro
+BUTTON_BG = (0.02, 0.39, 0.62, 1)  # Azul
+MIC_ACTIVE_COLOR = (1, 0, 0, 1)  # Vermelho
+TEXT_COLOR = (1, 1, 1, 1)  # Branco
+HIGHLIGHT_COLOR = (0, 1, 1, 1)  # Ciano
+
+MODEL_FILE = "DeepSeek-R1-0528-Qwen3-8B-Q4_K_M.gguf"
+
+# Configurar caminho do modelo (adaptado para Android)
+if IS_ANDROID:
+    try:
+        from android.storage import primary_external_storage_path
+
+        STORAGE_ROOT = Path(primary_external_storage_path())
+    except ImportError:
+        logger.warning("Módulo android.storage não disponível")
+        STORAGE_ROOT = Path("/storage/emulated/0")
+    MODEL_PATH = STORAGE_ROOT / "TerlineT" / "modelo" / MODEL_FILE
+    # Arquivo colocado no aparelho (navegador, adb push) importado na primeira execução
+    MODEL_SOURCES = [os.environ.get('TERLINET_MODEL_SOURCE'),
+                     STORAGE_ROOT / "Download" / MODEL_FILE]
+else:
+    MODEL_PATH = Path("K:/FLUTTER/TerlineT_Kivy/modelo") / MODEL_FILE
+    MODEL_SOURCES = [os.environ.get('TERLINET_MODEL_SOURCE'),
+                     Path.home() / "Downloads" / MODEL_FILE]
+
+# Modelo de reconhecimento de fala offline (opcional)
+VOSK_MODEL_PATH = MODEL_PATH.parent / "vosk"
+
+# Notas do usuário indexadas para recuperação (TerlineT/notas)
+NOTES_PATH = MODEL_PATH.parent.parent / "notas"
+
+# Snapshot de retomada na pasta de dados do app (gravado em on_pause)
+SNAPSHOT_FILE = "retomada.snap"
+
+# Configurar permissões Android
+if IS_ANDROID:
+    try:
+        from android.permissions import request_permissions, Permission
+        request_permissions([
+            Permission.WRITE_EXTERNAL_STORAGE,
+            Permission.READ_EXTERNAL_STORAGE,
+            Permission.RECORD_AUDIO,
+            Permission.INTERNET
+        ])
+    except ImportError:
+        logger.warning("Módulo android.permissions não disponível")
+        pass
+
+
+class VoiceSynthesizer:
+    def __init__(self):
+        self.is_speaking = False
+
+    def speak(self, text, callback):
+        if not text or self.is_speaking:
+            callback()
+            return
+        
+        self.is_speaking = True
+        logger.debug("Falando: %s", text)
+        with profiler.span('tts.speak'):
+            # Simula o tempo de fala (reduzido para Android)
+            sleep_time = len(text.split()) * (0.1 if IS_ANDROID else 0.2)
+            time.sleep(sleep_time)
+        self.is_speaking = False
+        callback()
+
+
+class VoiceRecognizer:
+    def __init__(self, source_factory=None, stt_backend=None):
+        self.listening = False
+        self.recording = False
+        self.confirmation_phrase = "Sim, estou ouvindo! Como posso ajudar?"
+
+        # Módulos de áudio (NumPy) só são carregados quando a voz é usada
+        voice_activity = lazy_import('voice_activity')
+        speech_backend = lazy_import('speech_backend')
+
+        # Reconhecimento incremental enquanto o usuário fala
+        self.stt_backend = stt_backend or speech_backend.create_default_backend(str(VOSK_MODEL_PATH))
+        self.partial_text = ""
+
+        # Captura com endpointing por VAD
+        self.source_factory = source_factory or voice_activity.open_default_source
+        self.detector = voice_activity.VoiceActivityDetector()
+        self.ring = voice_activity.AudioRingBuffer(self.detector.max_frames * self.detector.frame_len * 2)
+        self.last_utterance = None
+
+    def start_listening(self):
+        self.listening = True
+        logger.info("Reconhecimento de voz simulado ativado")
+
+    def stop_listening(self):
+        self.listening = False
+        self.recording = False
+
+    def capture(self, source, on_partial=None):
+        """Grava até o VAD detectar silêncio no final da fala"""
+        from voice_activity import AudioRingBuffer, VoiceActivityDetector, capture_utterance
+
+        if source.sample_rate != self.detector.sample_rate:
+            self.detector = VoiceActivityDetector(sample_rate=source.sample_rate)
+            self.ring = AudioRingBuffer(self.detector.max_frames * self.detector.frame_len * 2)
+
+        def feed(frames):
+            # Decodifica em pedaços durante a fala
+            partial = self.stt_backend.accept_chunk(frames.ravel())
+            if partial != self.partial_text:
+                self.partial_text = partial
+                if on_partial:
+                    on_partial(partial)
+
+        self.partial_text = ""
+        self.stt_backend.start()
+        return capture_utterance(source, self.detector, self.ring, on_frames=feed,
+                                 cancelled=lambda: not self.listening)
+
+    def record_command(self, callback, on_partial=None):
+        """Grava um comando de voz com detecção de fim de fala
+
+        Bloqueia durante a gravação: deve ser chamado fora da thread da UI.
+        Se stop_listening() for chamado no meio, o callback não é chamado.
+        """
+        if not self.listening:
+            callback("")
+            return
+
+        self.recording = True
+        source = self.source_factory()
+        if source is None:
+            logger.info("Microfone indisponível - simulando gravação de comando")
+            time.sleep(1.5 if IS_ANDROID else 2)  # Tempo reduzido para Android
+            self.recording = False
+            callback("comando de voz simulado")
+            return
+
+        try:
+            with profiler.span('voice.capture'):
+                self.last_utterance = self.capture(source, on_partial)
+            end_of_speech = time.perf_counter()
+            with profiler.span('stt.finish'):
+                text = self.stt_backend.finish()
+        finally:
+            source.close()
+            self.recording = False
+        if not self.listening:
+            logger.info("Gravação de comando cancelada")
+            return
+
+        duration = len(self.last_utterance) / self.detector.sample_rate
+        latency_ms = (time.perf_counter() - end_of_speech) * 1000
+        logger.info("Comando gravado: %.2fs de fala, transcrição em %.0fms (%s)",
+                    duration, latency_ms, self.stt_backend.name)
+        callback(text if len(self.last_utterance) else "")
+
+
+# Widget com fundo colorido
+class ColoredBoxLayout(BoxLayout):
+    bg_color = (0, 0, 0, 1)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bind(pos=self.update_rect, size=self.update_rect)
+        with self.canvas.before:
+            Color(*self.bg_color)
+            self.rect = Rectangle(pos=self.pos, size=self.size)
+
+    def update_rect(self, *args):
+        self.rect.pos = self.pos
+        self.rect.size = self.size
+
+    def set_bg_color(self, color):
+        self.bg_color = color
+        self.canvas.before.clear()
+        with self.canvas.before:
+            Color(*color)
+            self.rect = Rectangle(pos=self.pos, size=self.size)
+
+
+# Botão de microfone animado
+class AnimatedMicButton(Button):
+    mic_active = BooleanProperty(False)
+    mic_level = NumericProperty(0)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.animation = None
+        self.bind(mic_active=self.update_animation)
+
+    def update_animation(self, instance, value):
+        from kivy.animation import Animation
+
+        if value:
+            # Inicia animação de pulso
+            self.animation = Animation(mic_level=1, duration=0.5) + Animation(mic_level=0, duration=0.5)
+            self.animation.repeat = True
+            self.animation.start(self)
+        elif self.animation:
+            self.animation.cancel(self)
+            self.mic_level = 0
+
+
+# Interface principal
+class ChatScreen(ColoredBoxLayout):
+    chat_log = StringProperty("")
+    status_text = StringProperty("Carregando...")
+    input_text = StringProperty("")
+    send_enabled = BooleanProperty(False)
+    mic_active = BooleanProperty(False)
+    mic_level = NumericProperty(0)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stream_parts = []
+        self.bg_color = WINDOW_BG
+        self.orientation = "vertical"
+        self.spacing = 10
+        self.padding = 10
+
+        # Título
+        title = Label(
+            text='🤖 TERLINET - ASSISTENTE VIRTUAL',
+            font_size=16 if IS_ANDROID else 20,
+            bold=True,
+            color=HIGHLIGHT_COLOR,
+            size_hint_y=None,
+            height=35 if IS_ANDROID else 40
+        )
+
+        # Status
+        status = Label(
+            text=self.status_text,
+            font_size=10 if IS_ANDROID else 11,
+            color=HIGHLIGHT_COLOR,
+            size_hint_y=None,
+            height=20
+        )
+        self.bind(status_text=status.setter('text'))
+
+        # Área de chat
+        scroll_view = ScrollView(size_hint=(1, 0.7))
+        self.chat_view = ChatTextView(
+            font_size=12 if IS_ANDROID else 14,
+            color=TEXT_COLOR
+        )
+        scroll_view.add_widget(self.chat_view)
+
+        # Área de entrada
+        input_box = BoxLayout(
+            size_hint_y=None,
+            height=50 if IS_ANDROID else 40,
+            spacing=10
+        )
+
+        self.input_field = TextInput(
+            text=self.input_text,
+            hint_text='Digite sua mensagem...',
+            font_size=12 if IS_ANDROID else 14,
+            background_color=INPUT_BG,
+            foreground_color=TEXT_COLOR,
+            multiline=False,
+            size_hint_x=0.6
+        )
+        self.input_field.bind(text=self.setter('input_text'))
+        self.input_field.bind(on_text_validate=self.send_message)
+
+        self.send_btn = Button(
+            text='ENVIAR',
+            font_size=12 if IS_ANDROID else 14,
+            bold=True,
+            background_color=BUTTON_BG if self.send_enabled else (0.5, 0.5, 0.5, 1),
+            disabled=not self.send_enabled,
+            size_hint_x=0.2
+        )
+        self.send_btn.bind(on_press=self.send_message)
+        self.bind(send_enabled=self.update_send_button)
+
+        # Botão de microfone
+        self.mic_btn = AnimatedMicButton(
+            text='🎤',
+            font_size=18 if IS_ANDROID else 20,
+            background_color=MIC_ACTIVE_COLOR if self.mic_active else BUTTON_BG,
+            size_hint_x=0.2
+        )
+        self.mic_btn.bind(on_press=self.toggle_microphone)
+        self.bind(mic_active=self.mic_btn.setter('mic_active'))
+        self.bind(mic_level=self.mic_btn.setter('mic_level'))
+
+        input_box.add_widget(self.input_field)
+        input_box.add_widget(self.send_btn)
+        input_box.add_widget(self.mic_btn)
+
+        # Monta a interface
+        self.add_widget(title)
+        self.add_widget(status)
+        self.add_widget(scroll_view)
+        self.add_widget(input_box)
+
+        # Barramento de atualizações vindas de outras threads
+        self.ui_bus = UIUpdateBus(self)
+        self.ui_bus.start()
+
+        # Componentes pesados são criados depois do primeiro quadro
+        self.model = None
+        self.voice = VoiceSynthesizer()
+        self.voice_recognizer = None
+        self.voice_capture = None
+        self.resource_monitor = None
+        self.inference_server = None
+        # Conversa retomada de um snapshot (o app foi encerrado em pausa)
+        self.snapshot_path = None
+        self.resumed = False
+        # Origem de um modelo copiado (não movido): pode ser apagada após a verificação
+        self.provisioned_source = None
+
+        # Mensagem inicial
+        platform_msg = "🤖 Android" if IS_ANDROID else "💻 Desktop"
+        self.add_message("Sistema", f"TerlineT iniciando... Plataforma: {platform_msg}")
+        self.status_text = "Carregando modelo GGUF..."
+
+    def on_start(self):
+        """Aguarda o primeiro quadro antes de carregar o resto"""
+        Window.bind(on_flip=self.on_first_frame)
+
+    def on_first_frame(self, *args):
+        Window.unbind(on_flip=self.on_first_frame)
+        startup_timing.mark("primeiro quadro")
+        # Deixa o quadro seguinte livre antes de importar o modelo
+        Clock.schedule_once(self.initialize_subsystems, 0)
+
+    def initialize_subsystems(self, dt=None):
+        """Importa e cria os subsistemas numa thread, fora da thread da UI"""
+        data_dir = App.get_running_app().user_data_dir
+        threading.Thread(target=self.prepare_subsystems, args=(data_dir,),
+                         name='Startup', daemon=True).start()
+
+    def prepare_subsystems(self, data_dir):
+        """Carrega o modelo e prepara o reconhecimento de voz (thread Startup)
+
+        NumPy, gguf_loader, o roteador de intenções e o Vosk são importados e
+        construídos aqui; o que mexe na tela volta pelo ui_bus.
+        """
+        try:
+            gguf_loader = lazy_import('gguf_loader')
+            model = gguf_loader.GGUFModelWrapper()
+            # Resultado da sondagem de backends reaproveitado entre execuções
+            model.probe_cache_path = os.path.join(data_dir, 'backend_probe.json')
+            model.verification_cache_path = os.path.join(data_dir, 'model_verification.json')
+            # Processo de inferência separado no desktop. No Android fica
+            # desligado: o python-for-android não tem um executável Python para
+            # o spawn iniciar e o Android não oferece /dev/shm para o
+            # shared_memory; lá a geração roda em threads deste processo
+            model.use_worker = os.environ.get(
+                'TERLINET_INFERENCE_WORKER', '0' if IS_ANDROID else '1') == '1'
+
+            # Retoma a conversa de antes do app ser encerrado em pausa
+            snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+            extra = model.restore_snapshot(snapshot_path)
+
+            # Modelos alternativos na mesma pasta servem de fallback sob pressão
+            if MODEL_PATH.parent.exists():
+                for path in MODEL_PATH.parent.glob('*.gguf'):
+                    model.register_model(str(path))
+
+            self.snapshot_path = snapshot_path
+            self.model = model
+            if extra and extra.get('chat_log'):
+                self.resumed = True
+                self.ui_bus.call(self.show_restored_chat, extra['chat_log'])
+
+            # Monitor de recursos em baixa frequência
+            resource_monitor = lazy_import('resource_monitor')
+            self.resource_policy = resource_monitor.DegradationPolicy()
+            self.resource_policy.add_listener(self.on_resource_level)
+            model.attach_resource_policy(self.resource_policy)
+            self.resource_monitor = resource_monitor.ResourceMonitor(
+                interval=10.0 if IS_ANDROID else 5.0, policy=self.resource_policy)
+            self.resource_monitor.start()
+
+            # Na primeira execução o modelo é importado para TerlineT/modelo antes de carregar
+            provisioning = lazy_import('provisioning')
+            source = None if MODEL_PATH.exists() else provisioning.find_source(MODEL_PATH, MODEL_SOURCES)
+            if source:
+                threading.Thread(target=self.provision_model, args=(source,),
+                                 name='ModelProvisioning', daemon=True).start()
+            else:
+                self.load_model()
+
+            # Servidor local opcional compartilhando o modelo carregado
+            server_port = os.environ.get('TERLINET_SERVER_PORT')
+            if server_port:
+                server = lazy_import('server')
+                self.inference_server = server.InferenceServer(model, port=int(server_port))
+                self.inference_server.start_in_thread()
+
+            # Índice de recuperação em paralelo com o reconhecedor de voz
+            threading.Thread(target=self.load_retrieval_index, daemon=True).start()
+
+            # Reconhecedor pronto; a gravação começa quando o microfone é tocado
+            recognizer = VoiceRecognizer()
+            self.ui_bus.call(self.voice_recognizer_ready, recognizer)
+        except Exception as e:
+            logger.error("Erro ao iniciar os subsistemas: %s", e)
+            self.ui_bus.add_message("Sistema", f"❌ Erro na inicialização: {e}")
+            self.ui_bus.set_send_enabled(True)
+        startup_timing.mark("subsistemas iniciados")
+        startup_timing.report()
+
+    def voice_recognizer_ready(self, recognizer):
+        if self.voice_recognizer is None:
+            self.voice_recognizer = recognizer
+
+    def load_model(self):
+        """Carrega o modelo (callback chega pela thread de carregamento)"""
+        self.model.load_model(
+            str(MODEL_PATH),
+            lambda success, error=None: self.ui_bus.call(self.model_loaded_callback, success, error))
+
+    def provision_model(self, source):
+        """Importa o modelo para TerlineT/modelo (thread própria) e depois carrega"""
+        provisioning = lazy_import('provisioning')
+        gigabyte = 1024 ** 3
+        self.ui_bus.add_message("Sistema", f"📦 Importando o modelo de {source}...")
+
+        def progress(copied, total):
+            self.ui_bus.set_status(f"Importando modelo: {copied * 100 // total}% "
+                                   f"({copied / gigabyte:.1f}/{total / gigabyte:.1f} GB)")
+
+        try:
+            with profiler.span('model.provision'):
+                result = provisioning.provision(source, str(MODEL_PATH), progress)
+            if result == provisioning.PROVISION_COPIED:
+                self.provisioned_source = source
+            self.ui_bus.set_status("Carregando modelo GGUF...")
+        except (OSError, provisioning.ProvisioningError) as e:
+            logger.error("Falha ao importar o modelo: %s", e)
+            self.ui_bus.add_message("Sistema", f"❌ Falha ao importar o modelo: {e}")
+        self.load_model()
+
+    def offer_source_removal(self, source):
+        """Pergunta se a cópia original do modelo (já verificada) pode ser apagada"""
+        from kivy.uix.popup import Popup
+
+        self.provisioned_source = None
+        size_gb = os.path.getsize(source) / 1024 ** 3
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        content.add_widget(Label(
+            text=f"O modelo foi copiado e verificado.\nApagar {source} ({size_gb:.1f} GB)?",
+            halign='center'))
+        buttons = BoxLayout(size_hint_y=None, height=48, spacing=10)
+        delete_btn = Button(text="Apagar", background_color=BUTTON_BG)
+        keep_btn = Button(text="Manter")
+        buttons.add_widget(delete_btn)
+        buttons.add_widget(keep_btn)
+        content.add_widget(buttons)
+        popup = Popup(title="Liberar espaço", content=content, size_hint=(0.9, 0.4),
+                      auto_dismiss=False)
+
+        def delete(*args):
+            popup.dismiss()
+            try:
+                os.remove(source)
+                if os.path.exists(source + '.sha256'):
+                    os.remove(source + '.sha256')
+            except OSError as e:
+                logger.error("Não foi possível apagar %s: %s", source, e)
+                self.add_message("Sistema", f"❌ Não foi possível apagar {source}: {e}")
+                return
+            logger.info("Origem do modelo apagada: %s", source)
+            self.add_message("Sistema", f"🗑️ {source} apagado ({size_gb:.1f} GB liberados)")
+
+        delete_btn.bind(on_release=delete)
+        keep_btn.bind(on_release=popup.dismiss)
+        popup.open()
+
+    def show_restored_chat(self, chat_log):
+        """Mostra a conversa salva; KV cache e sampler voltam quando o modelo carregar"""
+        self.chat_log = chat_log
+        for block in self.chat_log.split("\n\n"):
+            if block:
+                self.chat_view.add_paragraph(block)
+        startup_timing.mark("conversa retomada")
+
+    def save_snapshot(self):
+        """Grava o snapshot de retomada (chamado em on_pause)"""
+        if self.model is None or self.snapshot_path is None:
+            return
+        try:
+            self.model.save_snapshot(self.snapshot_path, extra={'chat_log': self.chat_log})
+        except Exception as e:
+            logger.error("Erro ao salvar o snapshot: %s", e)
+
+    def load_retrieval_index(self):
+        """Abre o índice de conversas/notas e indexa notas novas"""
+        try:
+            retrieval = lazy_import('retrieval')
+            index_dir = os.path.join(App.get_running_app().user_data_dir, 'indice')
+            with profiler.span('retrieval.load'):
+                index = retrieval.RetrievalIndex(index_dir)
+                index.add_directory(str(NOTES_PATH))
+            self.model.attach_retrieval(index)
+            self.connect_embeddings()
+        except Exception as e:
+            logger.error("Erro ao carregar o índice de recuperação: %s", e)
+
+    def connect_embeddings(self):
+        """Liga a busca semântica quando o índice e o modelo estão prontos"""
+        model = self.model
+        if model is None or model.retrieval is None or not model.model_loaded:
+            return
+        if model.embeddings_available():
+            model.retrieval.set_embedder(model.embed, Path(model.model_path).name)
+
+    def on_resource_level(self, level, sample):
+        """Avisa na barra de status quando a qualidade é reduzida (thread do monitor)"""
+        from resource_monitor import LEVEL_NAMES
+
+        if level:
+            self.ui_bus.set_status(f"⚠️ Recursos limitados - modo {LEVEL_NAMES[level]}")
+        else:
+            self.ui_bus.set_status("Recursos normalizados")
+
+    def update_send_button(self, instance, value):
+        self.send_btn.disabled = not value
+        self.send_btn.background_color = BUTTON_BG if value else (0.5, 0.5, 0.5, 1)
+
+    def model_loaded_callback(self, success, error=None):
+        """Callback chamado quando o modelo é carregado"""
+        source = self.provisioned_source
+        if success and source and self.model.model is not None and self.model.model.loaded:
+            # A primeira carga conferiu a cópia inteira contra o resumo da origem
+            if os.path.exists(source):
+                self.offer_source_removal(source)
+        if success:
+            threading.Thread(target=self.connect_embeddings, daemon=True).start()
+            if error and "simulado" in error.lower():
+                self.status_text = "Modo simulado inteligente ativo"
+                self.add_message("TerlineT",
+                                 f"Olá! Estou funcionando em modo simulado inteligente. {error}")
+            else:
+                self.status_text = f"Modelo GGUF carregado - {self.model.backend_summary()}"
+                if not self.resumed:
+                    self.add_message("TerlineT",
+                                     "Olá! Modelo GGUF carregado com sucesso! Como posso ajudar?")
+
+            if self.resumed:
+                # Conversa retomada: sem boas-vindas de novo
+                self.send_enabled = True
+                return
+
+            if IS_ANDROID:
+                self.add_message("TerlineT",
+                                 f"📱 Funcionando perfeitamente no Android! Modelo localizado em: {MODEL_PATH}")
+
+            self.send_enabled = True
+            self.speak("Olá! Estou pronta para ajudar você!")
+        else:
+            self.status_text = f"Erro: {error}" if error else "Erro ao carregar"
+            self.add_message("Sistema",
+                             f"❌ Falha ao carregar modelo: {error or 'Erro desconhecido'}")
+            self.send_enabled = True  # Permite uso mesmo com erro
+
+    def add_message(self, sender, message):
+        self.add_messages([(sender, message)])
+
+    def add_messages(self, messages):
+        """Adiciona várias mensagens com um único relayout"""
+        timestamp = datetime.now().strftime("%H:%M")
+        formatted = [f"[{timestamp}] {sender}: {message}" for sender, message in messages]
+        self.chat_log += "".join(f"{text}\n\n" for text in formatted)
+
+        # Só os blocos novos são diagramados
+        for text in formatted:
+            self.chat_view.add_paragraph(text)
+
+    def begin_stream(self, sender):
+        """Abre o balão da resposta em streaming"""
+        timestamp = datetime.now().strftime("%H:%M")
+        self.stream_parts = [f"[{timestamp}] {sender}: "]
+        self.chat_view.begin_stream(self.stream_parts[0])
+
+    def append_stream(self, text):
+        self.stream_parts.append(text)
+        self.chat_view.append_stream(text)
+
+    def end_stream(self):
+        self.chat_log += "".join(self.stream_parts) + "\n\n"
+        self.stream_parts = []
+        self.chat_view.end_stream()
+
+    def speak(self, text):
+        def callback():
+            self.ui_bus.set_send_enabled(True)
+
+        self.send_enabled = False
+        threading.Thread(target=self.voice.speak, args=(text, callback), daemon=True).start()
+
+    def send_message(self, instance):
+        message = self.input_text.strip()
+        if not message or not self.send_enabled:
+            return
+
+        # Adiciona a mensagem do usuário
+        self.add_message("Você", message)
+        self.input_text = ""
+        self.input_field.text = ""
+        self.send_enabled = False
+        self.status_text = "Processando..."
+
+        # Processa a resposta em outra thread
+        threading.Thread(target=self.process_message, args=(message,), daemon=True).start()
+
+    def process_message(self, message):
+        parts = []
+        try:
+            # Gera resposta usando o modelo GGUF, exibindo os tokens à medida que chegam
+            for piece in self.model.generate_stream(message):
+                if not parts:
+                    self.ui_bus.begin_stream("TerlineT")
+                parts.append(piece)
+                self.ui_bus.append_stream(piece)
+            response = "".join(parts)
+
+            if response:
+                self.ui_bus.end_stream()
+                self.ui_bus.speak(response)
+            else:
+                raise RuntimeError("Resposta vazia do modelo")
+
+        except Exception as e:
+            if parts:
+                self.ui_bus.end_stream()
+            self.ui_bus.add_message("Sistema", f"Erro ao processar: {str(e)}")
+            logger.error("Erro no processamento: %s", e)
+        finally:
+            self.ui_bus.set_status("Pronto para nova mensagem")
+            self.ui_bus.set_send_enabled(True)
+
+    def toggle_microphone(self, instance):
+        """Ativa/desativa o microfone manualmente"""
+        if self.mic_active:
+            self.stop_voice_recognition()
+        else:
+            self.start_voice_recognition()
+
+    def start_voice_recognition(self):
+        """Inicia o reconhecimento de voz"""
+        if self.voice_recognizer is None:
+            # Ainda sendo criado pela thread de inicialização
+            self.status_text = "🎤 Reconhecimento de voz carregando..."
+            return
+        if self.voice_capture is not None and self.voice_capture.is_alive():
+            # Gravação anterior ainda terminando (microfone desligado e religado)
+            return
+        self.mic_active = True
+        self.status_text = "🎤 Ouvindo... Diga algo!"
+        self.voice_recognizer.start_listening()
+
+        # A leitura do microfone bloqueia: a gravação roda numa thread própria
+        self.voice_capture = threading.Thread(target=self.capture_voice_command,
+                                              args=(self.voice_recognizer,),
+                                              name='VoiceCapture', daemon=True)
+        self.voice_capture.start()
+
+    def stop_voice_recognition(self):
+        """Para o reconhecimento de voz"""
+        self.mic_active = False
+        self.status_text = "Pronto para nova mensagem"
+        if self.voice_recognizer:
+            self.voice_recognizer.stop_listening()
+
+    def capture_voice_command(self, recognizer):
+        """Grava um comando (thread VoiceCapture); o resultado chega à UI pelo ui_bus"""
+        def on_partial(text):
+            self.ui_bus.set_status(f"🎤 {text}" if text else "Gravando comando...")
+
+        try:
+            recognizer.record_command(self.handle_voice_command, on_partial)
+        except Exception as e:
+            logger.error("Erro na gravação do comando de voz: %s", e)
+            self.ui_bus.add_message("Sistema", f"❌ Erro no microfone: {e}")
+        finally:
+            self.ui_bus.call(self.voice_capture_finished, recognizer)
+
+    def voice_capture_finished(self, recognizer):
+        """Um comando por ativação: o microfone desliga ao fim da gravação"""
+        if self.voice_capture is not None and self.voice_capture.is_alive():
+            # Outra gravação já começou depois desta
+            return
+        recognizer.stop_listening()
+        self.mic_active = False
+
+    def handle_voice_command(self, command):
+        """Processa o comando de voz reconhecido"""
+        if command and command.strip():
+            self.ui_bus.add_message("Você", f"🎤 {command}")
+            # A decodificação restrita leva segundos: fora da thread da UI
+            threading.Thread(target=self.interpret_voice_command, args=(command,),
+                             name='VoiceAction', daemon=True).start()
+        else:
+            self.ui_bus.set_status("Comando não reconhecido")
+            self.ui_bus.add_message("Sistema", "❌ Não consegui entender o comando de voz")
+
+    def interpret_voice_command(self, command):
+        """Converte o comando numa ação (thread própria) e a executa na UI"""
+        action = None
+        if self.model is not None and self.model.model_loaded:
+            self.ui_bus.set_status("Interpretando comando...")
+            try:
+                # JSON sempre válido: a decodificação segue o esquema das ações
+                action = self.model.voice_action(command)
+            except Exception as e:
+                logger.warning("Falha ao interpretar o comando de voz: %s", e)
+        self.ui_bus.call(self.process_voice_command, command, action)
+
+    def process_voice_command(self, command, action=None):
+        """Executa a ação do comando de voz; sem ação, vira uma mensagem normal"""
+        kind = action['acao'] if action else 'mensagem'
+        if kind == 'nova_conversa':
+            self.model.context.clear()
+            self.add_message("Sistema", "Nova conversa iniciada")
+            return
+        if kind == 'parar_microfone':
+            self.stop_voice_recognition()
+            return
+        if kind == 'status':
+            self.add_message("Sistema", f"Modelo: {self.model.backend_summary()}")
+            return
+        message = (action or {}).get('texto') or command
+        self.input_text = message
+        self.input_field.text = message
+        self.send_message(None)
+
+
+# App principal
+class TerlineTApp(App):
+    def build(self):
+        # Passa a gravar também em arquivo rotativo na pasta de dados do app
+        terlinet_logging.setup_logging(log_dir=os.path.join(self.user_data_dir, 'logs'))
+        Window.clearcolor = WINDOW_BG
+        if IS_ANDROID:
+            # Ajustar tamanho para Android
+            Window.size = (360, 640)
+        return ChatScreen()
+
+    def on_start(self):
+        self.root.on_start()
+
+    def on_pause(self):
+        # O Android pode encerrar o app pausado: salva o necessário para retomar
+        self.root.save_snapshot()
+        return True
+
+    def on_stop(self):
+        if self.root.resource_monitor:
+            self.root.resource_monitor.stop()
+        if self.root.model is not None and self.root.model.retrieval is not None:
+            self.root.model.retrieval.close()
+        if self.root.inference_server is not None:
+            self.root.inference_server.stop()
+        if self.root.model is not None:
+            self.root.model.close()
+        # Saída normal começa uma conversa nova na próxima abertura
+        if self.root.snapshot_path and os.path.exists(self.root.snapshot_path):
+            os.remove(self.root.snapshot_path)
+
+        # Salva o trace da execução quando o profiler estiver ativo
+        if profiler.is_enabled():
+            trace_path = os.path.join(self.user_data_dir, 'terlinet_trace.json')
+            events = profiler.export_chrome_trace(trace_path)
+            logger.info("Trace salvo em %s (%d eventos)", trace_path, events)
+
+    def on_resume(self):
+        # Permite que o app seja retomado no Android
+        pass
+
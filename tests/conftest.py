@@ -0,0 +1,104 @@
+"""
+Configuração comum dos testes do TerlineT
+Os módulos do app ficam na raiz do repositório (sem pacote); os áudios de
+teste são gerados em WAV PCM de 16 bits e o modelo de teste é um llama
+mínimo com pesos aleatórios, ambos em pastas temporárias.
+"""
+
+import sys
+import wave
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gguf_loader import GGML_TYPE_F32, GGUF_TYPE_ARRAY, GGUF_TYPE_STRING, _bytes_to_unicode
+from gguf_writer import GGUFWriter
+
+SAMPLE_RATE = 16000
+
+# Modelo de teste: vocabulário de bytes ASCII imprimíveis (todo token vira texto)
+N_EMBD, N_LAYERS, N_HEADS, N_KV_HEADS, HEAD_DIM, N_FF = 128, 2, 4, 2, 32, 256
+TOKENS = [_bytes_to_unicode()[byte] for byte in range(0x20, 0x7f)]
+N_VOCAB = len(TOKENS)
+
+
+def speech(ms: int, amplitude: float = 6000.0) -> np.ndarray:
+    """Trecho "falado": vogal sintética (fundamental de 220 Hz e harmônicos)"""
+    t = np.arange(SAMPLE_RATE * ms // 1000) / SAMPLE_RATE
+    wave_form = sum(np.sin(2 * np.pi * 220 * k * t) / k for k in (1, 2, 3))
+    return amplitude * wave_form / 1.8
+
+
+def silence(ms: int, amplitude: float = 30.0, seed: int = 0) -> np.ndarray:
+    """Ruído de fundo fraco (~-60 dBFS)"""
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal(SAMPLE_RATE * ms // 1000) * amplitude
+
+
+@pytest.fixture
+def make_wav(tmp_path):
+    """Grava os trechos em sequência num WAV; com `transcript`, grava também o .txt"""
+    def make(*parts, name='fala.wav', transcript=None):
+        samples = np.clip(np.concatenate(parts), -32768, 32767).astype('<i2')
+        path = tmp_path / name
+        with wave.open(str(path), 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(samples.tobytes())
+        if transcript is not None:
+            path.with_suffix('.txt').write_text(transcript, encoding='utf-8')
+        return path
+    return make
+
+
+def tiny_model_tensors():
+    """Tensores (shape numpy = GGML invertido) de um llama mínimo"""
+    tensors = {'token_embd.weight': (N_VOCAB, N_EMBD), 'output_norm.weight': (N_EMBD,)}
+    for layer in range(N_LAYERS):
+        prefix = f'blk.{layer}.'
+        tensors.update({
+            prefix + 'attn_norm.weight': (N_EMBD,),
+            prefix + 'attn_q.weight': (N_HEADS * HEAD_DIM, N_EMBD),
+            prefix + 'attn_k.weight': (N_KV_HEADS * HEAD_DIM, N_EMBD),
+            prefix + 'attn_v.weight': (N_KV_HEADS * HEAD_DIM, N_EMBD),
+            prefix + 'attn_output.weight': (N_EMBD, N_HEADS * HEAD_DIM),
+            prefix + 'ffn_norm.weight': (N_EMBD,),
+            prefix + 'ffn_gate.weight': (N_FF, N_EMBD),
+            prefix + 'ffn_up.weight': (N_FF, N_EMBD),
+            prefix + 'ffn_down.weight': (N_EMBD, N_FF),
+        })
+    return tensors
+
+
+def write_tiny_gguf(path: Path, seed: int = 0) -> Path:
+    """Grava o llama mínimo (F32, pesos aleatórios, tokenizador gpt2 sem EOS)"""
+    rng = np.random.default_rng(seed)
+    writer = GGUFWriter(path)
+    for key, value in {'general.architecture': 'llama', 'llama.context_length': 128,
+                       'llama.embedding_length': N_EMBD, 'llama.block_count': N_LAYERS,
+                       'llama.attention.head_count': N_HEADS,
+                       'llama.attention.head_count_kv': N_KV_HEADS,
+                       'llama.feed_forward_length': N_FF,
+                       'tokenizer.ggml.model': 'gpt2', 'tokenizer.ggml.tokens': TOKENS}.items():
+        writer.add_field(key, value)
+    writer.add_field('tokenizer.ggml.merges', [], GGUF_TYPE_ARRAY, GGUF_TYPE_STRING)
+    arrays = {}
+    for name, shape in tiny_model_tensors().items():
+        if name.endswith('norm.weight'):
+            arrays[name] = np.ones(shape, dtype=np.float32)
+        else:
+            arrays[name] = (rng.standard_normal(shape) * 0.3).astype(np.float32)
+        writer.add_tensor(name, shape[::-1], GGML_TYPE_F32)
+    with writer:
+        for name, array in arrays.items():
+            writer.write_tensor(name, [array])
+    return path
+
+
+@pytest.fixture(scope='session')
+def tiny_gguf(tmp_path_factory):
+    return write_tiny_gguf(tmp_path_factory.mktemp('modelo') / 'tiny.gguf')
@@ -0,0 +1,142 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+
+from constrained import DEAD, CharAutomaton, ConstrainedSampler, GrammarCache, escape, json_schema_pattern
+from gguf_loader import VOICE_ACTION_SCHEMA, GGUFModelWrapper
+from numpy_engine import Sampler
+
+VOICE_PATTERN = ' ?' + json_schema_pattern(VOICE_ACTION_SCHEMA)
+
+
+class ToyTokenizer:
+    """Vocabulário fixo com EOS no id 0"""
+
+    eos_id = 0
+
+    def __init__(self, tokens):
+        self.tokens = ['</s>'] + list(tokens)
+
+    def token_strings(self):
+        return [None] + self.tokens[1:]
+
+
+def run(vocab, pattern, preference, max_tokens=20):
+    """Decodifica de forma gulosa preferindo os tokens na ordem de `preference`"""
+    tokenizer = ToyTokenizer(vocab)
+    sampler = ConstrainedSampler(Sampler(temperature=0), GrammarCache(tokenizer).grammar(pattern))
+    logits = np.zeros(len(tokenizer.tokens), dtype=np.float32)
+    for rank, text in enumerate(preference):
+        logits[tokenizer.tokens.index(text)] = len(preference) - rank
+    pieces = []
+    for _ in range(max_tokens):
+        token = sampler.sample(logits)
+        if token in (sampler.end_id, DEAD):
+            break
+        pieces.append(tokenizer.tokens[token])
+    return ''.join(pieces), sampler
+
+
+@pytest.mark.parametrize('pattern, accepted, rejected', [
+    ('[a-c]x[^0-9]', ['axy', 'cx-'], ['dxy', 'ax5', 'ax']),
+    ('gato|cão|peixe', ['gato', 'cão', 'peixe'], ['gatocão', 'gat', '']),
+    ('(ab)*c+d?', ['c', 'ababcc', 'ccd'], ['abd', 'abac', 'd']),
+    (r'\d{2,3}-\w{2}', ['12-ab', '123-Zé'], ['1-ab', '1234-ab', '12-a']),
+    (r'\[\.\]\s\\n', ['[.] \\n', '[.]\t\\n'], ['[x] \\n', '[.] \n']),
+    ('.+', ['qualquer coisa'], ['', 'duas\nlinhas']),
+])
+def test_compiler_matches_like_a_regular_expression(pattern, accepted, rejected):
+    automaton = CharAutomaton(pattern)
+    for text in accepted:
+        assert automaton.fullmatch(text), text
+    for text in rejected:
+        assert not automaton.fullmatch(text), text
+
+
+def test_escape_makes_metacharacters_literal():
+    text = 'a+b (c) [d] {e} .|*?\\'
+    assert CharAutomaton(escape(text)).fullmatch(text)
+
+
+@pytest.mark.parametrize('pattern', ['(ab', 'a)', '[ab'])
+def test_malformed_patterns_are_rejected(pattern):
+    with pytest.raises(ValueError):
+        CharAutomaton(pattern)
+
+
+def test_voice_action_schema_pattern():
+    automaton = CharAutomaton(VOICE_PATTERN)
+
+    for text in ['{"acao": "status", "texto": ""}',
+                 ' { "acao" : "mensagem" , "texto" : "diga \\"oi\\"" }']:
+        assert automaton.fullmatch(text), text
+        assert json.loads(text)['acao'] in VOICE_ACTION_SCHEMA['properties']['acao']['enum']
+    for text in ['{"acao": "desligar", "texto": ""}',
+                 '{"acao": "status"}',
+                 '{"texto": "", "acao": "status"}',
+                 '{"acao": "status", "texto": "duas\nlinhas"}']:
+        assert not automaton.fullmatch(text), text
+
+
+def test_sampler_only_picks_allowed_tokens():
+    vocab = ['{', '}', '"', 'a', 'b', 'ab', 'x', ':', ': ', '{"']
+    text, sampler = run(vocab, r'\{"ab": ?"x"\}', ['x', '}', 'ab', '{"', ': ', '"', 'a', '{'])
+
+    assert text == '{"ab": "x"}'
+    assert sampler.complete
+    # Tokens que casariam com o texto mas não com a gramática ficam mascarados
+    grammar = sampler.grammar
+    assert not grammar.mask(grammar.start)[1 + vocab.index('x')]
+    assert grammar.mask(grammar.start)[1 + vocab.index('{"')]
+
+
+def test_sampler_returns_eos_once_nothing_else_fits():
+    text, sampler = run(['a', 'b'], 'ab?', ['b', 'a'])
+    assert text == 'ab' and sampler.complete
+
+    tokenizer = ToyTokenizer(['a'])
+    sampler = ConstrainedSampler(Sampler(temperature=0), GrammarCache(tokenizer).grammar('a'))
+    sampler.sample(np.zeros(2, dtype=np.float32))
+    assert sampler.sample(np.array([0, 5], dtype=np.float32)) == tokenizer.eos_id
+
+
+def test_tokens_leading_to_dead_ends_are_masked():
+    # Sem o token 'b', começar por 'a' não tem saída; 'c' + 'd' tem
+    text, sampler = run(['a', 'c', 'd'], 'ab|cd', ['a', 'c', 'd'])
+    assert text == 'cd' and sampler.complete
+
+    # Sem saída também quando o caminho morto tem um laço (falta o 'y')
+    text, sampler = run(['x', 'a', 'z'], 'xa*y|z', ['x', 'a', 'z'])
+    assert text == 'z' and sampler.complete
+
+    # Caso do revisor: a chave "acao" não se completa sem o 'c'
+    vocab = list('{ "aoxtexto:,}') + ['"acao"', 'status']
+    text, sampler = run(vocab, VOICE_PATTERN, ['"', '{', ' ', 'a'], max_tokens=40)
+    assert sampler.complete
+    assert json.loads(text) == {'acao': 'status', 'texto': ''}
+
+
+def test_unsatisfiable_grammar_stops_incomplete():
+    text, sampler = run(['a', 'c'], 'ab', ['a', 'c'])
+    assert text == '' and not sampler.complete
+
+
+@pytest.fixture(scope='module')
+def model(tiny_gguf):
+    model = GGUFModelWrapper()
+    loaded = threading.Event()
+    model.load_model(str(tiny_gguf), lambda success, error=None: loaded.set())
+    assert loaded.wait(60)
+    yield model
+    model.close()
+
+
+def test_complete_constrained_on_a_tiny_model(model):
+    text = model.complete_constrained("Código: ", r'\d{3}-[a-c]', max_tokens=12)
+    assert CharAutomaton(r'\d{3}-[a-c]').fullmatch(text)
+
+
+def test_complete_constrained_drops_incomplete_text(model):
+    assert model.complete_constrained("Código: ", r'\d{3}-[a-c]', max_tokens=3) is None
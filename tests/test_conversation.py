@@ -0,0 +1,38 @@
+from conversation import ConversationContext
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def make_context(turns=10):
+    context = ConversationContext(count_tokens=count_words, persona="Persona.",
+                                  context_budget=1000)
+    for index in range(turns):
+        context.add_turn('user' if index % 2 == 0 else 'assistant', f"mensagem número {index}")
+    return context
+
+
+def test_small_budget_shrinks_only_that_prompt():
+    context = make_context()
+    full = context.build_prompt()
+    state = (context.window_start, context.window_tokens)
+
+    # Turno com cabeçalho: 4 palavras + quebra de linha; cabem os três últimos
+    short = context.build_prompt(budget=context.persona_tokens + 15)
+
+    assert "mensagem número 6" not in short
+    assert "mensagem número 7" in short and "mensagem número 9" in short
+    assert (context.window_start, context.window_tokens) == state
+    assert context.build_prompt() == full
+    assert "mensagem número 0" in full
+
+
+def test_context_budget_still_moves_the_window():
+    context = make_context()
+    context.context_budget = context.persona_tokens + 15
+    context.add_turn('user', "mensagem número 10")
+
+    assert context.window_start == 8
+    assert not context.in_window(7)
+    assert context.window_tokens == 15
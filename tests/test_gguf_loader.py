@@ -0,0 +1,36 @@
+import struct
+
+import pytest
+
+from conftest import N_VOCAB, write_tiny_gguf
+from gguf_loader import GGUFReader, SimpleGGUFModel
+
+
+def with_version(path, version):
+    data = bytearray(path.read_bytes())
+    data[4:8] = struct.pack('<I', version)
+    path.write_bytes(bytes(data))
+    return path
+
+
+@pytest.mark.parametrize('version', [2, 3])
+def test_supported_versions_load(tmp_path, version):
+    path = with_version(write_tiny_gguf(tmp_path / 'tiny.gguf'), version)
+
+    model = SimpleGGUFModel(str(path))
+    try:
+        assert model.load_model()
+        assert model.metadata['version'] == version
+        assert model.reader.version == version
+        assert model.tokenizer.vocab_size == N_VOCAB
+    finally:
+        model.reader.close()
+
+
+@pytest.mark.parametrize('version', [1, 4])
+def test_unsupported_versions_are_rejected(tmp_path, version):
+    path = with_version(write_tiny_gguf(tmp_path / 'tiny.gguf'), version)
+
+    assert not SimpleGGUFModel(str(path)).load_model()
+    with pytest.raises(ValueError):
+        GGUFReader(path)
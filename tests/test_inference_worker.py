@@ -0,0 +1,56 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from conftest import N_EMBD
+from inference_worker import InferenceWorker
+
+ROOT = Path(__file__).resolve().parent.parent
+PARAMS = {'max_tokens': 8, 'kv_window': 128, 'pattern_only': False, 'adapter': None}
+
+
+@pytest.fixture(scope='module')
+def worker(tiny_gguf):
+    worker = InferenceWorker(str(tiny_gguf), kv_window=128, ready_timeout=120)
+    worker.start()
+    yield worker
+    worker.stop()
+
+
+def test_main_does_not_import_the_app_in_spawned_children():
+    # O spawn executa o script principal de novo no filho como __mp_main__
+    code = (f"import runpy, sys; runpy.run_path({str(ROOT / 'main.py')!r}, run_name='__mp_main__'); "
+            "print(sorted(name for name in ('terlinet_app', 'kivy') if name in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            check=True, cwd=ROOT)
+    assert result.stdout.strip() == '[]'
+
+
+def test_worker_streams_tokens_through_the_ring_buffer(worker):
+    assert worker.alive
+    assert worker.report['backend'] == 'numpy'
+
+    pieces = list(worker.stream("Hello", 8, params=PARAMS))
+
+    # Cada token do vocabulário ASCII é um pedaço de texto
+    assert len(pieces) == 8
+    assert all(isinstance(piece, str) and piece for piece in pieces)
+
+
+def test_abandoned_stream_does_not_block_the_next_request(worker):
+    stream = worker.stream("Hello", 8, params=PARAMS)
+    next(stream)
+    stream.close()
+
+    assert len(list(worker.stream("abc", 4, params=dict(PARAMS, max_tokens=4)))) == 4
+
+
+def test_remote_calls_return_results_from_the_child(worker):
+    assert worker.call('embeddings_available') is True
+    vectors = worker.call('embed', ['olá', 'mundo'])
+    assert vectors.shape == (2, N_EMBD) and vectors.dtype == np.float32
+    with pytest.raises(RuntimeError):
+        worker.call('close')
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from conftest import HEAD_DIM, N_KV_HEADS
+from gguf_loader import GGUFModelWrapper, GGUFReader
+from numpy_engine import KVCache, NumpyEngine
+from resource_monitor import LEVEL_NORMAL, LEVEL_REDUCED, DegradationPolicy
+
+PROMPT = [3, 17, 42, 8, 8, 61, 5, 29, 77, 12]
+
+
+@pytest.fixture(scope='module')
+def engine(tiny_gguf):
+    reader = GGUFReader(tiny_gguf)
+    yield NumpyEngine(reader)
+    reader.close()
+
+
+def test_reduced_caches_track_float32_logits(engine):
+    report = engine.kv_accuracy(PROMPT, steps=24)
+
+    # Logits deste modelo vão até ~13: f16 erra ~0,3% e int8 ~6%
+    assert report['f16']['max_error'] < 0.05
+    assert report['f16']['top1_agreement'] == 1.0
+    assert report['f16']['max_error'] < report['int8']['max_error'] < 1.0
+    assert report['int8']['top1_agreement'] >= 0.95
+
+
+def test_reduced_caches_use_less_memory(engine):
+    report = engine.kv_accuracy(PROMPT, steps=2)
+    f32_bytes = KVCache(engine.config, 1, dtype='f32').nbytes
+
+    assert report['f16']['bytes_per_token'] * 2 == f32_bytes
+    assert report['int8']['bytes_per_token'] < f32_bytes / 3
+
+
+def test_int8_cache_round_trips_keys_and_values(engine):
+    shape = (1, N_KV_HEADS, len(PROMPT), HEAD_DIM)
+    rng = np.random.default_rng(1)
+    keys = rng.standard_normal(shape).astype(np.float32)
+    values = rng.standard_normal(shape).astype(np.float32)
+    cache = KVCache(engine.config, len(PROMPT), dtype='int8')
+
+    cache.update(0, keys, values)
+    restored_keys, restored_values = cache.read(0, 0, len(PROMPT))
+
+    # Escala por bloco de 32 valores: erro de até meio degrau
+    for original, restored in ((keys, restored_keys), (values, restored_values)):
+        blocks = original.reshape(shape[:-1] + (-1, cache.block))
+        step = np.abs(blocks).max(axis=-1, keepdims=True) / 127
+        error = np.abs(restored - original).reshape(blocks.shape)
+        assert np.all(error <= step * 0.51)
+
+
+def test_default_cache_is_f16_and_int8_only_under_pressure():
+    model = GGUFModelWrapper()
+    assert model.generation_params()['kv_dtype'] == 'f16'
+
+    model.resource_policy = DegradationPolicy()
+    model.resource_policy.level = LEVEL_REDUCED
+    assert model.generation_params()['kv_dtype'] == 'int8'
+    model.resource_policy.level = LEVEL_NORMAL
+    assert model.generation_params()['kv_dtype'] == 'f16'
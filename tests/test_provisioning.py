@@ -0,0 +1,141 @@
+import errno
+import os
+
+import numpy as np
+import pytest
+
+import integrity
+import provisioning
+from provisioning import (PART_SUFFIX, PROVISION_COPIED, PROVISION_MOVED, PROVISION_PRESENT,
+                          STATE_SUFFIX, ProvisioningError, provision)
+
+# Blocos pequenos: a cópia (COPY) não é múltipla do bloco de resumo (HASH)
+HASH = 4096
+COPY = 3000
+SIZE = 10 * HASH + 123
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(integrity, 'VERIFY_CHUNK', HASH)
+
+
+@pytest.fixture
+def cross_device(monkeypatch):
+    """rename falha com EXDEV, como entre o Download e a pasta do app"""
+    def rename(source, target):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+    monkeypatch.setattr(os, 'rename', rename)
+
+
+def write_source(path, seed=0, size=SIZE):
+    data = np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8).tobytes()
+    path.write_bytes(data)
+    return data
+
+
+def interrupted_copy(source, target, after):
+    """Importa até `after` bytes e simula o app encerrado no meio"""
+    def progress(copied, total):
+        if copied >= after:
+            raise Interrupted
+    with pytest.raises(Interrupted):
+        provision(str(source), str(target), progress, chunk_size=COPY)
+
+
+def assert_imported(source_data, target):
+    assert target.read_bytes() == source_data
+    assert not os.path.exists(str(target) + PART_SUFFIX)
+    assert not os.path.exists(str(target) + STATE_SUFFIX)
+    # O resumo gravado durante a cópia é o mesmo da verificação completa
+    assert integrity.expected_digest(str(target)) == integrity.file_digest(str(target), HASH)
+
+
+@pytest.mark.parametrize('chunk_size', [COPY, 2 * HASH, SIZE * 2])
+def test_fresh_copy(tmp_path, cross_device, chunk_size):
+    source, target = tmp_path / 'origem.gguf', tmp_path / 'modelo' / 'modelo.gguf'
+    data = write_source(source)
+    calls = []
+
+    result = provision(str(source), str(target), lambda *args: calls.append(args),
+                       chunk_size=chunk_size)
+
+    assert result == PROVISION_COPIED
+    assert source.exists()
+    assert_imported(data, target)
+    assert calls[-1] == (SIZE, SIZE)
+    assert [copied for copied, _ in calls] == sorted(copied for copied, _ in calls)
+
+
+def test_copy_resumes_after_a_truncated_part(tmp_path, cross_device):
+    source, target = tmp_path / 'origem.gguf', tmp_path / 'modelo.gguf'
+    data = write_source(source)
+    interrupted_copy(source, target, after=6 * COPY)
+    part = str(target) + PART_SUFFIX
+
+    # Só parte do último bloco chegou ao disco antes do encerramento
+    os.truncate(part, 5 * COPY - 700)
+    calls = []
+    result = provision(str(source), str(target), lambda *args: calls.append(args),
+                       chunk_size=COPY)
+
+    assert result == PROVISION_COPIED
+    assert calls[0][0] == 5 * COPY - 700 + COPY
+    assert_imported(data, target)
+
+
+def test_changed_source_restarts_the_copy(tmp_path, cross_device):
+    source, target = tmp_path / 'origem.gguf', tmp_path / 'modelo.gguf'
+    write_source(source)
+    interrupted_copy(source, target, after=4 * COPY)
+
+    # Mesmo tamanho, conteúdo e data diferentes
+    data = write_source(source, seed=1)
+    stat = os.stat(source)
+    os.utime(source, (stat.st_atime, stat.st_mtime + 10))
+    calls = []
+    provision(str(source), str(target), lambda *args: calls.append(args), chunk_size=COPY)
+
+    assert calls[0][0] == COPY
+    assert_imported(data, target)
+
+
+def test_source_digest_mismatch_is_rejected(tmp_path, cross_device):
+    source, target = tmp_path / 'origem.gguf', tmp_path / 'modelo.gguf'
+    write_source(source)
+    integrity.write_digest(str(source), '0' * 64)
+
+    with pytest.raises(ProvisioningError):
+        provision(str(source), str(target), chunk_size=COPY)
+    assert not target.exists()
+    assert not os.path.exists(str(target) + PART_SUFFIX)
+
+
+def test_same_filesystem_moves_and_then_finds_the_model(tmp_path):
+    source, target = tmp_path / 'origem.gguf', tmp_path / 'modelo' / 'modelo.gguf'
+    data = write_source(source)
+    integrity.write_digest(str(source), integrity.file_digest(str(source), HASH))
+
+    assert provision(str(source), str(target)) == PROVISION_MOVED
+    assert not source.exists()
+    assert_imported(data, target)
+    write_source(source)
+    assert provision(str(source), str(target)) == PROVISION_PRESENT
+    assert source.exists()
+
+
+def test_move_reports_exdev_and_raises_other_errors(tmp_path, monkeypatch):
+    errors = iter([errno.EXDEV, errno.EACCES])
+
+    def rename(source, target):
+        code = next(errors)
+        raise OSError(code, os.strerror(code))
+    monkeypatch.setattr(os, 'rename', rename)
+
+    assert provisioning._move(str(tmp_path / 'a'), str(tmp_path / 'b')) is False
+    with pytest.raises(PermissionError):
+        provisioning._move(str(tmp_path / 'a'), str(tmp_path / 'b'))
@@ -0,0 +1,39 @@
+from conversation import ConversationContext
+from gguf_loader import GGUFModelWrapper
+from retrieval import USER_TURN_PREFIX, RetrievalIndex, conversation_source
+
+
+def test_only_user_turns_are_indexed_with_their_author():
+    index = RetrievalIndex()
+    context = ConversationContext()
+    context.add_listener(index.add_message)
+
+    context.add_turn('user', "minha bicicleta é azul")
+    context.add_turn('assistant', "sua bicicleta é vermelha")
+
+    assert index.texts == [f"{USER_TURN_PREFIX} minha bicicleta é azul"]
+    assert index.sources == [conversation_source(context.session_id, 0)]
+
+
+def test_router_replies_never_reach_the_index():
+    model = GGUFModelWrapper()
+    index = RetrievalIndex()
+    model.attach_retrieval(index)
+
+    reply = "".join(model.generate_stream("olá"))
+
+    assert reply and model.route_counts
+    assert index.texts == [f"{USER_TURN_PREFIX} olá"]
+
+
+def test_unattributed_turns_from_old_indexes_are_not_retrieved():
+    model = GGUFModelWrapper()
+    index = RetrievalIndex()
+    model.attach_retrieval(index)
+    index.add_document("a bicicleta é vermelha", conversation_source('antiga', 1))
+    index.add_document("a bicicleta é azul", conversation_source('antiga', 2),
+                       prefix=USER_TURN_PREFIX)
+    index.add_document("a bicicleta é verde", 'notas/bicicleta.txt')
+
+    assert sorted(model.retrieve("bicicleta")) == [
+        f"{USER_TURN_PREFIX} a bicicleta é azul", "a bicicleta é verde"]
@@ -0,0 +1,68 @@
+import numpy as np
+
+from conftest import silence, speech
+from speech_backend import FileTranscriptBackend, SimulatedSTTBackend
+from voice_activity import VoiceActivityDetector, WavAudioSource, capture_utterance
+
+TRANSCRIPT = "ligar a luz da sala"
+
+
+def test_partials_grow_with_audio_and_final_is_complete():
+    backend = FileTranscriptBackend(TRANSCRIPT, words_per_second=2.5)
+    backend.start()
+    chunk = np.zeros(1600, dtype=np.int16)
+
+    partials = [backend.accept_chunk(chunk) for _ in range(20)]
+
+    # 2,5 palavras/s: uma palavra nova a cada 0,4 s (4 pedaços de 100 ms)
+    assert partials[2] == ""
+    assert partials[3] == "ligar"
+    assert partials[7] == "ligar a"
+    assert partials[-1] == TRANSCRIPT
+    assert all(later.startswith(earlier) for earlier, later in zip(partials, partials[1:]))
+    assert backend.finish() == TRANSCRIPT
+
+
+def test_final_is_complete_before_all_words_are_revealed():
+    backend = FileTranscriptBackend(TRANSCRIPT)
+    backend.start()
+    assert backend.accept_chunk(np.zeros(800, dtype=np.int16)) == ""
+    assert backend.finish() == TRANSCRIPT
+
+
+def test_start_resets_between_utterances():
+    backend = FileTranscriptBackend(TRANSCRIPT)
+    backend.start()
+    backend.accept_chunk(np.zeros(16000, dtype=np.int16))
+    backend.start()
+    assert backend.finish() == ""
+    assert SimulatedSTTBackend().finish() == ""
+
+
+def test_for_wav_reads_transcript_beside_the_audio(make_wav):
+    path = make_wav(speech(500), transcript=TRANSCRIPT + "\n")
+    assert FileTranscriptBackend.for_wav(str(path)).words == TRANSCRIPT.split()
+
+
+def test_capture_feeds_pre_roll_and_onset_to_the_backend(make_wav):
+    path = make_wav(silence(500), speech(2000), silence(600), transcript=TRANSCRIPT)
+    backend = FileTranscriptBackend.for_wav(str(path))
+    detector = VoiceActivityDetector()
+    fed, partials = [], []
+
+    def feed(frames):
+        fed.append(frames.ravel().copy())
+        partials.append(backend.accept_chunk(frames.ravel()))
+
+    backend.start()
+    source = WavAudioSource(path)
+    try:
+        utterance = capture_utterance(source, detector, on_frames=feed)
+    finally:
+        source.close()
+    fed = np.concatenate(fed)
+
+    # O STT recebe o trecho falado desde o pré-roll, sem perder o início
+    assert np.array_equal(fed[:len(utterance)], utterance)
+    assert partials[-1] == TRANSCRIPT
+    assert backend.finish() == TRANSCRIPT
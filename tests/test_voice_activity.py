@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from conftest import silence, speech
+from voice_activity import AudioRingBuffer, VoiceActivityDetector, WavAudioSource, capture_utterance
+
+FRAME_MS = 20
+
+
+def capture(path, **kwargs):
+    detector = VoiceActivityDetector()
+    source = WavAudioSource(path)
+    try:
+        utterance = capture_utterance(source, detector, **kwargs)
+    finally:
+        source.close()
+    return detector, utterance
+
+
+def test_ring_buffer_wraps_around():
+    ring = AudioRingBuffer(8)
+    ring.write(np.arange(6))
+    ring.write(np.arange(6, 12))
+    assert ring.oldest == 4
+    assert ring.read(4, 8).tolist() == list(range(4, 12))
+    with pytest.raises(IndexError):
+        ring.read(2, 4)
+
+
+def test_speech_between_silences(make_wav):
+    path = make_wav(silence(500), speech(800), silence(600))
+    detector, utterance = capture(path)
+
+    assert detector.ended
+    assert detector.speech_start_frame == 500 // FRAME_MS
+    assert detector.speech_end_frame == (500 + 800) // FRAME_MS
+    # Fala mais o pré-roll de 100 ms
+    assert len(utterance) == (800 + 100) * 16
+
+
+def test_speech_starting_at_first_frame(make_wav):
+    path = make_wav(speech(800), silence(600))
+    detector, utterance = capture(path)
+
+    assert detector.speech_start_frame == 0
+    assert detector.speech_end_frame == 800 // FRAME_MS
+    assert len(utterance) == 800 * 16
+    # A fala não pode ter virado o piso de ruído
+    assert detector.noise_floor_db < -55
+
+
+def test_silence_times_out_without_speech(make_wav):
+    path = make_wav(silence(6000))
+    detector, utterance = capture(path)
+
+    assert detector.ended
+    assert not detector.speech_started
+    assert detector.frames_seen == detector.no_speech_timeout_frames
+    assert len(utterance) == 0
+
+
+def test_speech_cut_at_max_duration(make_wav):
+    path = make_wav(silence(200), speech(9000), silence(600))
+    detector, utterance = capture(path)
+
+    assert detector.speech_end_frame == detector.max_frames
+    assert len(utterance) == (detector.max_frames - 200 // FRAME_MS + 100 // FRAME_MS) * 320
+
+
+def test_high_frequency_noise_is_not_speech(make_wav):
+    rng = np.random.default_rng(1)
+    # Chiado: muitos cruzamentos por zero e energia só um pouco acima do limiar
+    hiss = rng.standard_normal(16 * 800) * 150
+    path = make_wav(silence(300), hiss, silence(300))
+    detector, _ = capture(path)
+
+    assert not detector.speech_started
+
+
+def test_cancelled_capture_stops_reading(make_wav):
+    path = make_wav(silence(300), speech(2000), silence(600))
+    source = WavAudioSource(path)
+    detector = VoiceActivityDetector()
+    reads = []
+    original_read = source.read
+
+    def read(count):
+        reads.append(count)
+        return original_read(count)
+
+    source.read = read
+    try:
+        capture_utterance(source, detector, cancelled=lambda: len(reads) >= 40)
+    finally:
+        source.close()
+
+    assert len(reads) == 40
+    assert detector.speech_started and not detector.ended
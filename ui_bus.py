@@ -0,0 +1,158 @@
+"""
+Barramento de atualizações de UI do TerlineT
+Threads de trabalho publicam eventos tipados numa fila; um único callback
+do Clock por quadro drena a fila, mescla atualizações redundantes e aplica
+tudo de uma vez na thread principal
+"""
+
+import queue
+from collections import namedtuple
+
+import profiler
+
+# Eventos suportados
+AddMessage = namedtuple('AddMessage', 'sender message')
+SetStatus = namedtuple('SetStatus', 'text')
+SetSendEnabled = namedtuple('SetSendEnabled', 'enabled')
+Speak = namedtuple('Speak', 'text')
+Call = namedtuple('Call', 'func args')
+BeginStream = namedtuple('BeginStream', 'sender')
+AppendStream = namedtuple('AppendStream', 'text')
+EndStream = namedtuple('EndStream', '')
+
+
+class UIUpdateBus:
+    """Fila thread-safe de atualizações aplicadas em lote a cada quadro
+
+    O alvo precisa oferecer `add_messages(lista)`, `speak(texto)`,
+    `begin_stream`/`append_stream`/`end_stream` e as propriedades
+    `status_text` e `send_enabled`.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self._queue = queue.SimpleQueue()
+        self._clock_event = None
+
+        # Estatísticas simples
+        self.events_posted = 0
+        self.events_applied = 0
+        self.batches_applied = 0
+
+    def start(self):
+        """Registra o callback de drenagem no Clock do Kivy"""
+        from kivy.clock import Clock
+
+        if self._clock_event is None:
+            self._clock_event = Clock.schedule_interval(self.drain, 0)
+
+    def stop(self):
+        if self._clock_event is not None:
+            self._clock_event.cancel()
+            self._clock_event = None
+
+    def post(self, event):
+        """Publica um evento (pode ser chamado de qualquer thread)"""
+        self.events_posted += 1
+        self._queue.put(event)
+
+    def add_message(self, sender, message):
+        self.post(AddMessage(sender, message))
+
+    def set_status(self, text):
+        self.post(SetStatus(text))
+
+    def set_send_enabled(self, enabled):
+        self.post(SetSendEnabled(enabled))
+
+    def speak(self, text):
+        self.post(Speak(text))
+
+    def begin_stream(self, sender):
+        self.post(BeginStream(sender))
+
+    def append_stream(self, text):
+        self.post(AppendStream(text))
+
+    def end_stream(self):
+        self.post(EndStream())
+
+    def call(self, func, *args):
+        """Executa uma função arbitrária na thread principal, em ordem"""
+        self.post(Call(func, args))
+
+    def drain(self, dt=None) -> int:
+        """Aplica todos os eventos pendentes e retorna quantos foram processados"""
+        events = []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not events:
+            return 0
+
+        with profiler.span('ui.drain'):
+            self._apply_events(events)
+        profiler.count('ui.events', len(events))
+        self.events_applied += len(events)
+        return len(events)
+
+    def _apply_events(self, events):
+        pending = _PendingBatch()
+        for event in events:
+            if isinstance(event, AddMessage):
+                pending.messages.append((event.sender, event.message))
+            elif isinstance(event, SetStatus):
+                pending.status = event.text
+            elif isinstance(event, SetSendEnabled):
+                pending.send_enabled = event.enabled
+            elif isinstance(event, Speak):
+                pending.speak = event.text
+            elif isinstance(event, AppendStream):
+                pending.stream.append(event.text)
+            else:
+                # Eventos ordenados dependem do estado anterior: aplica antes
+                self._apply(pending)
+                pending = _PendingBatch()
+                if isinstance(event, BeginStream):
+                    self.target.begin_stream(event.sender)
+                elif isinstance(event, EndStream):
+                    self.target.end_stream()
+                else:
+                    event.func(*event.args)
+        self._apply(pending)
+
+    def _apply(self, pending):
+        if pending.empty:
+            return
+        self.batches_applied += 1
+        if pending.messages:
+            self.target.add_messages(pending.messages)
+        if pending.stream:
+            # Vários tokens do mesmo quadro viram um único append
+            self.target.append_stream("".join(pending.stream))
+        if pending.speak is not None:
+            self.target.speak(pending.speak)
+        if pending.status is not None:
+            self.target.status_text = pending.status
+        if pending.send_enabled is not None:
+            self.target.send_enabled = pending.send_enabled
+
+
+class _PendingBatch:
+    """Atualizações mescladas entre duas chamadas ordenadas"""
+
+    __slots__ = ('messages', 'stream', 'status', 'send_enabled', 'speak')
+
+    def __init__(self):
+        self.messages = []
+        self.stream = []
+        self.status = None
+        self.send_enabled = None
+        self.speak = None
+
+    @property
+    def empty(self):
+        return (not self.messages and not self.stream and self.status is None
+                and self.send_enabled is None and self.speak is None)
@@ -0,0 +1,282 @@
+"""
+Detecção de atividade de voz (VAD) para o TerlineT
+Processa quadros PCM de 10-30 ms a partir de um buffer circular NumPy
+pré-alocado e encerra a gravação assim que detecta silêncio no final da fala
+"""
+
+import wave
+from typing import Callable, Optional
+
+import numpy as np
+
+import profiler
+
+# Configurações padrão de captura
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+PCM_FULL_SCALE = 32768.0
+
+
+class AudioRingBuffer:
+    """Buffer circular pré-alocado de amostras PCM int16"""
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("Capacidade do buffer deve ser positiva")
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        # Posição absoluta (em amostras) do próximo write
+        self.total_written = 0
+
+    def clear(self):
+        self.total_written = 0
+
+    @property
+    def oldest(self) -> int:
+        """Posição absoluta da amostra mais antiga ainda disponível"""
+        return max(0, self.total_written - self.capacity)
+
+    def write(self, samples: np.ndarray):
+        """Copia amostras para o buffer sem realocar memória"""
+        samples = np.asarray(samples, dtype=np.int16).ravel()
+        count = samples.shape[0]
+        if count == 0:
+            return
+
+        end = self.total_written + count
+        if count > self.capacity:
+            samples = samples[-self.capacity:]
+        start = (end - samples.shape[0]) % self.capacity
+        first = min(samples.shape[0], self.capacity - start)
+        self.buffer[start:start + first] = samples[:first]
+        if first < samples.shape[0]:
+            self.buffer[:samples.shape[0] - first] = samples[first:]
+        self.total_written = end
+
+    def read(self, start: int, count: int) -> np.ndarray:
+        """Lê `count` amostras a partir da posição absoluta `start`"""
+        if start < self.oldest or start + count > self.total_written:
+            raise IndexError("Intervalo fora do buffer circular")
+        begin = start % self.capacity
+        if begin + count <= self.capacity:
+            return self.buffer[begin:begin + count]
+        first = self.capacity - begin
+        return np.concatenate((self.buffer[begin:], self.buffer[:count - first]))
+
+    def read_frames(self, start: int, frame_count: int, frame_len: int) -> np.ndarray:
+        """Retorna os quadros como matriz (frame_count, frame_len)"""
+        return self.read(start, frame_count * frame_len).reshape(frame_count, frame_len)
+
+
+class VoiceActivityDetector:
+    """Endpointing por energia e taxa de cruzamentos por zero
+
+    O piso de ruído começa em `min_energy_db` - `energy_margin_db` e só se
+    adapta com quadros sem fala, então uma fala que começa no primeiro quadro
+    não vira o piso.
+    """
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, frame_ms: int = FRAME_MS,
+                 energy_margin_db: float = 10.0, min_energy_db: float = -50.0,
+                 zcr_max: float = 0.35, speech_start_ms: int = 60,
+                 trailing_silence_ms: int = 300, no_speech_timeout_ms: int = 5000,
+                 max_duration_ms: int = 8000, noise_adapt: float = 0.05):
+        if not 10 <= frame_ms <= 30:
+            raise ValueError("Quadros devem ter entre 10 e 30 ms")
+
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_len = sample_rate * frame_ms // 1000
+        self.energy_margin_db = energy_margin_db
+        self.min_energy_db = min_energy_db
+        self.zcr_max = zcr_max
+        self.noise_adapt = noise_adapt
+
+        # Limiares convertidos para número de quadros
+        self.speech_start_frames = max(1, speech_start_ms // frame_ms)
+        self.trailing_silence_frames = max(1, trailing_silence_ms // frame_ms)
+        self.no_speech_timeout_frames = max(1, no_speech_timeout_ms // frame_ms)
+        self.max_frames = max(1, max_duration_ms // frame_ms)
+
+        self.reset()
+
+    def reset(self):
+        """Prepara o detector para uma nova gravação"""
+        self.noise_floor_db = self.min_energy_db - self.energy_margin_db
+        self.frames_seen = 0
+        self.speech_run = 0
+        self.silence_run = 0
+        self.speech_started = False
+        self.speech_start_frame = None
+        self.speech_end_frame = None
+        self.ended = False
+
+    @staticmethod
+    def frame_features(frames: np.ndarray):
+        """Calcula energia (dBFS) e taxa de cruzamentos por zero por quadro"""
+        samples = frames.astype(np.float32) / PCM_FULL_SCALE
+        power = np.mean(samples * samples, axis=1)
+        energy_db = 10.0 * np.log10(power + 1e-10)
+        crossings = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1)
+        zcr = crossings / float(frames.shape[1] - 1)
+        return energy_db, zcr
+
+    def classify(self, energy_db: np.ndarray, zcr: np.ndarray) -> np.ndarray:
+        """Marca os quadros que contêm fala"""
+        threshold = max(self.noise_floor_db + self.energy_margin_db, self.min_energy_db)
+        loud = energy_db > threshold
+        # Ruído de alta frequência só conta como fala se for bem mais forte
+        very_loud = energy_db > threshold + self.energy_margin_db
+        return loud & ((zcr < self.zcr_max) | very_loud)
+
+    def process(self, frames: np.ndarray) -> bool:
+        """Processa um lote de quadros e retorna True quando a fala terminou"""
+        if self.ended or frames.shape[0] == 0:
+            return self.ended
+
+        with profiler.span('voice.vad'):
+            return self._process(frames)
+
+    def _process(self, frames: np.ndarray) -> bool:
+        energy_db, zcr = self.frame_features(frames)
+        is_speech = self.classify(energy_db, zcr)
+
+        # Atualiza o piso de ruído com os quadros sem fala
+        silent = energy_db[~is_speech]
+        if silent.size:
+            self.noise_floor_db += self.noise_adapt * (float(np.mean(silent)) - self.noise_floor_db)
+
+        for speech in is_speech:
+            self.frames_seen += 1
+            if speech:
+                self.speech_run += 1
+                self.silence_run = 0
+                if not self.speech_started and self.speech_run >= self.speech_start_frames:
+                    self.speech_started = True
+                    self.speech_start_frame = self.frames_seen - self.speech_run
+            else:
+                self.speech_run = 0
+                self.silence_run += 1
+
+            if self.speech_started and self.silence_run >= self.trailing_silence_frames:
+                self.speech_end_frame = self.frames_seen - self.silence_run
+                self.ended = True
+            elif not self.speech_started and self.frames_seen >= self.no_speech_timeout_frames:
+                self.ended = True
+            elif self.frames_seen >= self.max_frames:
+                if self.speech_started:
+                    self.speech_end_frame = self.frames_seen
+                self.ended = True
+
+            if self.ended:
+                break
+
+        return self.ended
+
+
+class WavAudioSource:
+    """Fonte de áudio lida de um arquivo WAV PCM de 16 bits"""
+
+    def __init__(self, path: str):
+        self._wav = wave.open(str(path), 'rb')
+        if self._wav.getsampwidth() != 2:
+            self._wav.close()
+            raise ValueError("Apenas WAV PCM de 16 bits é suportado")
+        self.sample_rate = self._wav.getframerate()
+        self.channels = self._wav.getnchannels()
+
+    def read(self, count: int) -> Optional[np.ndarray]:
+        data = self._wav.readframes(count)
+        if not data:
+            return None
+        samples = np.frombuffer(data, dtype='<i2')
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1).astype(np.int16)
+        return samples
+
+    def close(self):
+        self._wav.close()
+
+
+class MicrophoneAudioSource:
+    """Fonte de áudio do microfone via PyAudio"""
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, frame_ms: int = FRAME_MS):
+        import pyaudio
+
+        self.sample_rate = sample_rate
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(format=pyaudio.paInt16, channels=1, rate=sample_rate,
+                                     input=True,
+                                     frames_per_buffer=sample_rate * frame_ms // 1000)
+
+    def read(self, count: int) -> Optional[np.ndarray]:
+        data = self._stream.read(count, exception_on_overflow=False)
+        return np.frombuffer(data, dtype=np.int16)
+
+    def close(self):
+        self._stream.stop_stream()
+        self._stream.close()
+        self._pa.terminate()
+
+
+def open_default_source() -> Optional[MicrophoneAudioSource]:
+    """Abre o microfone padrão, ou retorna None se não houver captura disponível"""
+    try:
+        return MicrophoneAudioSource()
+    except Exception:
+        return None
+
+
+def capture_utterance(source, detector: VoiceActivityDetector,
+                      ring: Optional[AudioRingBuffer] = None,
+                      on_frames: Optional[Callable[[np.ndarray], None]] = None,
+                      pre_roll_ms: int = 100,
+                      cancelled: Optional[Callable[[], bool]] = None) -> np.ndarray:
+    """Lê a fonte até o detector encontrar o fim da fala e retorna o trecho falado
+
+    `cancelled()` é consultado a cada quadro; se retornar True a captura
+    para e retorna o que foi gravado até ali.
+    """
+    detector.reset()
+    frame_len = detector.frame_len
+    pre_roll_frames = pre_roll_ms // detector.frame_ms
+
+    if ring is None:
+        ring = AudioRingBuffer((detector.max_frames + pre_roll_frames + 1) * frame_len)
+    ring.clear()
+
+    processed = 0
+    while not detector.ended:
+        if cancelled is not None and cancelled():
+            break
+        chunk = source.read(frame_len)
+        if chunk is None or chunk.shape[0] == 0:
+            break
+        ring.write(chunk)
+
+        ready = (ring.total_written - processed) // frame_len
+        if ready == 0:
+            continue
+        frames = ring.read_frames(processed, ready, frame_len)
+        processed += ready * frame_len
+        was_speaking = detector.speech_started
+        detector.process(frames)
+        if on_frames is None or not detector.speech_started:
+            continue
+        if not was_speaking:
+            # A fala começou neste lote: o STT recebe também o pré-roll e os
+            # quadros do início da fala, anteriores à confirmação do VAD
+            first = max(ring.oldest // frame_len, detector.speech_start_frame - pre_roll_frames)
+            frames = ring.read_frames(first * frame_len, processed // frame_len - first, frame_len)
+        on_frames(frames)
+
+    if detector.speech_start_frame is None:
+        return np.zeros(0, dtype=np.int16)
+
+    end_frame = detector.speech_end_frame
+    if end_frame is None:
+        end_frame = processed // frame_len
+    start = max(ring.oldest, (detector.speech_start_frame - pre_roll_frames) * frame_len)
+    end = end_frame * frame_len
+    return ring.read(start, end - start).copy()